@@ -0,0 +1,76 @@
+"""
+Benchmark the diff stage on a synthetic access switch config.
+
+    difflib: difflib.unified_diff over the config lines
+    ncc:     `ncc.diff.line_diff` and `unified_diff`, then `sections`
+
+A number of lines scattered over the config are changed, the way a
+VLAN or description change touches many interfaces.  The number of
+changed lines each diff reports is printed too: difflib's autojunk
+treats lines like '!' as junk and lumps changes together.
+
+Usage:
+    python bench/bench_diff.py [--ports 8000] [--changes 20]
+
+"""
+
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+
+def synthetic_config(ports):
+    lines = ["hostname sw1", "!"]
+    for i in range(ports):
+        lines += [
+            "interface GigabitEthernet{}/0/{}".format(i // 48 + 1, i % 48 + 1),
+            " description port {}".format(i),
+            " switchport access vlan {}".format(i % 40 + 10),
+            " spanning-tree portfast",
+            "!",
+        ]
+    return lines + ["end"]
+
+
+def main():
+    from ncc import diff
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ports", type=int, default=8000)
+    parser.add_argument("--changes", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(1)
+    old = synthetic_config(args.ports)
+    new = list(old)
+    for k in random.sample(range(len(new)), args.changes):
+        new[k] += " changed"
+
+    t0 = time.perf_counter()
+    ref = "".join(difflib.unified_diff(old, new, "a", "b", lineterm="\n"))
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    codes = diff.line_diff(old, new)
+    out = diff.unified_diff(old, new, codes, "a", "b")
+    t_ncc = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    found = diff.sections(new, [j for tag, _, _, j1, j2 in codes if tag != "equal" for j in range(j1, j2)], 1)
+    t_sections = time.perf_counter() - t0
+
+    print("{} lines, {} changed".format(len(old), args.changes))
+    print("{:>8} {:>10} {:>14}".format("diff", "seconds", "lines added"))
+    print("{:>8} {:>10.3f} {:>14}".format("difflib", t_ref, ref.count("\n+") - 1))
+    print("{:>8} {:>10.3f} {:>14}".format("ncc", t_ncc, out.count("\n+") - 1))
+    print("sections: {} in {:.3f}s".format(len(found), t_sections))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark thread mode vs async mode collection against the mock SSH server.
+
+Both modes run `collect.configs` on a nornir inventory of simulated IOS
+devices, the way `ncc.py run --engine thread|async` does:
+
+    thread: nornir's thread pool, NAPALM/netmiko sessions typing
+            `show run`, `show inventory` and `show version` at the
+            mock server's prompt
+    async:  the async engine, asyncssh exec requests for the same
+            commands
+
+`--workers` is the concurrency of both, as `ncc.py --workers` is.  Each
+measurement runs in its own process so peak RSS is comparable.
+
+Usage:
+    python bench/bench_engines.py [--latency 0.05] [--workers 1000] [--devices 100 1000 5000]
+
+Requires asyncssh, napalm and nornir.
+
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+
+def use_port(port):
+    "Point NAPALM drivers at the mock server's `port`, thread mode connects to port 22 otherwise."
+    import napalm
+
+    get_network_driver = napalm.get_network_driver
+
+    def get_driver(name):
+        driver = get_network_driver(name)
+
+        class Driver(driver):
+            def __init__(self, *args, **kwargs):
+                kwargs["optional_args"] = dict(kwargs.get("optional_args") or {}, port=port)
+                super().__init__(*args, **kwargs)
+
+        return Driver
+
+    napalm.get_network_driver = get_driver
+
+
+def inventory(devices, port, workers):
+    "Nornir object with `devices` simulated IOS devices on the mock server."
+    from nornir.core import Nornir
+    from nornir.core.deserializer.configuration import Config
+    from nornir.core.inventory import Defaults, Groups, Host, Hosts, Inventory
+    from nornir.core.state import GlobalState
+
+    defaults = Defaults()
+    hosts = Hosts({
+        "sim{}".format(i): Host(
+            "sim{}".format(i), hostname="127.0.0.1", port=port, username="bench", password="bench",
+            platform="ios", data={"site": "bench"}, defaults=defaults)
+        for i in range(devices)
+    })
+    return Nornir(
+        inventory=Inventory(hosts=hosts, groups=Groups(), defaults=defaults),
+        config=Config.deserialize(core={"num_workers": workers}),
+        data=GlobalState(),
+    )
+
+
+def child(mode, devices, port, workers):
+    from ncc import collect
+    from ncc.libs.transport.limits import limiter
+
+    use_port(port)
+    limiter.configure(workers=workers)
+    nr = inventory(devices, port, workers)
+
+    t0 = time.perf_counter()
+    _, results = collect.configs(nr, True, 0, num_workers=workers, engine=mode)
+    elapsed = time.perf_counter() - t0
+
+    print(json.dumps({
+        "seconds": elapsed,
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "failed": len(results.failed_hosts),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=1000)
+    parser.add_argument("--devices", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, devices, port, workers = args.child
+        return child(mode, int(devices), int(port), int(workers))
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_ssh.py"), "--port", "0", "--latency", str(args.latency)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    try:
+        port = server.stdout.readline().strip().rsplit(":", 1)[1]
+
+        print("{:>8} {:>8} {:>8} {:>10} {:>12} {:>8}".format(
+            "devices", "workers", "mode", "seconds", "peak RSS MB", "failed"))
+        for n in args.devices:
+            workers = min(n, args.workers)
+            for mode in ("thread", "async"):
+                out = subprocess.check_output(
+                    [sys.executable, __file__, "--child", mode, str(n), port, str(workers)],
+                    universal_newlines=True,
+                )
+                r = json.loads(out.strip().splitlines()[-1])
+                print("{:>8} {:>8} {:>8} {:>10.2f} {:>12.1f} {:>8}".format(
+                    n, workers, mode, r["seconds"], r["maxrss_mb"], r["failed"]))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cold-start import time report, in the style of `python -X importtime`.
+
+Each scenario runs in a fresh interpreter with `-X importtime`, the
+self times of every module it imports are summed, and the best of
+`--runs` runs is kept.  The slowest modules of the first scenario are
+listed so regressions are easy to spot.
+
+Scenarios:
+    startup       `ncc.py` itself, what `ncc.py --help` pays before any
+                  command runs
+    run           startup, then the modules `run` imports before
+                  collecting
+    + ios         run, then the first IOS host (loads one driver)
+    + all         run, then one host of every platform
+
+Usage:
+    python bench/bench_import.py [--runs 5] [--top 15]
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, "..")
+
+# the module level of ncc.py, without running the command line
+STARTUP = "import runpy; runpy.run_path('ncc.py')"
+RUN = STARTUP + "; import ncc.collect, ncc.schedule, nornir, ncc.libs.inventory.init_nornir, ncc.libs.inventory.netbox"
+
+SCENARIOS = [
+    ("startup", STARTUP),
+    ("run", RUN),
+    ("+ ios", RUN + "; from ncc.platforms import get_platform; get_platform('ios')"),
+    ("+ all", RUN + "; from ncc.platforms import get_platform, PLATFORMS; [get_platform(p) for p in PLATFORMS]"),
+]
+
+
+def importtime(code):
+    """
+    Run `code` in a new interpreter with `-X importtime`.
+
+    Returns
+    -------
+    list of (self_us, cumulative_us, module)
+
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), int(cumulative_us), name.rstrip()))
+
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    print("{:<10} {:>10} {:>9}".format("scenario", "total (ms)", "modules"))
+    slowest = None
+    for name, code in SCENARIOS:
+        try:
+            runs = [importtime(code) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print("{:<10} failed: {}".format(name, e))
+            continue
+
+        best = min(runs, key=lambda modules: sum(m[0] for m in modules))
+        print("{:<10} {:>10.1f} {:>9}".format(name, sum(m[0] for m in best) / 1000.0, len(best)))
+        if slowest is None:
+            slowest = best
+
+    if slowest:
+        print("")
+        print("slowest imports at startup (cumulative):")
+        print("{:>10}  {}".format("ms", "module"))
+        top_level = [m for m in slowest if not m[2].startswith("  ")]
+        for self_us, cumulative_us, module in sorted(top_level, reverse=True, key=lambda m: m[1])[:args.top]:
+            print("{:>10.1f}  {}".format(cumulative_us / 1000.0, module.strip()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark `NBInventory` loading against the local fake NetBox server:
+one `limit=0` request for the whole fleet vs paged, concurrent loading.
+
+The fake server runs in its own process and each load in another, so
+peak RSS is that of the inventory loader alone.
+
+Usage:
+    python bench/bench_netbox.py [--devices 50000] [--page-size 1000] [--page-workers 4]
+
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+
+def child(url, page_size, page_workers):
+    from ncc.libs.inventory.netbox import NBInventory
+
+    t0 = time.perf_counter()
+    inv = NBInventory(nb_url=url, nb_token="bench", page_size=page_size, page_workers=page_workers)
+    elapsed = time.perf_counter() - t0
+
+    print(json.dumps({
+        "seconds": elapsed,
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "hosts": len(inv.hosts),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=50000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-device", type=float, default=0.00002)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--page-workers", type=int, default=4)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        url, page_size, page_workers = args.child
+        return child(url, int(page_size), int(page_workers))
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_netbox.py"), "--port", "0",
+         "--devices", str(args.devices), "--latency", str(args.latency), "--per-device", str(args.per_device)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    try:
+        url = server.stdout.readline().strip().split()[-1]
+
+        print("{:>8} {:>10} {:>8} {:>10} {:>12} {:>8}".format(
+            "devices", "page size", "workers", "seconds", "peak RSS MB", "hosts"))
+        for page_size, page_workers in ((0, 1), (args.page_size, 1), (args.page_size, args.page_workers)):
+            out = subprocess.check_output(
+                [sys.executable, __file__, "--child", url, str(page_size), str(page_workers)],
+                universal_newlines=True,
+            )
+            r = json.loads(out.strip().splitlines()[-1])
+            print("{:>8} {:>10} {:>8} {:>10.2f} {:>12.1f} {:>8}".format(
+                args.devices, page_size or "all", page_workers, r["seconds"], r["maxrss_mb"], r["hosts"]))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
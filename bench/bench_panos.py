@@ -0,0 +1,152 @@
+"""
+Benchmark `PaloaltoPanos.get_config` on a synthetic PAN-OS running config.
+
+    legacy: xmltodict.parse, json.dumps(indent=2), then the regex secrets
+    stream:  `ncc.libs.xmljson.xml_to_json` with structural redaction
+
+The config is laid out like `show config running` output: address
+objects, security rules, local users with password hashes and IKE
+gateways with pre-shared keys, pretty printed.  Both pipelines must
+give the same JSON when secrets are not hidden.
+
+Each measurement runs in its own process so peak RSS is comparable.
+
+Usage:
+    python bench/bench_panos.py [--size-mb 50]
+
+Requires xmltodict.
+
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+# the regex redaction get_config used before streaming
+LEGACY_SECRETS = [
+    (r'(phash":) "\S+(,?)', r'\1 <secret hidden>\2'),
+    (r'("(?:private-)?key":) "\S+(,?)', r'\1 <secret hidden>'),
+    (r'("bind-password":) "\S+', r'\1 <secret hidden>')
+]
+
+
+def synthetic_config(size):
+    "PAN-OS style `show config running` XML of about `size` characters."
+    head = (
+        '<response status="success"><result>\n'
+        '  <config version="9.1.0" urldb="paloaltonetworks" detail-version="9.1.3">\n'
+        '    <mgt-config>\n'
+        '      <users>\n'
+    )
+    users = "".join(
+        '        <entry name="admin{0}">\n'
+        '          <phash>$1$abcdefgh$ijklmnopqrstuvwx{0}</phash>\n'
+        '          <permissions><role-based><superuser>yes</superuser></role-based></permissions>\n'
+        '        </entry>\n'.format(i) for i in range(20))
+    parts = [head, users, '      </users>\n    </mgt-config>\n    <devices>\n      <entry name="localhost.localdomain">\n'
+             '        <network><ike><gateway>\n']
+    parts.extend(
+        '          <entry name="gw{0}">\n'
+        '            <authentication><pre-shared-key><key>-AQ==abc{0}def=</key></pre-shared-key></authentication>\n'
+        '            <peer-address><ip>192.0.2.{1}</ip></peer-address>\n'
+        '          </entry>\n'.format(i, i % 250) for i in range(50))
+    parts.append('        </gateway></ike></network>\n        <vsys><entry name="vsys1">\n          <address>\n')
+
+    n = sum(len(p) for p in parts)
+    half = size // 2
+    i = 0
+    while n < half:
+        p = ('            <entry name="host-10.{0}.{1}.{2}">\n'
+             '              <ip-netmask>10.{0}.{1}.{2}/32</ip-netmask>\n'
+             '              <description>server {3}</description>\n'
+             '              <tag><member>servers</member><member>dc{4}</member></tag>\n'
+             '            </entry>\n').format(i // 65536 % 256, i // 256 % 256, i % 256, i, i % 3)
+        parts.append(p)
+        n += len(p)
+        i += 1
+
+    parts.append('          </address>\n          <rulebase><security><rules>\n')
+    i = 0
+    while n < size:
+        p = ('            <entry name="rule-{0}" uuid="00000000-0000-0000-0000-{0:012d}">\n'
+             '              <from><member>trust</member></from>\n'
+             '              <to><member>untrust</member></to>\n'
+             '              <source><member>host-10.0.{1}.{2}</member><member>host-10.1.{1}.{2}</member></source>\n'
+             '              <destination><member>any</member></destination>\n'
+             '              <service><member>application-default</member></service>\n'
+             '              <application><member>ssl</member><member>web-browsing</member></application>\n'
+             '              <action>allow</action>\n'
+             '            </entry>\n').format(i, i // 256 % 256, i % 256)
+        parts.append(p)
+        n += len(p)
+        i += 1
+
+    parts.append('          </rules></security></rulebase>\n        </entry></vsys>\n      </entry>\n'
+                 '    </devices>\n  </config>\n</result></response>\n')
+    return "".join(parts)
+
+
+def legacy(xml, hide_secrets):
+    import xmltodict
+    from ncc.redact import Redactor
+
+    cfg = json.dumps(xmltodict.parse(xml)["response"]["result"]["config"], indent=2)
+    return Redactor(LEGACY_SECRETS).redact(cfg) if hide_secrets else cfg
+
+
+def stream(xml, hide_secrets):
+    from ncc.libs.xmljson import xml_to_json
+
+    secrets = {"phash", "key", "private-key", "bind-password"} if hide_secrets else ()
+    return xml_to_json(xml, ("response", "result", "config"), secrets=secrets)
+
+
+def child(mode, size):
+    xml = synthetic_config(size)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    t0 = time.perf_counter()
+    cfg = (legacy if mode == "legacy" else stream)(xml, True)
+    elapsed = time.perf_counter() - t0
+
+    print(json.dumps({
+        "seconds": elapsed,
+        "input_mb": len(xml) / 1e6,
+        "output_mb": len(cfg) / 1e6,
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024.0,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=50)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, size = args.child
+        return child(mode, int(size))
+
+    size = int(args.size_mb * 1e6)
+
+    xml = synthetic_config(min(size, 2 * 10 ** 6))
+    assert legacy(xml, False) == stream(xml, False), "pipelines differ"
+    del xml
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>16}".format("mode", "input MB", "output MB", "seconds", "RSS growth MB"))
+    for mode in ("legacy", "stream"):
+        out = subprocess.check_output([sys.executable, __file__, "--child", mode, str(size)], universal_newlines=True)
+        r = json.loads(out.strip().splitlines()[-1])
+        print("{:>8} {:>10.1f} {:>10.1f} {:>10.2f} {:>16.1f}".format(
+            mode, r["input_mb"], r["output_mb"], r["seconds"], r["rss_growth_mb"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark push latency of the serial `Directory.create_tree` against the
+concurrent `write.Uploader`, using the local fake GitHub API server.
+
+Files are spread over 6 site directories like the configs repo.
+
+Usage:
+    python bench/bench_push.py [--latency 0.05] [--workers 16] [--files 10 100 1000]
+
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from fake_github import FakeGitHub, FakeRepo
+from ncc import write
+
+SITES = ["usden1", "usden2", "ussfo1", "uscol1", "uscol2", "uscol3"]
+
+
+def build_root(files):
+    root = write.Directory("")
+    for i in range(files):
+        path = "{}/device{}.cfg".format(SITES[i % len(SITES)], i)
+        root.add_file(path, "100644", content="hostname device{}\n!\nend\n".format(i))
+    return root
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="make the fake server rate limit every Nth request")
+    args = parser.parse_args()
+
+    server = FakeGitHub(latency=args.latency, rate_limit_every=args.rate_limit_every).start()
+
+    print("{:>6} {:>12} {:>12} {:>8}".format("files", "serial (s)", "parallel (s)", "speedup"))
+    try:
+        for n in args.files:
+            serial = None
+            if not args.rate_limit_every:
+                # the serial path has no retry handling
+                serial = timed(lambda: build_root(n).create_tree(FakeRepo(server.url)))
+
+            repo = FakeRepo(server.url)
+            write.keep_alive(repo.session, args.workers)
+            uploader = write.Uploader(repo, workers=args.workers)
+            parallel = timed(lambda: uploader.upload(build_root(n)))
+
+            print("{:>6} {:>12} {:>12.2f} {:>8}".format(
+                n,
+                "{:.2f}".format(serial) if serial else "-",
+                parallel,
+                "{:.1f}x".format(serial / parallel) if serial else "-",
+            ))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
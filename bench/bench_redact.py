@@ -0,0 +1,120 @@
+"""
+Benchmark the compiled redaction engine against the original
+per-rule `re.sub` loop used by the platform `filter()` methods.
+
+Runs both on large synthetic IOS and NX-OS configs and fails if the
+output is not byte-identical.  PAN-OS has no rules left to compare,
+its secrets are dropped while its XML is converted (`ncc.libs.xmljson`).
+
+Usage:
+    python bench/bench_redact.py [size_multiplier]
+
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ncc.platforms.cisco_ios import CiscoIOS
+from ncc.platforms.cisco_nxos import CiscoNXOS
+
+
+def legacy_filter(cls, cfg):
+    "The filter() loop every platform used before ncc.redact."
+    for secret in cls.CONFIG_SECRETS:
+        cfg = re.sub(secret[0], secret[1], cfg, flags=re.M)
+
+    for gfilter in cls.GLOBAL_FILTER:
+        cfg = re.sub(gfilter[0], gfilter[1], cfg, flags=re.M)
+
+    return cfg
+
+
+def new_filter(cls, cfg):
+    cfg = cls.SECRETS_REDACTOR.redact(cfg)
+    return cls.GLOBAL_REDACTOR.redact(cfg)
+
+
+def cisco_config(interfaces):
+    lines = [
+        "Building configuration...",
+        "",
+        "Current configuration : 123456 bytes",
+        "! Last configuration change at 10:01:02 UTC Mon Jan 6 2020 by admin",
+        "! NVRAM config last updated at 10:01:03 UTC Mon Jan 6 2020 by admin",
+        "!",
+        "version 15.2",
+        "hostname core-sw1",
+        "enable secret 5 $1$abcd$0123456789abcdefghij",
+        "username admin privilege 15 secret 5 $1$efgh$abcdefghij0123456789",
+        "snmp-server community s3cr3t RO 10",
+        "snmp-server host 10.0.0.1 version 2c s3cr3t",
+        "tacacs-server host 10.0.0.2 key 7 0822455D0A16",
+        "tacacs server ise1",
+        " address ipv4 10.0.0.3",
+        " key 7 0822455D0A16544541",
+        "!",
+    ]
+    for i in range(interfaces):
+        lines.extend([
+            "interface GigabitEthernet1/0/{}".format(i),
+            " description uplink-{} uptime check".format(i),
+            " switchport access vlan {}".format(i % 4094 + 1),
+            " switchport mode access",
+            " ip ospf message-digest-key 1 md5 7 0822455D0A16",
+            " standby 1 authentication md5 key-string 7 0822455D0A16 timeout 30",
+            " spanning-tree portfast",
+            "!",
+        ])
+    lines.extend([
+        "router bgp 65000",
+        " neighbor 10.1.1.1 password 7 0822455D0A16",
+        "line vty 0 4",
+        " password 7 0822455D0A16",
+        "end",
+    ])
+    return "\n".join(lines)
+
+
+def run(name, cls, cfg, rounds=3):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        expected = legacy_filter(cls, cfg)
+    legacy = (time.perf_counter() - t0) / rounds
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        result = new_filter(cls, cfg)
+    compiled = (time.perf_counter() - t0) / rounds
+
+    identical = result == expected
+    print("{:<8} {:>8.1f} MB  legacy {:>8.1f} ms  redact {:>8.1f} ms  {:>5.1f}x  passes {:>2} -> {:>2}  identical={}".format(
+        name,
+        len(cfg) / 1e6,
+        legacy * 1000,
+        compiled * 1000,
+        legacy / compiled,
+        len(cls.CONFIG_SECRETS) + len(cls.GLOBAL_FILTER),
+        len(cls.SECRETS_REDACTOR.passes) + len(cls.GLOBAL_REDACTOR.passes),
+        identical,
+    ))
+    return identical
+
+
+def main():
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    ok = all([
+        run("ios", CiscoIOS, cisco_config(20000 * scale)),
+        run("nxos", CiscoNXOS, cisco_config(20000 * scale)),
+    ])
+
+    if not ok:
+        sys.exit("Redacted output differs from legacy filter output!")
+
+
+if __name__ == "__main__":
+    main()
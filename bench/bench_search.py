@@ -0,0 +1,125 @@
+"""
+Benchmark fleet wide config searches on synthetic access switches.
+
+    scan: every line of every config checked, as grepping a clone does
+    ncc:  `ncc.search.SearchIndex`, already loaded
+    cli:  `ncc.py search -l`, wall time of the whole process, loading
+          the index included
+
+Every switch has a few unique lines (hostname, descriptions) among
+the lines the whole fleet shares.
+
+Usage:
+    python bench/bench_search.py [--devices 2000] [--ports 48]
+
+"""
+
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+
+def synthetic_config(device, ports):
+    lines = [
+        "hostname sw{}".format(device),
+        "snmp-server community {} RO".format(random.choice(["public", "netops", "monitor"])),
+        "!",
+    ]
+    for i in range(ports):
+        lines += [
+            "interface GigabitEthernet1/0/{}".format(i + 1),
+            " description desk {}".format(random.randrange(1000)),
+            " switchport access vlan {}".format(random.choice([10, 20, 200, 201, 300])),
+            " spanning-tree portfast",
+            "!",
+        ]
+    return lines + ["end"]
+
+
+QUERIES = [
+    ("snmp-server community public", False),
+    ("switchport access vlan 200", False),
+    ("description desk 99*", False),
+    (r"vlan 2\d\d$", True),
+]
+
+
+def scan(configs, query, regex):
+    "Number of matching lines, checking every line."
+    if regex:
+        pattern = re.compile(query)
+        return sum(1 for lines in configs.values() for line in lines if pattern.search(line))
+    # phrase queries without prefixes are substring checks on whole tokens
+    want = " {} ".format(query.rstrip("*"))
+    return sum(1 for lines in configs.values() for line in lines if want in " {} ".format(" ".join(line.split())))
+
+
+def cli(path, query, regex):
+    "Seconds `ncc.py search` takes end to end."
+    cmd = [sys.executable, os.path.join(BENCH_DIR, "..", "ncc.py"), "search", "--index-file", path, "-l"]
+    cmd += ["-e"] if regex else []
+    start = time.perf_counter()
+    subprocess.run(cmd + ["--"] + query.split(), check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    from ncc.search import SearchIndex
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--ports", type=int, default=48)
+    args = parser.parse_args()
+
+    random.seed(1)
+    configs = {"site{}/sw{}".format(d % 50, d): synthetic_config(d, args.ports) for d in range(args.devices)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SearchIndex(os.path.join(tmp, "search.idx"))
+        t0 = time.perf_counter()
+        for name, lines in configs.items():
+            index.update(name, "\n".join(lines))
+        t_build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index.save()
+        t_save = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index = SearchIndex(index.path)
+        t_load = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        t_python = time.perf_counter() - t0
+
+        print("{} devices, {} lines".format(len(configs), sum(len(l) for l in configs.values())))
+        print("build {:.2f}s, save {:.2f}s, load {:.2f}s, bare python startup {:.0f}ms".format(
+            t_build, t_save, t_load, t_python * 1e3))
+        print("{:>30} {:>9} {:>10} {:>10} {:>10}".format("query", "matches", "scan ms", "ncc ms", "cli ms"))
+        for query, regex in QUERIES:
+            t0 = time.perf_counter()
+            expected = scan(configs, query, regex) if not query.endswith("*") else None
+            t_scan = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            found = sum(index.count(query, regex).values())
+            t_ncc = time.perf_counter() - t0
+
+            t_cli = cli(index.path, query, regex)
+
+            assert expected is None or expected == found, (query, expected, found)
+            print("{:>30} {:>9} {:>10} {:>10.2f} {:>10.0f}".format(
+                query, found, "-" if expected is None else "{:.1f}".format(t_scan * 1e3), t_ncc * 1e3, t_cli * 1e3))
+
+
+if __name__ == "__main__":
+    main()
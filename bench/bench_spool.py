@@ -0,0 +1,130 @@
+"""
+Benchmark peak memory of holding collected configs in the inventory
+against spooling them to disk, as the fleet grows.
+
+Every simulated device returns an ASA style config of `--size-kb`,
+which goes through `collect._store` and then the `write.Accumulator`
+into a writer that reads each config back, like a push.
+
+    memory: the config text is kept on the host, as before the spool
+    spool:  `collect._store` writes it to `ncc.spool` and keeps a reference
+
+Each measurement runs in its own process so peak RSS is comparable.
+
+Usage:
+    python bench/bench_spool.py [--size-kb 2048] [--devices 50 200 800] [--workers 8]
+
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+LINES = [
+    "access-list outside_in extended permit tcp any host 10.{a}.{b}.{c} eq https",
+    "object network obj-10.{a}.{b}.{c}",
+    " host 10.{a}.{b}.{c}",
+    "username user{c} password {a}{b}{c}abcdef encrypted privilege 15",
+    "route outside 10.{a}.{b}.0 255.255.255.0 192.0.2.{c} 1",
+]
+
+
+class SimHost(dict):
+    "Just enough of a nornir Host for `collect._store`."
+    def __init__(self, i):
+        super().__init__()
+        self.name = "fw{}".format(i)
+        self.platform = "asa"
+
+
+class SimDevice(object):
+    "What a Platform instance holds once a device is collected."
+    def __init__(self, i, size):
+        from ncc.platforms.cisco_asa import CiscoASA
+
+        lines, n = [], 0
+        while n < size:
+            line = LINES[n % len(LINES)].format(a=i % 250, b=(n // 250) % 250, c=n % 250)
+            lines.append(line)
+            n += len(line) + 1
+        platform = CiscoASA(True, connect=False)
+        self.config = platform.filter("\n".join(lines) + "\n")
+        self.metadata = platform.format_metadata({"show version": "Cisco Adaptive Security Appliance"})
+        self.marker = None
+
+
+class NullWriter(object):
+    "Reads every pushed config back, the way `Github.push` does."
+    def blob_sha(self, path):
+        return None
+
+    def push(self, configs, message=None):
+        from ncc.spool import as_text
+
+        for config in configs:
+            as_text(config["content"])
+        return True
+
+
+def child(mode, devices, size, workers):
+    from ncc import collect, write
+    from ncc.spool import spool
+
+    hosts = [SimHost(i) for i in range(devices)]
+
+    def fetch(host):
+        netcon = SimDevice(int(host.name[2:]), size)
+        if mode == "spool":
+            collect._store(host, netcon)
+        else:
+            host["configs"] = netcon.metadata + netcon.config
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(fetch, hosts))
+
+    accumulator = write.Accumulator(NullWriter())
+    accumulator.add([{"path": "site/{}.cfg".format(h.name), "mode": "100644", "content": h["configs"]} for h in hosts])
+    accumulator.flush()
+    elapsed = time.perf_counter() - t0
+    spool.cleanup()
+
+    print(json.dumps({
+        "seconds": elapsed,
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--devices", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, devices, size, workers = args.child
+        return child(mode, int(devices), int(size), int(workers))
+
+    print("{:>8} {:>8} {:>10} {:>12}".format("devices", "mode", "seconds", "peak RSS MB"))
+    for n in args.devices:
+        for mode in ("memory", "spool"):
+            out = subprocess.check_output(
+                [sys.executable, __file__, "--child", mode, str(n), str(args.size_kb * 1024), str(args.workers)],
+                universal_newlines=True,
+            )
+            r = json.loads(out.strip().splitlines()[-1])
+            print("{:>8} {:>8} {:>10.2f} {:>12.1f}".format(n, mode, r["seconds"], r["maxrss_mb"]))
+
+
+if __name__ == "__main__":
+    main()
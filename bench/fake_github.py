@@ -0,0 +1,115 @@
+"""
+Local fake of the GitHub git data API used by `write.Github.push`.
+
+Implements just enough to post blobs and trees:
+
+    POST /repos/<org>/<repo>/git/blobs
+    POST /repos/<org>/<repo>/git/trees
+
+Every request sleeps `latency` seconds to mimic a round trip to
+api.github.com.  With `rate_limit_every` set, every Nth request is
+answered with a 403 rate limit response carrying `Retry-After: 0`.
+
+`FakeRepo` is a stand in for `github3.repos.repo.Repository` that talks
+to the fake server through a keep-alive `requests.Session`.
+
+"""
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from types import SimpleNamespace
+
+import github3
+import requests
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(server.latency)
+
+        with server.lock:
+            server.requests += 1
+            limited = server.rate_limit_every and server.requests % server.rate_limit_every == 0
+
+        if limited:
+            return self._reply(403, {"message": "API rate limit exceeded"}, {"Retry-After": "0"})
+
+        kind = self.path.rstrip("/").rsplit("/", 1)[-1]
+        sha = hashlib.sha1(kind.encode() + body).hexdigest()
+        self._reply(201, {"sha": sha, "url": self.path + "/" + sha})
+
+    def _reply(self, code, data, headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeGitHub(object):
+    """
+    Parameters
+    ----------
+    latency : float
+        Seconds every request takes.
+    rate_limit_every : int
+        Answer every Nth request with a rate limit error, 0 to disable.
+
+    """
+    def __init__(self, latency=0.05, rate_limit_every=0):
+        self.httpd = _ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.latency = latency
+        self.httpd.rate_limit_every = rate_limit_every
+        self.httpd.requests = 0
+        self.httpd.lock = threading.Lock()
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-github", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+class FakeRepo(object):
+    "The parts of `github3.repos.repo.Repository` that `write` uses to post blobs and trees."
+
+    def __init__(self, url, org="org", repository="configs"):
+        self.session = requests.Session()
+        self.base = "{}/repos/{}/{}/git".format(url, org, repository)
+
+    def _post(self, kind, data):
+        r = self.session.post("{}/{}".format(self.base, kind), json=data)
+        if r.status_code != 201:
+            raise github3.exceptions.error_for(r)
+        return r.json()
+
+    def create_blob(self, content, encoding):
+        return self._post("blobs", {"content": content, "encoding": encoding})["sha"]
+
+    def create_tree(self, tree, base_tree=None):
+        return SimpleNamespace(sha=self._post("trees", {"tree": tree})["sha"])
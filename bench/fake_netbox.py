@@ -0,0 +1,178 @@
+"""
+Local fake of the NetBox device list API used by `NBInventory`.
+
+Serves `GET /api/dcim/devices/?limit=N&offset=M` for a fleet of
+generated devices, with NetBox's `count`/`next`/`previous`/`results`
+envelope.  The `site` and `cf_monitor` filters are applied, and
+`GET /api/dcim/sites/` lists every site as active.  `limit=0` returns every device in one response, like a
+NetBox with MAX_PAGE_SIZE=0.
+
+Each response sleeps `latency` seconds plus `per_device` seconds for
+every device in it, to mimic a server whose cost grows with the page.
+Every 10th device is a virtual chassis secondary and every 7th is not
+monitored, so the inventory filters have something to drop.  All
+devices were last updated when the server started, which is enough for
+`last_updated__gte` to return everything before and nothing after.
+
+Usage:
+    python bench/fake_netbox.py --port 8080 --devices 50000
+
+or from code:
+    server = FakeNetbox(devices=50000).start()
+
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlencode, urlparse
+
+PLATFORMS = ["ios", "nxos", "junos", "panos", "cisco_asa", "cisco_wlc", "dell_force10", "opengear"]
+SITES = ["usden1", "usden2", "ussfo1", "uscol1", "uscol2", "uscol3"]
+
+
+def device(i, last_updated=""):
+    "NetBox device object number `i`."
+    platform = PLATFORMS[i % len(PLATFORMS)]
+    # the second member of the virtual chassis headed by device i - 1
+    name = "dev{}:b".format(i - 1) if i % 10 == 9 else "dev{}".format(i)
+    return {
+        "id": i,
+        "name": name,
+        "serial": "SN{:08d}".format(i),
+        "asset_tag": None,
+        "site": {"id": i % len(SITES), "name": SITES[i % len(SITES)].upper(), "slug": SITES[i % len(SITES)]},
+        "device_role": {"id": 1, "name": "Access", "slug": "access"},
+        "device_type": {
+            "id": 1,
+            "slug": "model-{}".format(platform),
+            "manufacturer": {"id": 1, "name": "Vendor", "slug": "vendor"},
+        },
+        "platform": {"id": 1, "name": platform, "slug": platform},
+        "primary_ip": {"id": i, "address": "10.{}.{}.{}/24".format(i >> 16 & 255, i >> 8 & 255, i & 255)},
+        "custom_fields": {"monitor": i % 7 != 0, "rack_unit": i % 42},
+        "tags": ["network"],
+        "last_updated": last_updated,
+    }
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        limit = int(query.get("limit", ["50"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+
+        if url.path.rstrip("/").endswith("/sites"):
+            objects = [{"slug": slug, "status": "active", "device_count": 1} for slug in SITES]
+            per_device = 0
+        else:
+            objects = self.devices(query)
+            per_device = server.per_device
+
+        total = len(objects)
+        end = total if limit == 0 else min(offset + limit, total)
+        results = [obj if isinstance(obj, dict) else device(obj, server.started) for obj in objects[offset:end]]
+        time.sleep(server.latency + per_device * len(results))
+
+        with server.lock:
+            server.requests += 1
+
+        query["offset"] = [str(end)]
+        base = "http://{}:{}{}".format(*self.server.server_address, url.path)
+        payload = json.dumps({
+            "count": total,
+            "next": "{}?{}".format(base, urlencode(query, doseq=True)) if end < total else None,
+            "previous": None,
+            "results": results,
+        }).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def devices(self, query):
+        "Ids of the devices matching the supported filters."
+        server = self.server
+        if query.get("last_updated__gte", [""])[0] > server.started:
+            return []
+
+        sites = query.get("site")
+        monitored = query.get("cf_monitor") == ["true"]
+        return [
+            i for i in range(server.devices)
+            if (not sites or SITES[i % len(SITES)] in sites) and (not monitored or i % 7 != 0)
+        ]
+
+
+class FakeNetbox(object):
+    """
+    Parameters
+    ----------
+    devices : int
+        Number of devices in the fleet.
+    latency : float
+        Seconds every request takes.
+    per_device : float
+        Extra seconds per device returned.
+    port : int
+        Port to listen on, 0 for any free port.
+
+    """
+    def __init__(self, devices=50000, latency=0.05, per_device=0.00002, port=0):
+        self.httpd = _ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.httpd.devices = devices
+        self.httpd.latency = latency
+        self.httpd.per_device = per_device
+        self.httpd.requests = 0
+        self.httpd.started = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        self.httpd.lock = threading.Lock()
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-netbox", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--devices", type=int, default=50000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-device", type=float, default=0.00002)
+    args = parser.parse_args()
+
+    server = FakeNetbox(args.devices, args.latency, args.per_device, args.port)
+    print("listening on {}".format(server.url), flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Local mock SSH server that answers commands with canned output.
+
+Commands can come as exec requests, as the async engine sends them, or
+typed at an IOS like `mock-sw1#` prompt in an interactive shell, as
+netmiko and NAPALM send them.  Any username/password is accepted.
+Every command sleeps for `latency` seconds before answering, to
+simulate a device on a WAN link.
+
+Usage:
+    python bench/mock_ssh.py --port 8022 --latency 0.05
+
+or from code:
+    server = MockSSHServer(latency=0.05)
+    port = server.start_in_thread()
+
+Requires asyncssh.
+
+"""
+
+import argparse
+import asyncio
+import threading
+
+import asyncssh
+
+
+SHOW_RUN = "\n".join(
+    ["Building configuration...", "", "Current configuration : 4242 bytes", "!", "hostname mock-sw1"]
+    + [
+        "interface GigabitEthernet1/0/{}\n description port {}\n switchport access vlan 10\n!".format(i, i)
+        for i in range(48)
+    ]
+    + ["snmp-server community s3cr3t RO", "line vty 0 4", " password 7 0822455D0A16", "end"]
+)
+
+PROMPT = "mock-sw1#"
+
+CANNED = {
+    "show run": SHOW_RUN,
+    "show running-config": SHOW_RUN,
+    "show inventory": 'NAME: "1", DESCR: "WS-C3850-48P"\nPID: WS-C3850-48P, VID: V01, SN: FOC0000X0XX',
+    "show version": "Cisco IOS Software, Version 16.9.4\nmock-sw1 uptime is 1 year, 2 weeks",
+}
+
+
+class _Server(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+class MockSSHServer(object):
+    """
+    Parameters
+    ----------
+    outputs : dict
+        Maps command to the output returned for it.  Unknown commands
+        return an IOS style error.
+    latency : float
+        Seconds to wait before answering each command.
+    host : str
+    port : int
+        0 picks a free port.
+
+    """
+    def __init__(self, outputs=None, latency=0.0, host="127.0.0.1", port=0):
+        self.outputs = outputs or CANNED
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.key = asyncssh.generate_private_key("ssh-ed25519")
+
+    async def _run(self, command):
+        await asyncio.sleep(self.latency)
+        output = self.outputs.get(command)
+        if output is None:
+            output = "% Invalid input detected at '^' marker."
+        return output
+
+    async def _handle(self, process):
+        if process.command is not None:
+            process.stdout.write(await self._run(process.command) + "\n")
+            process.exit(0)
+            return
+
+        # interactive shell, asyncssh's line editor echoes what is typed
+        process.stdout.write(PROMPT)
+        while True:
+            try:
+                line = await process.stdin.readline()
+            except asyncssh.TerminalSizeChanged:
+                continue
+            except asyncssh.Error:
+                break
+            if not line or line.strip() in ("exit", "quit"):
+                break
+            command = line.strip()
+            if command and not command.startswith("terminal "):
+                process.stdout.write(await self._run(command) + "\n")
+            process.stdout.write(PROMPT)
+        process.exit(0)
+
+    async def start(self):
+        "Start listening on the current event loop and return the port."
+        self.server = await asyncssh.create_server(
+            _Server,
+            self.host,
+            self.port,
+            server_host_keys=[self.key],
+            process_factory=self._handle,
+            backlog=4096,
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def start_in_thread(self):
+        "Run the server on its own event loop in a daemon thread and return the port."
+        ready = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, name="mock-ssh", daemon=True).start()
+        ready.wait()
+        return self.port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8022)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockSSHServer(latency=args.latency, host=args.host, port=args.port)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    port = loop.run_until_complete(server.start())
+    print("mock ssh server listening on {}:{}".format(args.host, port), flush=True)
+    loop.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,269 @@
-import os
 import logging
+from functools import partial
 
 import click
 
-from ncc import collect
+from ncc import archive as ncc_archive
+from ncc import diff as ncc_diff
+from ncc import search as ncc_search
+from ncc import state as ncc_state
 from ncc import write
 from ncc.libs.creds import creds
-from ncc.libs.inventory.init_nornir import get_devices
-
-from nornir.plugins.functions.text import print_result
+from ncc.spool import spool
+from ncc.libs.transport.limits import limiter
+from ncc.summary import summary
+from ncc.libs.inventory import cache as inventory_cache
 
 
 # Configs
 repo = "it-netconfigs"
 branch ="master"
 org = "ctopher78" # github user or org
-sites = ["usden1", "usden2", "ussfo1", "uscol1", "uscol2", "uscol3"]
-collect_freq = 60 # minutes
+collect_freq = 60 # minutes, between collections of a device with `serve`
 
 failed_hosts = dict()
 
-@click.command()
+class DefaultGroup(click.Group):
+    """
+    Group that runs `run` when no command is given, so existing
+    `ncc.py --workers 20 ...` cron entries keep working.
+    """
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args = ["run"] + list(args)
+        return super().parse_args(ctx, args)
+
+
+# options shared by `run` and `serve`
+COLLECTION_OPTIONS = [
+    click.option(
+        "--loglevel",
+        "-l",
+        default="info",
+        type=click.Choice(["info", "debug", "warning"]),
+        show_default="info",
+        help="Enabled debug logging"
+    ),
+    click.option(
+        "--console/--no-console",
+        "-c",
+        default=False,
+        show_default="--no-console",
+        help="Print logs to stdout"
+    ),
+    click.option(
+        "--hide-secrets/--show-secrets",
+        default=True,
+        show_default="--hide-secrets",
+        help="Redact sensitive secrets from config files.  Use before pushing to public GitHub Repos"
+    ),
+    click.option(
+        "--retries",
+        "-r",
+        default=1,
+        show_default=1,
+        help="Number of times to retry collecting configs for failed devices"
+    ),
+    click.option(
+        "--workers",
+        "-w",
+        default=15,
+        show_default=15,
+        help="Maximum number of devices to collect from at the same time, across all sites"
+    ),
+    click.option(
+        "--site-workers",
+        default=15,
+        show_default=15,
+        help="Maximum number of devices to collect from at the same time within a single site"
+    ),
+    click.option(
+        "--platform-limit",
+        "platform_limits",
+        multiple=True,
+        callback=lambda ctx, param, value: parse_limits(value),
+        help="Maximum sessions to devices of a platform, e.g. 'ios=40', may be repeated.  "
+             "Defaults to the driver's MAX_SESSIONS or --workers, the limit adapts to device load below it"
+    ),
+    click.option(
+        "--incremental/--full",
+        default=True,
+        show_default="--incremental",
+        help="Skip devices whose change marker (e.g. 'Last configuration change') is the same as on the last run"
+    ),
+    click.option(
+        "--state-file",
+        default=ncc_state.DEFAULT_STATE_FILE,
+        show_default=True,
+        help="File that keeps device change markers between runs"
+    ),
+    click.option(
+        "--full-every",
+        default=24.0,
+        show_default=24,
+        help="Hours after which unchanged devices are fetched in full again, refreshing version and inventory metadata"
+    ),
+    click.option(
+        "--writer",
+        default="github",
+        type=click.Choice(["github", "git"]),
+        show_default="github",
+        help="How configs are stored.  'git' pushes from a local clone, much faster than the GitHub API for many changes"
+    ),
+    click.option(
+        "--git-url",
+        default=None,
+        help="Remote for the 'git' writer, e.g. a path to a bare repo.  Defaults to the GitHub repo"
+    ),
+    click.option(
+        "--git-dir",
+        default=write.DEFAULT_CLONE_DIR,
+        show_default=True,
+        help="Local clone used by the 'git' writer"
+    ),
+    click.option(
+        "--diff-dir",
+        default=ncc_diff.DEFAULT_DIFF_DIR,
+        show_default=True,
+        help="Where the configs pushed last and their diffs are kept.  Changed configs are diffed against them "
+             "and the commit message lists changed devices and sections.  Empty to disable"
+    ),
+    click.option(
+        "--archive-dir",
+        default=ncc_archive.DEFAULT_ARCHIVE_DIR,
+        show_default=True,
+        help="Local archive that keeps every version of every config, compressed and deduplicated.  "
+             "Empty to disable"
+    ),
+    click.option(
+        "--index-file",
+        default=ncc_search.DEFAULT_INDEX_FILE,
+        show_default=True,
+        help="Search index of the latest config of every device, queried with `ncc.py search`.  Empty to disable"
+    ),
+    click.option(
+        "--inventory-cache",
+        default=inventory_cache.DEFAULT_CACHE_FILE,
+        show_default=True,
+        help="File that keeps the Netbox inventory between runs, only changed devices are fetched.  Empty to disable"
+    ),
+    click.option(
+        "--inventory-ttl",
+        default=86400,
+        show_default=86400,
+        help="Seconds after which the whole inventory is fetched from Netbox again"
+    ),
+    click.option(
+        "--refresh-inventory",
+        is_flag=True,
+        default=False,
+        help="Fetch the whole inventory from Netbox, ignoring the cache"
+    ),
+    click.option(
+        "--site",
+        "-s",
+        "sites",
+        multiple=True,
+        help="Site slug to collect, may be repeated.  Defaults to every active site in Netbox"
+    ),
+    click.option(
+        "--role",
+        "roles",
+        multiple=True,
+        help="Device role slug to collect, may be repeated.  Defaults to every role"
+    ),
+    click.option(
+        "--report-json",
+        default=None,
+        help="Write the run summary with per device, platform, site and phase timings to this JSON file"
+    ),
+    click.option(
+        "--prometheus-file",
+        default=None,
+        help="Write the run summary as a Prometheus textfile, e.g. into the node exporter's textfile directory"
+    ),
+]
+
+
+def collection_options(f):
+    for option in reversed(COLLECTION_OPTIONS):
+        f = option(f)
+    return f
+
+
+@click.group(cls=DefaultGroup)
+def main():
+    "Collect network device configs and store them in git."
+
+
+@main.command()
+@collection_options
 @click.option(
-    "--loglevel",
-    "-l",
-    default="info",
-    type=click.Choice(["info", "debug", "warning"]),
-    show_default="info",
-    help="Enabled debug logging"
+    "--engine",
+    default="thread",
+    type=click.Choice(["thread", "async"]),
+    show_default="thread",
+    help="Collection engine.  'async' needs asyncssh and handles thousands of devices with far less memory"
 )
 @click.option(
-    "--console/--no-console",
-    "-c",
+    "--commit-per-site/--single-commit",
     default=False,
-    show_default="--no-console",
-    help="Print logs to stdout"
-)
-@click.option(
-    "--hide-secrets/--show-secrets",
-    default=True,
-    show_default="--hide-secrets",
-    help="Redact sensitive secrets from config files.  Use before pushing to public GitHub Repos"
+    show_default="--single-commit",
+    help="Push each site as soon as it is collected instead of one commit for the whole run"
 )
-@click.option(
-    "--retries",
-    "-r",
-    default=1,
-    show_default=1,
-    help="Number of times to retry collecting configs for failed devices"
-)
-def main(loglevel, console, hide_secrets, retries):
+def run(loglevel, console, hide_secrets, retries, workers, site_workers, platform_limits, engine, incremental,
+        state_file, full_every, writer, git_url, git_dir, diff_dir, archive_dir, index_file, commit_per_site,
+        inventory_cache, inventory_ttl, refresh_inventory, sites, roles, report_json, prometheus_file):
+    "Collect every device once, the default."
+    # imported here, it loads nornir
+    from ncc import schedule
+
     logging.getLogger("nornir")
-    # get inventory
-    devices = get_devices(filter="", num_workers=15, loglevel=loglevel, console=console, netbox_token=creds.get_nb_token())
+    netbox_token = creds.get_nb_token()
+    limiter.configure(platform_limits, site_workers, workers)
 
-    creds.set_device_defaults(devices)
+    # get inventory, filtered by Netbox down to the
+    # monitored devices of the sites and roles collected
+    with summary.timer("inventory"):
+        sites, devices = load_devices(
+            netbox_token, sites, roles, workers, loglevel, console, inventory_cache, inventory_ttl, refresh_inventory)
 
-    # Collect configs for all network devices
-    # Shard out work by site to minimize resource issues
-    for site in sites:
-        logging.info("Collecting configs for: %s", site)
+    creds.set_device_defaults(devices)
 
-        nornir_obj, results = collect.configs(devices.filter(site=site), hide_secrets, retries)
+    # Device change markers.  Always recorded, but only used
+    # to skip unchanged devices when collecting incrementally.
+    state = ncc_state.StateStore(state_file, max_age=full_every * 3600)
 
-        write_configs(site, nornir_obj)
+    # Changed configs from every site are gathered and
+    # published as one commit once collection is done.
+    accumulator = write.Accumulator(
+        get_writer(writer, git_url, git_dir),
+        state=state,
+        flush_each_site=commit_per_site,
+        differ=ncc_diff.DiffStage(diff_dir) if diff_dir else None,
+        archive=ncc_archive.Archive(archive_dir) if archive_dir else None,
+        index=ncc_search.SearchIndex(index_file) if index_file else None
+    )
 
-        failed_hosts.update(results.failed_hosts)
+    # Collect configs for all network devices.
+    # All sites share one pool of `workers` sessions, capped per site
+    # to minimize resource issues.  Each site is handed to the
+    # accumulator as soon as its last device finishes.
+    scheduler = schedule.SiteScheduler(
+        devices,
+        sites,
+        hide_secrets,
+        retries,
+        num_workers=workers,
+        site_workers=site_workers,
+        on_site_done=partial(write_configs, accumulator=accumulator),
+        engine=engine,
+        state=state if incremental else None
+    )
+    with summary.timer("collect"):
+        failed_hosts.update(scheduler.run())
+    accumulator.flush()
+    spool.cleanup()
 
     # Eventually send message to slack that show
     # which devices we failed to collect configs for
@@ -73,26 +271,227 @@ def main(loglevel, console, hide_secrets, retries):
         print("Execption: ", r[0].exception)
         #print("result: ", r[0].result)
 
+    write_summary(report_json, prometheus_file)
+
     # Add, commit, and push collected configs to remote
     # repo as new branch.
 
 
-def write_configs(site, nornir_obj):
-    configs = list()
+@main.command()
+@collection_options
+@click.option(
+    "--interval",
+    default=collect_freq,
+    show_default=collect_freq,
+    help="Minutes between two collections of the same device"
+)
+@click.option(
+    "--jitter",
+    default=0.1,
+    show_default=0.1,
+    help="Fraction of the interval each collection is moved at random, either way"
+)
+@click.option(
+    "--push-interval",
+    default=300,
+    show_default=300,
+    help="Seconds between pushes of the changed configs"
+)
+@click.option(
+    "--inventory-interval",
+    default=900,
+    show_default=900,
+    help="Seconds between inventory reloads from Netbox, also reloaded on SIGHUP"
+)
+def serve(loglevel, console, hide_secrets, retries, workers, site_workers, platform_limits, incremental, state_file,
+          full_every, writer, git_url, git_dir, diff_dir, archive_dir, index_file, inventory_cache, inventory_ttl,
+          refresh_inventory, sites, roles, report_json, prometheus_file, interval, jitter, push_interval,
+          inventory_interval):
+    """
+    Keep running and collect each device once per interval.
 
-    print("Writing configs")
-    for hostname, nr_obj in nornir_obj.inventory.hosts.items():
-        if nr_obj.get("configs"):
-            config = dict()
-            config["path"] = os.path.join(site, hostname+".cfg")
-            config["content"] = nr_obj.get("configs")
-            config["mode"] = "100644"
+    Devices are spread evenly over the interval instead of collected
+    all at once, and the inventory, GitHub tree and device drivers stay
+    loaded between collections.  Stop with SIGTERM or SIGINT.
+    """
+    from ncc.daemon import Daemon
+
+    netbox_token = creds.get_nb_token()
+    limiter.configure(platform_limits, site_workers, workers)
+
+    def load(previous):
+        _, devices = load_devices(
+            netbox_token, sites, roles, workers, loglevel, console, inventory_cache, inventory_ttl,
+            refresh_inventory and previous is None)
+        if previous is None:
+            creds.set_device_defaults(devices)
+        else:
+            # don't prompt for credentials again
+            devices.inventory.defaults.username = previous.inventory.defaults.username
+            devices.inventory.defaults.password = previous.inventory.defaults.password
+        return devices
+
+    def on_interval():
+        write_summary(report_json, prometheus_file)
+        summary.reset()
+
+    state = ncc_state.StateStore(state_file, max_age=full_every * 3600)
+    daemon = Daemon(
+        load,
+        write.Accumulator(
+            get_writer(writer, git_url, git_dir),
+            state=state,
+            differ=ncc_diff.DiffStage(diff_dir) if diff_dir else None,
+            archive=ncc_archive.Archive(archive_dir) if archive_dir else None,
+            index=ncc_search.SearchIndex(index_file) if index_file else None
+        ),
+        hide_secrets,
+        retries,
+        interval=interval * 60,
+        jitter=jitter,
+        num_workers=workers,
+        push_interval=push_interval,
+        inventory_interval=inventory_interval,
+        state=state if incremental else None,
+        on_interval=on_interval
+    )
+    daemon.run()
+    spool.cleanup()
+    write_summary(report_json, prometheus_file)
 
-            configs.append(config)
 
-    gh = write.Github(creds.get_github_token(), org, repo, branch)
-    gh.push(configs)
+@main.command()
+@click.argument("query", nargs=-1, required=True)
+@click.option(
+    "--regex",
+    "-e",
+    is_flag=True,
+    default=False,
+    help="QUERY is a regular expression instead of tokens, e.g. 'vlan 2\\d\\d$'"
+)
+@click.option(
+    "--device",
+    "-d",
+    "devices",
+    default=None,
+    help="Regular expression the device names must match, e.g. '^usden1/'"
+)
+@click.option(
+    "--devices-only",
+    "-l",
+    is_flag=True,
+    default=False,
+    help="Print the matching devices and their number of matching lines instead of the lines"
+)
+@click.option(
+    "--limit",
+    default=1000,
+    show_default=1000,
+    help="Maximum number of lines printed"
+)
+@click.option(
+    "--index-file",
+    default=ncc_search.DEFAULT_INDEX_FILE,
+    show_default=True,
+    help="Search index written by `run` and `serve`"
+)
+def search(query, regex, devices, devices_only, limit, index_file):
+    """
+    Search the latest config of every device.
+
+    QUERY is matched as a phrase of whole tokens, a token ending with
+    '*' matches every token it starts, e.g.
+
+        ncc.py search snmp-server community '*'
+
+        ncc.py search -d '^usden1/' switchport access vlan 200
+    """
+    index = ncc_search.SearchIndex(index_file)
+    if not index.devices():
+        raise click.ClickException("{} has no configs yet, collect with `run` or `serve` first".format(index_file))
 
+    query = " ".join(query)
+    try:
+        counts = index.count(query, regex, devices)
+        if devices_only:
+            for name, count in sorted(counts.items()):
+                click.echo("{}: {}".format(name, count))
+            return
+        matches = index.search(query, regex, devices, limit)
+    except ncc_search.SearchError as e:
+        raise click.UsageError(str(e))
+
+    for match in matches:
+        section = "  ({})".format(match.section) if match.section else ""
+        click.echo("{}:{}: {}{}".format(match.device, match.lineno, match.line.strip(), section))
+
+    total = sum(counts.values())
+    if total > len(matches):
+        click.echo("{} more matching lines, raise --limit to see them".format(total - len(matches)), err=True)
+
+
+def load_devices(netbox_token, sites, roles, workers, loglevel, console, cache_file, cache_ttl, refresh):
+    """
+    Site slugs and nornir object with the monitored devices of `sites`
+    and `roles`, every active site and every role when empty.
+    """
+    # imported here, they load nornir and with it napalm and netmiko
+    from ncc.libs.inventory.init_nornir import get_devices, get_sites
+
+    sites = list(sites) or get_sites(netbox_token, cache_file or None)
+    devices = get_devices(
+        filter=[],
+        num_workers=workers,
+        loglevel=loglevel,
+        console=console,
+        netbox_token=netbox_token,
+        cache_file=cache_file or None,
+        cache_ttl=cache_ttl,
+        refresh=refresh,
+        sites=sites,
+        roles=list(roles)
+    )
+    return sites, devices
+
+
+def parse_limits(values):
+    "{'ios': 40} from ('ios=40',)."
+    limits = dict()
+    for value in values:
+        platform, _, limit = value.partition("=")
+        try:
+            limits[platform] = int(limit)
+        except ValueError:
+            raise click.BadParameter("expected PLATFORM=SESSIONS, got {!r}".format(value))
+    return limits
+
+
+def write_summary(report_json=None, prometheus_file=None):
+    print(summary.report())
+    limits = limiter.limits()
+    if limits:
+        print("session limits: " + ", ".join("{} {}".format(k, v) for k, v in sorted(limits.items())))
+    if report_json:
+        summary.write_json(report_json)
+    if prometheus_file:
+        summary.write_prometheus(prometheus_file)
+
+
+def get_writer(backend, git_url=None, git_dir=write.DEFAULT_CLONE_DIR):
+    "Writer object with a `push(configs)` method for `backend`."
+    if backend == "git":
+        if git_url:
+            return write.LocalGit(git_url, branch, git_dir)
+        url = "https://github.com/{}/{}.git".format(org, repo)
+        return write.LocalGit(url, branch, git_dir, token=creds.get_github_token())
+
+    return write.Github(creds.get_github_token(), org, repo, branch)
+
+
+def write_configs(site, nornir_obj, accumulator):
+    print("Writing configs")
+    configs, markers = write.host_configs(site, nornir_obj.inventory.hosts)
+    accumulator.add(configs, markers)
 
 
 if __name__ == "__main__":
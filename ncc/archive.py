@@ -0,0 +1,407 @@
+"""
+Local archive of every config version collected.
+
+The git repo only keeps what was pushed, and reading history back
+means cloning it or walking the GitHub API.  The archive keeps every
+version of every device on local disk, compactly enough for a year of
+hourly collections of thousands of devices:
+
+    archive = Archive()
+    archive.store("usden1/r1", text, time.time())  # after each collection
+    archive.latest("usden1/r1")                    # (timestamp, text)
+    archive.get("usden1/r1", at=timestamp)         # as it was then
+    archive.history("usden1/r1", start, end)       # [(timestamp, sha), ...]
+    archive.read("usden1/r1", sha)
+
+Layout below the archive directory, two files per device:
+
+    packs/usden1/r1.pack  the device's configs, appended one object
+                          after the other
+    index/usden1/r1.idx   one fixed size record per version, in time
+                          order: timestamp, sha256 of the config, and
+                          where its object is in the pack
+
+Versions are addressed by the sha256 of their text.  A version is
+recorded only when it differs from the device's latest one, so a device
+that doesn't change costs nothing per collection, and a config that
+returns to an earlier version points at the object already stored.
+Objects hold either the whole config or a line delta against the
+device's previous version, with a whole config every
+`KEYFRAME_INTERVAL` versions to bound how many deltas a read applies.
+Both are compressed with zstd when the `zstandard` package is
+installed, zlib otherwise.  Keeping a device's objects in one file
+rather than a file each keeps a year of mostly tiny deltas from
+taking a disk block each.
+
+Writers hold an flock on the device's index file, so `run` and
+`serve` can share an archive.  The latest version is the last index
+record, one seek from the end of the file.  Records have a fixed size,
+so versions in a time range are found by bisecting the file.
+
+"""
+
+import os
+import json
+import fcntl
+import logging
+import zlib
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from ncc.diff import line_diff
+from ncc.spool import as_text
+from ncc.summary import summary
+
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.expanduser("~"), ".ncc", "archive")
+
+# a whole config after this many deltas in a row
+KEYFRAME_INTERVAL = 64
+
+# index record: unix time, sha256 of the config, offset and size of its object
+RECORD = struct.Struct("<d32sQI")
+
+# object header: magic, kind (F)ull or (D)elta, codec, delta chain
+# length, offset and size of the base object
+HEADER = struct.Struct("<4sccHQI")
+MAGIC = b"NCA2"
+
+
+class ArchiveError(Exception):
+    "Error raised for a missing or corrupt archive object."
+    pass
+
+
+def _zstd():
+    "zstandard module, None if it isn't installed."
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _compress(data):
+    "(codec, compressed data)."
+    zstandard = _zstd()
+    if zstandard is not None:
+        return b"s", zstandard.ZstdCompressor(level=10).compress(data)
+    return b"z", zlib.compress(data, 9)
+
+
+def _decompress(codec, data):
+    if codec == b"z":
+        return zlib.decompress(data)
+    if codec == b"s":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ArchiveError("object is zstd compressed, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ArchiveError("unknown codec {!r}".format(codec))
+
+
+def make_delta(base, lines):
+    """
+    Line delta turning `base` into `lines`: a list of [start, stop]
+    ranges of `base` to copy and lists of new lines to insert.
+
+    >>> make_delta(['a', 'b', 'c'], ['a', 'x', 'c'])
+    [[0, 1], ['x'], [2, 3]]
+
+    """
+    delta = []
+    for tag, i1, i2, j1, j2 in line_diff(base, lines):
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j1 != j2:
+            delta.append(lines[j1:j2])
+    return delta
+
+
+def apply_delta(base, delta):
+    "Lines of `base` changed by `delta`, the reverse of `make_delta`."
+    lines = []
+    for op in delta:
+        if op and isinstance(op[0], int):
+            lines.extend(base[op[0]:op[1]])
+        else:
+            lines.extend(op)
+    return lines
+
+
+class Archive(object):
+    """
+    Parameters
+    ----------
+    directory : str
+        Created on first store.
+
+    """
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _pack_path(self, device):
+        return os.path.join(self.directory, "packs", device + ".pack")
+
+    def _index_path(self, device):
+        return os.path.join(self.directory, "index", device + ".idx")
+
+    # -- writing
+
+    def store(self, device, text, timestamp):
+        """
+        Record `text` as the config of `device` at `timestamp`.
+
+        Parameters
+        ----------
+        device : str
+            e.g. 'usden1/r1'.
+        text : str
+        timestamp : float
+            Unix time of the collection.
+
+        Returns
+        -------
+        bool
+            False if the config is the same as the latest version.
+
+        """
+        data = text.encode("utf-8")
+        sha = hashlib.sha256(data).digest()
+
+        with self._lock, _locked(self._index_path(device)) as index:
+            last = _last(index)
+            if last is not None and last[1] == sha:
+                summary.count("archive unchanged")
+                return False
+
+            with summary.timer("archive"):
+                # only a changed config pays for reading the whole index
+                index.seek(0)
+                stored = next((r for r in reversed(list(RECORD.iter_unpack(index.read()))) if r[1] == sha), None)
+                if stored is not None:
+                    # back to an earlier version
+                    offset, size = stored[2], stored[3]
+                else:
+                    offset, size = self._write_object(device, text, last)
+                index.seek(0, os.SEEK_END)
+                index.write(RECORD.pack(timestamp, sha, offset, size))
+
+        summary.count("archive versions")
+        return True
+
+    def store_config(self, config, timestamp):
+        "`store` a config dict as from `write.host_configs`, keyed by its path."
+        device = os.path.splitext(config["path"])[0]
+        return self.store(device, as_text(config["content"]), timestamp)
+
+    def _write_object(self, device, text, base):
+        """
+        Append `text` to the device's pack, as a delta against the
+        `base` record if that pays off, whole otherwise.
+
+        Returns
+        -------
+        (offset, size) of the object.
+
+        """
+        pack = self._pack_path(device)
+        kind, depth, base_offset, base_size, payload = b"F", 0, 0, 0, text.encode("utf-8")
+
+        if base is not None:
+            with open(pack, "rb") as f:
+                base_depth = _read_object(f, base[2], base[3])[3]
+                if base_depth + 1 < KEYFRAME_INTERVAL:
+                    delta = make_delta(_lines(f, base[2], base[3]), text.split("\n"))
+                    delta = json.dumps(delta, separators=(",", ":")).encode("utf-8")
+                    # unrelated configs make deltas bigger than the text
+                    if len(delta) < len(payload) // 2:
+                        kind, depth, base_offset, base_size, payload = b"D", base_depth + 1, base[2], base[3], delta
+
+        codec, payload = _compress(payload)
+        data = HEADER.pack(MAGIC, kind, codec, depth, base_offset, base_size) + payload
+        summary.count("archive deltas" if kind == b"D" else "archive keyframes")
+        return _append(pack, data), len(data)
+
+    # -- reading
+
+    def _records(self, device):
+        "Every (timestamp, sha, offset, size) record of `device`."
+        try:
+            with open(self._index_path(device), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        return list(RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]))
+
+    def _last_record(self, device):
+        "Latest (timestamp, sha, offset, size) record of `device`, None if there is none."
+        try:
+            with open(self._index_path(device), "rb") as f:
+                return _last(f)
+        except FileNotFoundError:
+            return None
+
+    def _text(self, device, record):
+        with open(self._pack_path(device), "rb") as f:
+            return "\n".join(_lines(f, record[2], record[3]))
+
+    def latest(self, device):
+        """
+        Returns
+        -------
+        (timestamp, text)
+            Latest version of `device`, None if it has none.
+
+        """
+        record = self._last_record(device)
+        if record is None:
+            return None
+        return record[0], self._text(device, record)
+
+    def history(self, device, start=None, end=None):
+        """
+        Versions of `device` recorded from `start` up to, not including,
+        `end`.  Both are unix times, None for no bound.
+
+        Returns
+        -------
+        list of (timestamp, sha)
+            In time order, `sha` in hex for `read`.
+
+        """
+        return [(r[0], r[1].hex()) for r in self._range(device, start, end)]
+
+    def _range(self, device, start, end):
+        try:
+            f = open(self._index_path(device), "rb")
+        except FileNotFoundError:
+            return []
+
+        with f:
+            f.seek(0, os.SEEK_END)
+            count = f.tell() // RECORD.size
+            lo = 0 if start is None else _bisect(f, count, start)
+            hi = count if end is None else _bisect(f, count, end)
+            if hi <= lo:
+                return []
+            f.seek(lo * RECORD.size)
+            data = f.read((hi - lo) * RECORD.size)
+
+        return list(RECORD.iter_unpack(data))
+
+    def read(self, device, sha):
+        """
+        Config text of version `sha` of `device`, as returned by `history`.
+        """
+        sha = bytes.fromhex(sha)
+        record = next((r for r in reversed(self._records(device)) if r[1] == sha), None)
+        if record is None:
+            raise ArchiveError("{} has no version {}".format(device, sha.hex()))
+        return self._text(device, record)
+
+    def get(self, device, at=None):
+        """
+        Config text of `device` as it was at unix time `at`, the latest
+        if None.  None if it has no version that old.
+        """
+        if at is None:
+            latest = self.latest(device)
+            return latest[1] if latest else None
+
+        records = self._range(device, None, at + 1e-6)
+        if not records:
+            return None
+        return self._text(device, records[-1])
+
+    def devices(self):
+        "Names of every archived device."
+        root = os.path.join(self.directory, "index")
+        names = []
+        for path, _, files in os.walk(root):
+            for name in files:
+                if name.endswith(".idx"):
+                    names.append(os.path.relpath(os.path.join(path, name[:-4]), root).replace(os.sep, "/"))
+        return sorted(names)
+
+
+def _read_object(f, offset, size):
+    "(kind, codec, payload, depth, base offset, base size) of the object at `offset` of pack `f`."
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size or data[:4] != MAGIC:
+        raise ArchiveError("corrupt object at {} of {}".format(offset, f.name))
+    _, kind, codec, depth, base_offset, base_size = HEADER.unpack(data[:HEADER.size])
+    return kind, codec, data[HEADER.size:], depth, base_offset, base_size
+
+
+def _lines(f, offset, size):
+    "Lines of the object at `offset` of pack `f`, applying its delta chain."
+    chain = []
+    while True:
+        kind, codec, payload, _, offset, size = _read_object(f, offset, size)
+        payload = _decompress(codec, payload).decode("utf-8")
+        if kind == b"F":
+            lines = payload.split("\n")
+            break
+        chain.append(json.loads(payload))
+
+    for delta in reversed(chain):
+        lines = apply_delta(lines, delta)
+    return lines
+
+
+def _bisect(f, count, timestamp):
+    "Number of records in index file `f` older than `timestamp`."
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid * RECORD.size)
+        if RECORD.unpack(f.read(RECORD.size))[0] < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _last(f):
+    "Last whole record of index file `f`, None if there is none."
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size < RECORD.size:
+        return None
+    f.seek(size - size % RECORD.size - RECORD.size)
+    return RECORD.unpack(f.read(RECORD.size))
+
+
+@contextmanager
+def _locked(path):
+    """
+    Index file `path` opened for update and locked against other
+    processes, e.g. `run` and `serve` sharing an archive.  A record
+    torn by a crash is cut off so the next one is written in line.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0, os.SEEK_END)
+            torn = f.tell() % RECORD.size
+            if torn:
+                logging.warning("Dropping %d bytes of a torn record at the end of %s", torn, path)
+                f.truncate(f.tell() - torn)
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _append(path, data):
+    "Append `data` to file `path`, returns the offset it was written at."
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(data)
+    return offset
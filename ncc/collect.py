@@ -1,82 +1,265 @@
 
 import re
 import sys
+import time
+import random
+import asyncio
 import logging
+import traceback
+import contextvars
 
-import xmltodict
+from nornir.core.task import AggregatedResult, MultiResult, Result
 
-from ncc.platforms.cisco_ios import CiscoIOS
-from ncc.platforms.cisco_asa import CiscoASA
-from ncc.platforms.cisco_wlc import CiscoWLC
-from ncc.platforms.cisco_nxos import CiscoNXOS
-from ncc.platforms.dell_os6 import DellOS6
-from ncc.platforms.juniper_junos import JuniperJunos
-from ncc.platforms.paloalto_panos import PaloaltoPanos
-from ncc.platforms.opengear_linux import OpengearLinux
-
-
-class UnsupportedPlatform(Exception):
-    pass
+from ncc.libs.transport.aiossh import AsyncSSH
+from ncc.libs.transport.limits import limiter
+from ncc.platforms import get_platform, UnsupportedPlatform
+from ncc.spool import spool
+from ncc.summary import summary
 
 
 class MissingHandler(Exception):
     pass
 
 
-# Maps Netbox Platfrom field to ncc platform Class
-platform_map = {
-    "ios": CiscoIOS,
-    "nxos": CiscoNXOS,
-    "asa": CiscoASA,
-    "cisco_wlc": CiscoWLC,
-    "panos": PaloaltoPanos,
-    "opengear": OpengearLinux,
-    "junos": JuniperJunos,
-    "dell_os6": DellOS6,
-}
-
-
 faild_hosts = list()
 
+# Errors that fail the same way on every attempt, matched by class name
+# so the libraries raising them don't have to be imported.
+PERMANENT_ERRORS = {
+    "NetMikoAuthenticationException",  # netmiko
+    "AuthenticationException",  # paramiko
+    "ConnectAuthError",  # napalm
+    "PermissionDenied",  # asyncssh
+    "MissingDependency",
+}
+
 # logging.basicConfig(filename="test1.txt", level=logging.DEBUG)
 # logger = logging.getLogger("netmiko")
 
 
-def configs(devices, hide_secrets, retries):
-    results = devices.run(task=_collect, hide_secrets=hide_secrets)
+class RetryPolicy(object):
+    """
+    When and how often failed hosts are collected again.
+
+    Parameters
+    ----------
+    retries : int
+        Attempts after the first one.
+    backoff : float
+        Upper bound of the delay before the first retry in seconds,
+        doubled for every further retry.
+    max_backoff : float
+        Upper bound of any delay.
+
+    """
+    def __init__(self, retries, backoff=2.0, max_backoff=60.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        "Seconds to wait before retry number `attempt`, starting at 1."
+        # full jitter, so hosts that failed together don't retry together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def permanent(self, multi):
+        "Whether the failed `multi` result would fail again on a retry."
+        exc = multi[0].exception if multi else None
+        if isinstance(exc, (UnsupportedPlatform, MissingHandler)):
+            return True
+        return any(cls.__name__ in PERMANENT_ERRORS for cls in type(exc).__mro__)
+
+    def retryable(self, results):
+        "Names of the failed hosts in `results` worth another attempt."
+        names = list()
+        for name, multi in results.failed_hosts.items():
+            if self.permanent(multi):
+                logging.info("Not retrying %s: %s", name, multi[0].exception)
+            else:
+                names.append(name)
+        return names
+
+
+def configs(devices, hide_secrets, retries, num_workers=None, engine="thread", state=None):
+    """
+    Collect configs from every host in `devices`.
+
+    Failed hosts are collected again up to `retries` times, after an
+    exponential backoff, unless their error is permanent (see
+    `RetryPolicy`).  The returned results hold the last attempt of
+    every host.
+
+    When a `state.StateStore` is given, devices whose change marker
+    matches the one stored from the last run are not fetched again.
+
+    `engine` is "thread", nornir's thread pool with one blocking session
+    per worker, or "async", one event loop where platforms with `ASYNC`
+    set use an asyncio SSH transport.
+    """
+    policy = RetryPolicy(retries)
+
+    if engine == "async":
+        return devices, _configs_async(devices, hide_secrets, policy, num_workers, state)
+
+    def run(nr):
+        results = nr.run(task=_collect, num_workers=num_workers, on_failed=True, hide_secrets=hide_secrets, state=state)
+        for name, multi in results.items():
+            if not multi.failed:
+                devices.data.recover_host(name)
+        return results
+
+    results = run(devices)
+
+    return devices, _retry(results, policy, lambda names: run(devices.filter(filter_func=lambda h: h.name in names)))
+
+
+def _retry(results, policy, run):
+    """
+    Collect the failed hosts of `results` again until they succeed,
+    fail permanently or `policy` runs out of retries.
+
+    `run(names)` collects the named hosts and returns their
+    AggregatedResult, which replaces their entries in `results`.
+    """
+    for attempt in range(1, policy.retries + 1):
+        names = policy.retryable(results)
+        if not names:
+            break
+
+        delay = policy.delay(attempt)
+        logging.info("Retrying %d failed hosts in %.1fs, attempt %d of %d", len(names), delay, attempt, policy.retries)
+        time.sleep(delay)
 
-    retried = 0
-    if results.failed and retried < retries:
-        r = devices.run(task=_collect, on_failed=True, on_good=False, hide_secrets=hide_secrets)
-        retried += 1
+        summary.count("host retries", len(names))
+        results.update(run(set(names)))
 
-    return devices, results
+    return results
 
 
-def _collect(task, hide_secrets):
-    platform = task.host.platform
+def _collect(task, hide_secrets, state=None):
+    with _labels(task.host), summary.timer("device"):
+        # fail before connecting if the platform has no driver
+        get_platform(task.host.platform)
 
-    if platform not in platform_map.keys():
-        raise UnsupportedPlatform("'{}' not in {}".format(platform, platform_map.keys()))
+        with limiter.slot(task.host.platform, task.host.data.get("site")):
+            netcon = connect(hide_secrets, _conn_params(task.host), _last_marker(state, task.host))
 
-    device_type = platform_map[platform]
-    
-    params = {
-        "platform": platform,
-        "host": task.host.hostname,
-        "username": task.host.username,
-        "password": task.host.password
+        _store(task.host, netcon)
+
+
+def _labels(host):
+    "Label the timings recorded while collecting `host`."
+    return summary.labels(device=host.name, platform=host.platform, site=host.data.get("site"))
+
+
+def connect(hide_secrets, conn_params, last_marker=None):
+    return get_platform(conn_params["platform"])(hide_secrets, last_marker=last_marker, **conn_params)
+
+
+def _conn_params(host):
+    return {
+        "platform": host.platform,
+        "host": host.hostname,
+        "username": host.username,
+        "password": host.password
     }
 
-    netcon = connect(hide_secrets, params)
 
-    task.host["configs"] = netcon.metadata
-    task.host["configs"] += netcon.config
+def _last_marker(state, host):
+    return state.get(host.name) if state else None
+
+
+def _store(host, netcon):
+    "Save what was collected from `netcon` on the nornir host."
+    summary.add_timings(host.platform, getattr(netcon, "timings", {}))
+
+    # written to the state store once the config has been pushed
+    host["marker"] = getattr(netcon, "marker", None)
+
+    if netcon.config is None:
+        summary.count("fetches skipped (unchanged)")
+        return
+
+    summary.count("configs fetched")
+    # only a reference stays in the inventory, the text is on disk
+    with summary.timer("spool"):
+        host["configs"] = spool.write(host.name, [netcon.metadata, netcon.config])
+
+
+def _configs_async(devices, hide_secrets, policy, num_workers, state=None):
+    """
+    Async engine for `configs()`.  Returns a nornir AggregatedResult
+    just like `Nornir.run` does so callers don't need to care which
+    engine was used.
+    """
+    num_workers = num_workers or devices.config.core.num_workers
+    hosts = list(devices.inventory.hosts.values())
+
+    results = asyncio.run(_collect_all(hosts, hide_secrets, num_workers, state))
+
+    results = _retry(results, policy, lambda names: asyncio.run(
+        _collect_all([devices.inventory.hosts[n] for n in names], hide_secrets, num_workers, state)))
+
+    for name, multi in results.items():
+        if multi.failed:
+            devices.data.failed_hosts.add(name)
+        else:
+            devices.data.recover_host(name)
+
+    return results
+
+
+async def _collect_all(hosts, hide_secrets, num_workers, state=None):
+    results = AggregatedResult("_collect")
+    sem = asyncio.Semaphore(num_workers)
+
+    async def run(host):
+        async with sem:
+            results[host.name] = await _collect_async(host, hide_secrets, state)
+
+    await asyncio.gather(*[run(h) for h in hosts])
+
+    return results
+
+
+async def _collect_async(host, hide_secrets, state=None):
+    with _labels(host), summary.timer("device"):
+        return await _collect_host_async(host, hide_secrets, state)
+
+
+async def _collect_host_async(host, hide_secrets, state=None):
+    multi = MultiResult("_collect")
 
+    try:
+        device_type = get_platform(host.platform)
+        params = _conn_params(host)
+        last_marker = _last_marker(state, host)
 
-def connect(hide_secrets, conn_params):
-    return platform_map[conn_params["platform"]](hide_secrets, **conn_params)
+        async with limiter.slot_async(host.platform, host.data.get("site")):
+            if device_type.ASYNC:
+                netcon = device_type(hide_secrets, connect=False, **params)
+                netcon.config = None
+                async with AsyncSSH(params["host"], params["username"], params["password"], port=host.port or 22) as conn:
+                    with summary.timer("change marker"):
+                        netcon.marker = await netcon.fetch_change_marker(conn)
 
+                    if not netcon.marker or netcon.marker != last_marker:
+                        with summary.timer("fetch"):
+                            netcon.config = await netcon.fetch_config(conn)
+                            netcon.metadata = await netcon.fetch_metadata(conn)
+            else:
+                # Platforms without async support (API based ones like
+                # PAN-OS) fall back to a thread from the default executor.
+                loop = asyncio.get_event_loop()
+                # copy the context so the thread's timings keep the host
+                # labels and its connect is reported to the limiter slot
+                run = contextvars.copy_context().run
+                netcon = await loop.run_in_executor(None, run, connect, hide_secrets, params, last_marker)
 
+        _store(host, netcon)
+        multi.append(Result(host, name="_collect"))
 
+    except Exception as e:
+        multi.append(Result(host, result=traceback.format_exc(), exception=e, failed=True, name="_collect"))
 
+    return multi
@@ -0,0 +1,270 @@
+"""
+Long running collection, `ncc.py serve`.
+
+A cron run collects the whole fleet at once every interval and then
+sits idle, so NetBox, GitHub and the devices see a burst of load and
+every run starts from scratch: inventory, GitHub tree, compiled
+filters and device sessions.  The daemon keeps all of that in memory
+and collects each device on its own schedule instead:
+
+    - every device has a slot within `interval`, an offset derived from
+      its name, so collections are spread evenly and a device keeps its
+      slot when the inventory changes.  Each collection is moved by a
+      random jitter of up to `jitter` of the interval, either way.
+    - a failed device is retried after the `collect.RetryPolicy`
+      backoff, and waits for its next slot once retries run out or the
+      error is permanent.
+    - changed configs are pushed every `push_interval` seconds.
+    - the inventory is loaded again every `inventory_interval` seconds
+      and on SIGHUP.  New devices get a slot, removed ones are dropped
+      when their slot comes up.
+    - SIGTERM and SIGINT stop handing out devices, wait for the running
+      collections and push what is pending.
+
+"""
+
+import time
+import heapq
+import random
+import signal
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from ncc import collect
+from ncc import schedule
+from ncc import write
+from ncc.summary import summary
+
+
+def slot(name, interval):
+    "Offset of device `name` within `interval`, the same on every run."
+    return zlib.crc32(name.encode("utf-8")) / 2 ** 32 * interval
+
+
+class Daemon(object):
+    """
+    Parameters
+    ----------
+    load_devices : callable
+        Called as `load_devices(previous)` with the current nornir
+        object, None the first time, returns one with a fresh inventory.
+    accumulator : write.Accumulator
+        Where collected configs go, flushed every `push_interval`.
+    hide_secrets : bool
+        Passed to `collect.configs`.
+    retries : int
+        Times a failed device is collected again before its next slot.
+    interval : float
+        Seconds between two collections of the same device.
+    jitter : float
+        Fraction of `interval` a collection is moved at random, either way.
+    num_workers : int
+        Maximum number of devices collected at the same time.
+    push_interval : float
+        Seconds between pushes of the changed configs.
+    inventory_interval : float
+        Seconds between inventory reloads.
+    state : ncc.state.StateStore
+        Passed to `collect.configs` to skip unchanged devices.
+    on_interval : callable
+        Called with no arguments once per `interval`, e.g. to write
+        the summary of the interval.
+
+    """
+    def __init__(self, load_devices, accumulator, hide_secrets, retries, interval, jitter=0.1, num_workers=15,
+                 push_interval=300, inventory_interval=900, state=None, on_interval=None):
+        self.load_devices = load_devices
+        self.accumulator = accumulator
+        self.hide_secrets = hide_secrets
+        self.policy = collect.RetryPolicy(retries)
+        self.interval = interval
+        self.jitter = jitter
+        self.num_workers = num_workers
+        self.push_interval = push_interval
+        self.inventory_interval = inventory_interval
+        self.state = state
+        self.on_interval = on_interval
+
+        self.devices = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._reload = threading.Event()
+        # (due time, seq, hostname), stale entries are skipped
+        self._queue = []
+        self._seq = 0
+        # hostname -> due time of its queue entry
+        self._due = dict()
+        # hostname -> start of its current slot, jitter and retries left out
+        self._slot = dict()
+        self._attempts = dict()
+        self._running = set()
+
+    def stop(self, *args):
+        "Finish the running collections, push and return from `run`."
+        self._stop.set()
+        self._wake.set()
+
+    def reload(self, *args):
+        "Load the inventory again before handing out the next device."
+        self._reload.set()
+        self._wake.set()
+
+    def run(self):
+        """
+        Collect until `stop` is called or SIGTERM/SIGINT are received.
+
+        Must be called from the main thread to install the signal
+        handlers.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+
+        self._load()
+        now = time.monotonic()
+        next_push = now + self.push_interval
+        next_load = now + self.inventory_interval
+        next_report = now + self.interval
+
+        with ThreadPoolExecutor(max_workers=max(1, self.num_workers), thread_name_prefix="ncc-serve") as pool:
+            while not self._stop.is_set():
+                now = time.monotonic()
+
+                if self._reload.is_set() or now >= next_load:
+                    self._reload.clear()
+                    self._load()
+                    next_load = now + self.inventory_interval
+
+                if now >= next_push:
+                    self.accumulator.flush()
+                    next_push = now + self.push_interval
+
+                if now >= next_report:
+                    if self.on_interval:
+                        self.on_interval()
+                    next_report = now + self.interval
+
+                for name in self._ready(now):
+                    pool.submit(self._collect, name)
+
+                wake = min(next_push, next_load, next_report)
+                with self._lock:
+                    if self._queue:
+                        wake = min(wake, self._queue[0][0])
+                self._wake.wait(max(0.0, wake - time.monotonic()))
+                self._wake.clear()
+
+            logging.info("Stopping, waiting for %d running collections", len(self._running))
+
+        self.accumulator.flush()
+
+    def _load(self):
+        "Load the inventory and give new devices a slot."
+        try:
+            with summary.timer("inventory"):
+                devices = self.load_devices(self.devices)
+        except Exception:
+            logging.exception("Inventory reload failed, keeping the current inventory")
+            if self.devices is None:
+                raise
+            return
+
+        now, wall = time.monotonic(), time.time()
+        with self._lock:
+            self.devices = devices
+            hosts = devices.inventory.hosts
+            for name in hosts:
+                if name not in self._slot:
+                    # slots are offsets from the epoch, so a device keeps
+                    # its slot across restarts of the daemon too
+                    self._slot[name] = now + (slot(name, self.interval) - wall) % self.interval
+                    self._push(name, self._slot[name])
+            for name in list(self._slot):
+                if name not in hosts and name not in self._running:
+                    self._forget(name)
+
+        logging.info("Serving %d devices", len(hosts))
+        summary.peak("devices served", len(hosts))
+
+    def _push(self, name, due):
+        self._seq += 1
+        self._due[name] = due
+        heapq.heappush(self._queue, (due, self._seq, name))
+
+    def _forget(self, name):
+        for d in (self._slot, self._due, self._attempts):
+            d.pop(name, None)
+
+    def _ready(self, now):
+        "Names of the devices whose time has come."
+        ready = []
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                due, _, name = heapq.heappop(self._queue)
+                if self._due.get(name) != due or name in self._running:
+                    continue
+                if name not in self.devices.inventory.hosts:
+                    self._forget(name)
+                    continue
+                self._running.add(name)
+                ready.append(name)
+        return ready
+
+    def _collect(self, name):
+        "Collect one device, hand its config to the accumulator and schedule it again."
+        delay = None
+        devices = self.devices
+        try:
+            host = schedule.subset(devices, [name])
+            _, results = collect.configs(host, self.hide_secrets, 0, num_workers=1, state=self.state)
+
+            multi = results.get(name)
+            if multi is not None and multi.failed:
+                delay = self._retry_delay(name, multi)
+            else:
+                self._attempts.pop(name, None)
+                data = devices.inventory.hosts[name].data
+                configs, markers = write.host_configs(data.get("site"), host.inventory.hosts)
+                self.accumulator.add(configs, markers)
+                # the accumulator holds what's left of it
+                data.pop("configs", None)
+        except Exception:
+            logging.exception("Collecting %s failed", name)
+        finally:
+            with self._lock:
+                self._running.discard(name)
+                if name in self._slot:
+                    self._schedule(name, delay)
+            self._wake.set()
+
+    def _retry_delay(self, name, multi):
+        "Seconds until `name` is collected again, None to wait for its next slot."
+        attempt = self._attempts.get(name, 0) + 1
+        if self.policy.permanent(multi):
+            logging.warning("Not retrying %s until its next slot: %s", name, multi.exception)
+        elif attempt <= self.policy.retries:
+            self._attempts[name] = attempt
+            summary.count("host retries")
+            return self.policy.delay(attempt)
+        else:
+            logging.warning("%s failed %d times, waiting for its next slot", name, attempt)
+
+        self._attempts.pop(name, None)
+        return None
+
+    def _schedule(self, name, delay=None):
+        now = time.monotonic()
+        if delay is not None:
+            self._push(name, now + delay)
+            return
+
+        # the next slot that hasn't passed yet, skipping any missed
+        # while the device was slow, so slots never drift
+        base = self._slot[name] + self.interval
+        if base <= now:
+            base += ((now - base) // self.interval + 1) * self.interval
+        self._slot[name] = base
+        self._push(name, base + random.uniform(-1, 1) * self.jitter * self.interval)
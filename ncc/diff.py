@@ -0,0 +1,440 @@
+"""
+Diff stage, what changed in each config since it was last pushed.
+
+The configs pushed last are kept in a local cache, so a changed config
+is compared with its previous version without fetching anything from
+the repo:
+
+    stage = DiffStage()
+    change = stage.diff(config)     # after redaction, before the push
+    change.diff                     # unified diff
+    change.sections                 # e.g. ['interface Gi0/1', 'router bgp 65000']
+    stage.commit(configs)           # once the push succeeded
+
+Lines are diffed by their hash, as integer ids, anchored on the lines
+that occur once in both versions (see `line_diff`), so a config of tens
+of thousands of lines diffs in milliseconds.
+
+Drivers with `SECTION_DEPTH` set have the changed lines classified by
+the config section they are in, using indentation: depth 1 for IOS
+style configs ('interface Gi0/1', 'router bgp 65000', 'ip route'),
+depth 2 for Junos ('interfaces ge-0/0/0', 'protocols bgp').
+
+"""
+
+import os
+import bisect
+from collections import Counter
+from difflib import SequenceMatcher
+
+from ncc.platforms import get_platform, UnsupportedPlatform
+from ncc.spool import SpooledConfig, as_text
+from ncc.summary import summary
+
+
+DEFAULT_DIFF_DIR = os.path.join(os.path.expanduser("~"), ".ncc", "diffs")
+
+# lines of context around changes, as with `diff -u`
+CONTEXT = 3
+
+# top level statements named by their first two words, e.g. 'ip route'
+TWO_WORD_STATEMENTS = {"ip", "ipv6"}
+
+# sections listed per device in the commit message
+MAX_SECTIONS = 8
+
+
+class Change(object):
+    """
+    How one config differs from the version pushed last.
+
+    Attributes
+    ----------
+    path : str
+        Config path in the repo, e.g. 'usden1/r1.cfg'.
+    new : bool
+        No previous version in the cache.
+    diff : str
+        Unified diff, None for a new config.
+    added, removed : int
+        Lines added and removed.
+    sections : list of str
+        Config sections with changed lines, in config order.  Empty
+        for platforms without `SECTION_DEPTH`.
+
+    """
+    def __init__(self, path, new=False, diff=None, added=0, removed=0, sections=None):
+        self.path = path
+        self.new = new
+        self.diff = diff
+        self.added = added
+        self.removed = removed
+        self.sections = sections or []
+
+    def describe(self):
+        "One line summary, e.g. 'interface Gi0/1, router bgp 65000 (+3 -1)'."
+        if self.new:
+            return "new"
+        text = ", ".join(self.sections[:MAX_SECTIONS])
+        if len(self.sections) > MAX_SECTIONS:
+            text += " and {} more".format(len(self.sections) - MAX_SECTIONS)
+        counts = "+{} -{}".format(self.added, self.removed)
+        return "{} ({})".format(text, counts) if text else counts
+
+
+def line_diff(a, b):
+    """
+    Opcodes turning lines `a` into lines `b`, as from
+    `SequenceMatcher.get_opcodes`.
+
+    Lines are matched patience style: lines that occur exactly once on
+    both sides anchor the diff, and only the gaps between anchors are
+    diffed further.  Config lines like 'interface Gi1/0/12' are mostly
+    unique, so this stays close to linear where `SequenceMatcher` on
+    the whole config is quadratic.
+
+    >>> line_diff(['a', 'b', 'c'], ['a', 'x', 'c'])
+    [('equal', 0, 1, 0, 1), ('replace', 1, 2, 1, 2), ('equal', 2, 3, 2, 3)]
+
+    """
+    # the same line gets the same id in both
+    ids = dict()
+    ha = [ids.setdefault(line, len(ids)) for line in a]
+    hb = [ids.setdefault(line, len(ids)) for line in b]
+
+    codes = []
+    i = j = 0
+    for mi, mj, n in _matching_blocks(ha, hb) + [(len(a), len(b), 0)]:
+        if i < mi and j < mj:
+            codes.append(("replace", i, mi, j, mj))
+        elif i < mi:
+            codes.append(("delete", i, mi, j, j))
+        elif j < mj:
+            codes.append(("insert", i, i, j, mj))
+        if n:
+            codes.append(("equal", mi, mi + n, mj, mj + n))
+        i, j = mi + n, mj + n
+    return codes
+
+
+def _matching_blocks(a, b):
+    "(i, j, n) runs of equal items of lists `a` and `b`, in order."
+    matches = []
+    ranges = [(0, len(a), 0, len(b))]
+    while ranges:
+        alo, ahi, blo, bhi = ranges.pop()
+
+        # common head and tail
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_lcs(a, alo, ahi, b, blo, bhi)
+        if not anchors:
+            # nothing unique to go by, e.g. a run of '!' lines
+            sm = SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=(ahi - alo) * (bhi - blo) > 10 ** 6)
+            for i, j, n in sm.get_matching_blocks():
+                matches.extend((alo + i + k, blo + j + k) for k in range(n))
+            continue
+
+        for i, j in anchors:
+            matches.append((i, j))
+            ranges.append((alo, i, blo, j))
+            alo, blo = i + 1, j + 1
+        ranges.append((alo, ahi, blo, bhi))
+
+    matches.sort()
+    blocks = []
+    for i, j in matches:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([i, j, 1])
+    return [tuple(block) for block in blocks]
+
+
+def _unique_lcs(a, alo, ahi, b, blo, bhi):
+    "Longest increasing run of (i, j) pairs of items occurring once in a[alo:ahi] and once in b[blo:bhi]."
+    count_a = Counter(a[alo:ahi])
+    where = dict()
+    for j in range(blo, bhi):
+        item = b[j]
+        if count_a[item] == 1:
+            where[item] = None if item in where else j
+    pairs = [(i, where[a[i]]) for i in range(alo, ahi) if where.get(a[i]) is not None and count_a[a[i]] == 1]
+    if not pairs:
+        return []
+
+    # patience sort on j, with back pointers to rebuild the sequence
+    tops, top_js, back = [], [], []
+    for k, (_, j) in enumerate(pairs):
+        pile = bisect.bisect_left(top_js, j)
+        back.append(tops[pile - 1] if pile else None)
+        if pile == len(tops):
+            tops.append(k)
+            top_js.append(j)
+        else:
+            tops[pile] = k
+            top_js[pile] = j
+
+    result = []
+    k = tops[-1]
+    while k is not None:
+        result.append(pairs[k])
+        k = back[k]
+    return result[::-1]
+
+
+def _grouped(codes, n=CONTEXT):
+    "Hunks of `codes` with up to `n` lines of context, like `SequenceMatcher.get_grouped_opcodes`."
+    codes = [c for c in codes if c[1] != c[2] or c[3] != c[4]]
+    if not codes or (len(codes) == 1 and codes[0][0] == "equal"):
+        return
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # split hunks at long stretches of unchanged lines
+        if tag == "equal" and i2 - i1 > n * 2:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _range(start, stop):
+    "'start,length' of a hunk header, as `diff -u` writes it."
+    length = stop - start
+    beginning = start + 1
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return "{},{}".format(beginning, length)
+
+
+def unified_diff(a, b, codes, fromfile, tofile, n=CONTEXT):
+    "Unified diff text of lines `a` and `b`, from their `line_diff` opcodes."
+    out = []
+    for group in _grouped(codes, n):
+        if not out:
+            out.append("--- {}\n+++ {}\n".format(fromfile, tofile))
+        first, last = group[0], group[-1]
+        out.append("@@ -{} +{} @@\n".format(_range(first[1], last[2]), _range(first[3], last[4])))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                out.extend(" " + line + "\n" for line in a[i1:i2])
+                continue
+            out.extend("-" + line + "\n" for line in a[i1:i2])
+            out.extend("+" + line + "\n" for line in b[j1:j2])
+    return "".join(out)
+
+
+def indentation(line):
+    "Number of leading whitespace characters of `line`."
+    return len(line) - len(line.lstrip())
+
+
+def ignored(text):
+    "Lines that don't belong to a section: blank, '!', '}' and comments."
+    return not text or text in ("!", "}") or text.startswith("#")
+
+
+def _keyword(text):
+    "Statement of a top level line without its values, e.g. 'ip route'."
+    words = text.rstrip(";").split()
+    if words[0] == "no" and len(words) > 1:
+        words = words[1:]
+    n = 2 if words[0] in TWO_WORD_STATEMENTS else 1
+    return " ".join(words[:n])
+
+
+def sections(lines, changed, depth):
+    """
+    Sections of the lines numbered `changed`.
+
+    A section is the chain of enclosing block headers of a line, found
+    by indentation, cut at `depth`.  Headers are kept whole, a line
+    without children is reduced to its `_keyword`.  Lines of the
+    metadata banner are in section 'metadata'.
+
+    >>> cfg = ['hostname r1', 'interface Gi0/1', ' description uplink', 'ip route 0.0.0.0 0.0.0.0 192.0.2.1']
+    >>> sections(cfg, [0, 2, 3], 1)
+    ['hostname', 'interface Gi0/1', 'ip route']
+
+    """
+    changed = set(changed)
+    found = dict()
+    meta_end = 0
+    if lines and "METADATA" in lines[0]:
+        meta_end = next((i + 1 for i, line in enumerate(lines) if "END-METADATA" in line), len(lines))
+        if any(i < meta_end for i in changed):
+            found["metadata"] = None
+
+    # enclosing headers of the current line, (indent, text)
+    stack = []
+    last = max(changed) if changed else -1
+    for i in range(meta_end, last + 1):
+        text = lines[i].strip()
+        if ignored(text):
+            continue
+        indent = indentation(lines[i])
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+
+        if i in changed and len(stack) < depth:
+            header = _is_header(lines, i, indent)
+            element = text.rstrip(" {") if header else _keyword(text)
+            path = [t for _, t in stack] + [element]
+        elif i in changed:
+            path = [t for _, t in stack[:depth]]
+        else:
+            path = None
+
+        if path:
+            found.setdefault(" ".join(path[:depth]), None)
+
+        if len(stack) < depth:
+            stack.append((indent, text.rstrip(" {")))
+
+    return list(found)
+
+
+def _is_header(lines, i, indent):
+    "Whether line `i` has children, the next line that counts is indented deeper."
+    for line in lines[i + 1:]:
+        text = line.strip()
+        if not ignored(text):
+            return indentation(line) > indent
+    return False
+
+
+class DiffStage(object):
+    """
+    Parameters
+    ----------
+    directory : str
+        Where the configs pushed last and their diffs are kept, as
+        'configs/<path>' and 'diffs/<path>.diff'.
+
+    """
+    def __init__(self, directory=DEFAULT_DIFF_DIR):
+        self.directory = directory
+
+    def _cached(self, path):
+        return os.path.join(self.directory, "configs", path)
+
+    def diff(self, config):
+        """
+        Parameters
+        ----------
+        config : dict
+            'path', 'content' and 'platform', as from `write.host_configs`.
+
+        Returns
+        -------
+        `Change`
+
+        """
+        cached = self._cached(config["path"])
+        if not os.path.exists(cached):
+            return Change(config["path"], new=True)
+
+        with summary.timer("diff"):
+            with open(cached, encoding="utf-8", newline="") as f:
+                old = f.read().split("\n")
+            new = as_text(config["content"]).split("\n")
+
+            codes = line_diff(old, new)
+            change = Change(
+                config["path"],
+                diff=unified_diff(old, new, codes, "a/" + config["path"], "b/" + config["path"]),
+                added=sum(j2 - j1 for tag, _, _, j1, j2 in codes if tag != "equal"),
+                removed=sum(i2 - i1 for tag, i1, i2, _, _ in codes if tag != "equal"),
+            )
+
+            depth = _section_depth(config.get("platform"))
+            if depth:
+                removed = [i for tag, i1, i2, _, _ in codes if tag != "equal" for i in range(i1, i2)]
+                added = [j for tag, _, _, j1, j2 in codes if tag != "equal" for j in range(j1, j2)]
+                found = dict.fromkeys(sections(new, added, depth))
+                found.update(dict.fromkeys(sections(old, removed, depth)))
+                change.sections = list(found)
+
+        summary.count("configs diffed")
+        return change
+
+    def seed(self, config):
+        "Cache an unchanged `config` if it is missing, e.g. on the first run."
+        if not os.path.exists(self._cached(config["path"])):
+            self._store(config)
+
+    def commit(self, configs):
+        "Make the pushed `configs` the versions the next run is compared with."
+        for config in configs:
+            self._store(config)
+            change = config.get("change")
+            if change is not None and change.diff is not None:
+                _write(os.path.join(self.directory, "diffs", config["path"] + ".diff"), change.diff)
+
+    def _store(self, config):
+        path = self._cached(config["path"])
+        content = config["content"]
+        if isinstance(content, SpooledConfig):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            content.copy_to(tmp)
+            os.replace(tmp, path)
+        else:
+            _write(path, content)
+
+
+def _section_depth(platform):
+    if not platform:
+        return None
+    try:
+        return get_platform(platform).SECTION_DEPTH
+    except UnsupportedPlatform:
+        return None
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def commit_message(changes):
+    """
+    Commit message listing every changed device and its sections.
+
+    Parameters
+    ----------
+    changes : list of `Change`
+
+    """
+    names = [os.path.splitext(os.path.basename(c.path))[0] for c in changes]
+    subject = "Config changes on {} device{}: {}".format(
+        len(changes), "" if len(changes) == 1 else "s", ", ".join(names[:3]))
+    if len(names) > 3:
+        subject += " and {} more".format(len(names) - 3)
+
+    body = ["{}: {}".format(os.path.splitext(c.path)[0], c.describe()) for c in sorted(changes, key=lambda c: c.path)]
+    return subject + "\n\n" + "\n".join(body) + "\n"
@@ -0,0 +1,133 @@
+"""
+On-disk cache of the NetBox inventory.
+
+`InventoryCache` keeps the host dicts built by `NBInventory`, keyed by
+NetBox device id, with the time they were fetched.  Later runs only ask
+NetBox for devices updated since then and merge them in.  Devices no
+longer monitored are in such a delta and dropped from the cache, but
+deleted or untagged devices never show up in it, so the cache is fully
+refreshed once it is older than its TTL.
+
+The list of active sites, which the device queries are made for, is
+kept next to it with `save_sites()` so a run without `--site` can fall
+back to the cache too when NetBox can't be reached.
+
+"""
+
+import os
+import json
+import time
+
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".ncc", "inventory.json")
+
+
+class InventoryCache(object):
+    """
+    Parameters
+    ----------
+    path : str
+        JSON file to load from and save to.  Created on first save.
+    source : str
+        What the cached devices were fetched from, e.g. the NetBox url
+        and filters.  A cache saved for a different source is ignored.
+
+    Attributes
+    ----------
+    devices : dict
+        Maps NetBox device id (as str) to `[name, host]`.
+    fetched_at : float
+        Epoch time of the last full or delta fetch, None if empty.
+    refreshed_at : float
+        Epoch time of the last full fetch, None if empty.
+
+    """
+    def __init__(self, path=DEFAULT_CACHE_FILE, source=None):
+        self.path = path
+        self.source = source
+        self.devices = dict()
+        self.fetched_at = None
+        self.refreshed_at = None
+
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("source") == source:
+                self.devices = data["devices"]
+                self.fetched_at = data["fetched_at"]
+                self.refreshed_at = data["refreshed_at"]
+
+    def __bool__(self):
+        return self.fetched_at is not None
+
+    def expired(self, ttl):
+        "True if the last full fetch is more than `ttl` seconds old."
+        return not self or time.time() - self.refreshed_at > ttl
+
+    def hosts(self):
+        "Cached host dicts keyed by device name."
+        return {name: host for name, host in self.devices.values()}
+
+    def replace(self, devices, fetched_at):
+        """
+        Replace every cached device with a full fetch.
+
+        Parameters
+        ----------
+        devices : dict
+            Maps device id to `(name, host)`.  Devices whose host is None
+            (filtered out by the inventory) are dropped.
+        fetched_at : float
+            Epoch time the fetch started.
+
+        """
+        self.devices = {str(i): [name, host] for i, (name, host) in devices.items() if host is not None}
+        self.fetched_at = self.refreshed_at = fetched_at
+
+    def merge(self, devices, fetched_at):
+        "Merge a delta fetch, same arguments as `replace`."
+        for i, (name, host) in devices.items():
+            if host is None:
+                self.devices.pop(str(i), None)
+            else:
+                self.devices[str(i)] = [name, host]
+        self.fetched_at = fetched_at
+
+    def save(self):
+        "Atomically write the cache file."
+        _write_atomic(self.path, json.dumps({
+            "source": self.source,
+            "fetched_at": self.fetched_at,
+            "refreshed_at": self.refreshed_at,
+            "devices": self.devices,
+        }))
+
+
+def _sites_path(path):
+    return os.path.splitext(path)[0] + "-sites.json"
+
+
+def save_sites(path, sites):
+    "Keep the site slugs `sites` next to the cache file `path`."
+    _write_atomic(_sites_path(path), json.dumps({"fetched_at": time.time(), "sites": sites}))
+
+
+def cached_sites(path):
+    "Site slugs saved with `save_sites` for cache file `path`, None if there are none."
+    try:
+        with open(_sites_path(path)) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    return data["sites"]
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
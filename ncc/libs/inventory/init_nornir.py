@@ -1,34 +1,59 @@
 import os
 import sys
+import logging
 import urllib3
 
-from nornir import InitNornir
+import requests
+
+from ncc.libs.inventory import cache
 
 # from lib.creds import creds_from_env
 
+NB_URL = "https://netbox.gustocorp.com"
+# TODO: Requests library doesn't have access to Gusto CA.  I'll need to research how to add that CA in order to verify nb server.
+NB_VERIFY = False
+
 
-def _init_nornir(filter, num_workers, loglevel, console):
+def get_devices(filter, num_workers, loglevel, console, netbox_token, cache_file=None, cache_ttl=86400, refresh=False,
+                sites=None, roles=None):
     """ 
-    _init_nornir sets the maximum number of workers (`num_workers`) and
+    get_devices sets the maximum number of workers (`num_workers`) and
     gathers the inventory of network devices to run against from NetBox using 
-    the provided `filter`.  
+    the provided `filter` and netbox API Key.  
+
+    Only monitored devices of `sites` and `roles` (all if omitted) are
+    requested, the filtering is done by NetBox, one query per site.
+
+    With `cache_file` only devices updated since the last run are
+    fetched, see `ncc.libs.inventory.cache`.
     """
     # TODO: Temp ignore ssl insecure warnings
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-    filter_params = [("tag", "network")]
+    # only pulls monitored devices with `network` tag set.
+    filter_params = [("tag", "network"), ("cf_monitor", "true")]
+    filter_params.extend(("role", role) for role in roles or [])
 
     filter_params.extend(filter)
+
+    # imported here so loading this module doesn't load nornir, which
+    # imports napalm and netmiko through its connection plugins
+    from nornir import InitNornir
+
     nr = InitNornir(
         core={"num_workers": num_workers},
         logging={"level": loglevel, "to_console": console},
         inventory={
             "plugin": "ncc.libs.inventory.netbox.NBInventory",
             "options": {
-                "nb_url": "https://netbox.gustocorp.com",
+                "nb_url": NB_URL,
                 "nb_token": netbox_token,
-                "filter_parameters": filter_params,  # only pulls devices with `network` tag set.
-                "requests_verify": False,  # TODO: Requests library doesn't have access to Gusto CA.  I'll need to research how to add that CA in order to verify nb server.
+                "filter_parameters": filter_params,
+                "requests_verify": NB_VERIFY,
+                "cache_file": cache_file,
+                "cache_ttl": cache_ttl,
+                "refresh": refresh,
+                "sites": sites,
             },
             #"transform_function": adapt_host_data,
         },
@@ -37,32 +62,26 @@ def _init_nornir(filter, num_workers, loglevel, console):
     return nr
 
 
-def get_devices(filter, num_workers, loglevel, console, netbox_token):
-    #ni = _init_nornir(filter, num_workers, loglevel, console)
-    """ 
-    get_devices sets the maximum number of workers (`num_workers`) and
-    gathers the inventory of network devices to run against from NetBox using 
-    the provided `filter` and netbox API Key.  
+def get_sites(netbox_token, cache_file=None):
     """
-    # TODO: Temp ignore ssl insecure warnings
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    Slugs of the active NetBox sites to collect.
 
-    filter_params = [("tag", "network")]
+    With `cache_file` they are saved next to the inventory cache, and
+    the saved ones are used when NetBox can't be reached.
+    """
+    # the netbox module imports nornir too
+    from ncc.libs.inventory.netbox import active_sites
 
-    filter_params.extend(filter)
-    nr = InitNornir(
-        core={"num_workers": num_workers},
-        logging={"level": loglevel, "to_console": console},
-        inventory={
-            "plugin": "ncc.libs.inventory.netbox.NBInventory",
-            "options": {
-                "nb_url": "https://netbox.gustocorp.com",
-                "nb_token": netbox_token,
-                "filter_parameters": filter_params,  # only pulls devices with `network` tag set.
-                "requests_verify": False,  # TODO: Requests library doesn't have access to Gusto CA.  I'll need to research how to add that CA in order to verify nb server.
-            },
-            #"transform_function": adapt_host_data,
-        },
-    )
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    try:
+        sites = active_sites(NB_URL, netbox_token, requests_verify=NB_VERIFY)
+    except requests.RequestException as e:
+        sites = cache.cached_sites(cache_file) if cache_file else None
+        if sites is None:
+            raise
+        logging.warning("Netbox unavailable, collecting the cached sites: %s", e)
+        return sites
 
-    return nr
+    if cache_file:
+        cache.save_sites(cache_file, sites)
+    return sites
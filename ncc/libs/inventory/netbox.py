@@ -1,17 +1,35 @@
 import os
 import re
-from typing import Any, Dict, Optional
+import json
+import time
+import logging
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, List, Optional
 
 from nornir.core.deserializer.inventory import Inventory, HostsDict
 
 import requests
 
+from ncc.libs.inventory.cache import InventoryCache
+from ncc.summary import summary
+
 
 class MissingRequiredDeviceField(Exception):
     "Error raised when Netbox object is missing required keys."
     pass
 
 
+# Seconds subtracted from the last fetch time
+# when asking Netbox for updated devices
+CACHE_SKEW = 300
+
+# Filters `build_host` applies again.  Delta fetches leave them out, so
+# a device changed to no longer match one, e.g. no longer monitored,
+# is in the delta and dropped from the cache rather than kept in it.
+HOST_FILTERS = {"cf_monitor"}
+
+
 # Option to deal with WLC
 # ssh banner timeouts
 netmiko_conn_options = {
@@ -23,6 +41,13 @@ netmiko_conn_options = {
 }
 
 
+# Secondary nodes in vc clusters are
+# skipped during automation runs.
+# The first node in the cluster will
+# represent the entire cluster.
+virtual_chassis_secondary = re.compile(r".*:[a-z]$")
+
+
 def required_keys_check(device_obj):
     required = ["platform", "primary_ip"]
 
@@ -31,6 +56,66 @@ def required_keys_check(device_obj):
             raise MissingRequiredDeviceField("  '{}' netbox object is missing '{}' field.\n\nPlease update netbox with this field to continue.".format(device_obj["name"], i))
 
 
+def build_host(d, use_slugs=True, flatten_custom_fields=True):
+    """
+    Build a nornir host from a Netbox device object.
+
+    Returns None for devices that are skipped: virtual chassis
+    secondaries and devices not marked for monitoring.
+    """
+    host: HostsDict = {
+        "connection_options": {},
+        "data": {}
+        }
+
+    if virtual_chassis_secondary.search(d["name"]):
+        return None
+
+    # skip devices not marked for monitorig in Netbox
+    if not d["custom_fields"]["monitor"]:
+        # Log devices not being monitored
+        return None
+
+
+    # Make sure Netbox objects contain
+    # all the necessary keys to proceed
+    required_keys_check(d)
+
+    # Cisco WLC needs special connection options
+    # Specifically banner_timeout
+    # see: https://github.com/ktbyers/netmiko/issues/1314
+    if d["platform"]["slug"] == "cisco_wlc":
+        host["connection_options"] = netmiko_conn_options
+
+    host["hostname"] = d["primary_ip"]["address"].split("/")[0]
+    # Add values that don't have an option for 'slug'
+    host["data"]["serial"] = d["serial"]
+    host["data"]["vendor"] = d["device_type"]["manufacturer"]["name"]
+    host["data"]["asset_tag"] = d["asset_tag"]
+    if flatten_custom_fields:
+        for cf, value in d["custom_fields"].items():
+            host["data"][cf] = value
+    else:
+        host["data"]["custom_fields"] = d["custom_fields"]
+
+    # Add values that do have an option for 'slug'
+    if use_slugs:
+        host["data"]["site"] = d["site"]["slug"]
+        host["data"]["role"] = d["device_role"]["slug"]
+        host["data"]["model"] = d["device_type"]["slug"]
+
+        # Attempt to add 'platform' based of value in 'slug'
+        host["platform"] = d["platform"]["slug"] if d["platform"] else None
+
+    else:
+        host["data"]["site"] = d["site"]["name"]
+        host["data"]["role"] = d["device_role"]
+        host["data"]["model"] = d["device_type"]
+        host["platform"] = d["platform"]
+
+    return host
+
+
 class NBInventory(Inventory):
     def __init__(
         self,
@@ -40,6 +125,14 @@ class NBInventory(Inventory):
         flatten_custom_fields: bool = True,
         filter_parameters: Optional[Dict[str, Any]] = None,
         requests_verify=True,
+        page_size: int = 1000,
+        page_workers: int = 4,
+        requests_timeout: int = 60,
+        cache_file: Optional[str] = None,
+        cache_ttl: int = 86400,
+        refresh: bool = False,
+        sites: Optional[List[str]] = None,
+        site_workers: int = 4,
         **kwargs: Any,
     ) -> None:
         """
@@ -51,84 +144,225 @@ class NBInventory(Inventory):
             use_slugs: Whether to use slugs or not
             flatten_custom_fields: Whether to assign custom fields directly to the host or not
             filter_parameters: Key-value pairs to filter down hosts
+            page_size: Devices per API request, 0 to fetch all devices in one request
+            page_workers: Number of pages fetched at the same time
+            requests_timeout: Seconds to wait for each page
+            cache_file: Keep the inventory in this file and only fetch devices
+                updated since the last run.  Used as is when Netbox can't be reached.
+            cache_ttl: Seconds after which the cache is fully refreshed
+            refresh: Ignore the cache and fetch every device
+            sites: Only load devices of these site slugs, one query per site
+                filtered by Netbox.  All sites if omitted.
+            site_workers: Number of sites loaded at the same time
         """
         filter_parameters = filter_parameters or {}
+        if isinstance(filter_parameters, dict):
+            filter_parameters = list(filter_parameters.items())
 
         nb_url = nb_url or os.environ.get("NB_URL", "http://localhost:8080")
         nb_token = nb_token or os.environ.get(
             "NB_TOKEN", "0123456789abcdef0123456789abcdef01234567"
         )
-        headers = {"Authorization": "Token {}".format(nb_token)}
-
-        # Create dict of hosts using 'devices' from NetBox
-        r = requests.get(
-            "{}/api/dcim/devices/?limit=0".format(nb_url),
-            headers=headers,
-            params=filter_parameters,
-            verify=requests_verify,
+
+        loader = NetboxLoader(
+            nb_url,
+            nb_token,
+            use_slugs=use_slugs,
+            flatten_custom_fields=flatten_custom_fields,
+            filter_parameters=filter_parameters,
+            requests_verify=requests_verify,
+            page_size=page_size,
+            page_workers=page_workers,
+            requests_timeout=requests_timeout,
+            sites=sites,
+            site_workers=site_workers,
         )
-        r.raise_for_status()
-        nb_devices = r.json()
-
-        virtual_chassis_secondary = re.compile(r".*:[a-z]$")
-        hosts = {}
-        for d in nb_devices["results"]:
-            host: HostsDict = {
-                "connection_options": {},
-                "data": {}
-                }
-
-            # Secondary nodes in vc clusters are
-            # skipped during automation runs.
-            # The first node in the cluster will 
-            # represent the entire cluster.
-            if virtual_chassis_secondary.search(d["name"]):
-                continue
-            
-            # skip devices not marked for monitorig in Netbox
-            if not d["custom_fields"]["monitor"]:
-                # Log devices not being monitored
-                continue
-
-
-            # Make sure Netbox objects contain
-            # all the necessary keys to proceed
-            required_keys_check(d)
-
-            # Cisco WLC needs special connection options
-            # Specifically banner_timeout
-            # see: https://github.com/ktbyers/netmiko/issues/1314
-            if d["platform"]["slug"] == "cisco_wlc":
-                host["connection_options"] = netmiko_conn_options
-
-            host["hostname"] = d["primary_ip"]["address"].split("/")[0]
-            # Add values that don't have an option for 'slug'
-            host["data"]["serial"] = d["serial"]
-            host["data"]["vendor"] = d["device_type"]["manufacturer"]["name"]
-            host["data"]["asset_tag"] = d["asset_tag"]
-            if flatten_custom_fields:
-                for cf, value in d["custom_fields"].items():
-                    host["data"][cf] = value
-            else:
-                host["data"]["custom_fields"] = d["custom_fields"]
 
-            # Add values that do have an option for 'slug'
-            if use_slugs:
-                host["data"]["site"] = d["site"]["slug"]
-                host["data"]["role"] = d["device_role"]["slug"]
-                host["data"]["model"] = d["device_type"]["slug"]
+        if cache_file:
+            source = json.dumps([nb_url, filter_parameters, sites, use_slugs, flatten_custom_fields])
+            hosts = loader.load_cached(InventoryCache(cache_file, source), cache_ttl, refresh)
+        else:
+            hosts = {name: host for name, host in loader.fetch().values() if host is not None}
+
+        # Pass the data back to the parent class
+        super().__init__(hosts=hosts, groups={}, defaults={}, **kwargs)
+
+
+class NetboxLoader(object):
+    """
+    Fetches devices from Netbox for `NBInventory`.
 
-                # Attempt to add 'platform' based of value in 'slug'
-                host["platform"] = d["platform"]["slug"] if d["platform"] else None
+    Kept apart from the inventory, a pydantic model that refuses
+    attributes it doesn't declare.  Arguments are those of `NBInventory`.
+    """
+    def __init__(self, nb_url, nb_token, use_slugs=True, flatten_custom_fields=True, filter_parameters=(),
+                 requests_verify=True, page_size=1000, page_workers=4, requests_timeout=60, sites=None,
+                 site_workers=4):
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = "Token {}".format(nb_token)
+        self.session.verify = requests_verify
+        # keep-alive connections shared by the page workers
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(page_workers, 1) * max(site_workers, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.url = "{}/api/dcim/devices/".format(nb_url)
+        self.filter_parameters = list(filter_parameters)
+        self.timeout = requests_timeout
+
+        self.use_slugs = use_slugs
+        self.flatten_custom_fields = flatten_custom_fields
+        self.page_size = page_size
+        self.page_workers = page_workers
+        self.sites = sites
+        self.site_workers = site_workers
+
+    def fetch(self, params=(), delta=False):
+        """
+        Fetch devices matching the filter parameters and `params`.
 
+        With `sites` set, every site is a separate query filtered by
+        Netbox, `site_workers` of them at a time.  With `delta`, the
+        `HOST_FILTERS` are left to `build_host`.
+
+        Returns
+        -------
+        dict
+            Maps Netbox device id to `(name, host)`, sites in the
+            order given.
+
+        """
+        filters = [(k, v) for k, v in self.filter_parameters if not (delta and k in HOST_FILTERS)]
+        params = filters + list(params)
+        if not self.sites:
+            return self.fetch_filtered(params)
+
+        with ThreadPoolExecutor(max_workers=self.site_workers) as pool:
+            results = pool.map(lambda site: self.fetch_filtered(params + [("site", site)]), self.sites)
+
+            devices = {}
+            for result in results:
+                devices.update(result)
+            return devices
+
+    def fetch_filtered(self, params=()):
+        """
+        Fetch devices matching `params`.
+
+        Returns
+        -------
+        dict
+            Maps Netbox device id to `(name, host)`, in Netbox order.
+            `host` is None for devices skipped by `build_host`.
+
+        """
+        # Pages are turned into hosts as they arrive, so only
+        # the raw JSON of the pages in flight is held in memory.
+        pages = {}
+        for offset, devices in self.pages(self.page_size, self.page_workers, list(params)):
+            pages[offset] = [
+                (d["id"], (d["name"], build_host(d, self.use_slugs, self.flatten_custom_fields)))
+                for d in devices
+            ]
+
+        # in Netbox order no matter which page finished first
+        result = {}
+        for offset in sorted(pages):
+            result.update(pages.pop(offset))
+        return result
+
+    def load_cached(self, cache, ttl, refresh):
+        """
+        Hosts from `cache`, updated with the devices changed in Netbox
+        since it was last fetched.  Fully refreshed if expired or
+        `refresh` is set.  The cache is used as is if Netbox fails.
+        """
+        started = time.time()
+        full = refresh or cache.expired(ttl)
+        try:
+            if full:
+                cache.replace(self.fetch(), started)
             else:
-                host["data"]["site"] = d["site"]["name"]
-                host["data"]["role"] = d["device_role"]
-                host["data"]["model"] = d["device_type"]
-                host["platform"] = d["platform"]
+                # allow for clock skew between us and Netbox
+                since = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(cache.fetched_at - CACHE_SKEW))
+                changed = self.fetch([("last_updated__gte", since)], delta=True)
+                logging.info("%d devices changed in Netbox since %s", len(changed), since)
+                cache.merge(changed, started)
+        except requests.RequestException as e:
+            if not cache:
+                raise
+            logging.warning("Netbox unavailable, using cached inventory from %s: %s",
+                            time.ctime(cache.fetched_at), e)
+            return cache.hosts()
 
-            # Assign temporary dict to outer dict
-            hosts[d["name"]] = host
+        cache.save()
+        return cache.hosts()
 
-        # Pass the data back to the parent class
-        super().__init__(hosts=hosts, groups={}, defaults={}, **kwargs)
+    def get_page(self, limit, offset=0, params=()):
+        "One page of the device list as decoded JSON."
+        with summary.timer("netbox page"):
+            r = self.session.get(
+                self.url,
+                params=list(params) + [("limit", limit), ("offset", offset)],
+                timeout=self.timeout,
+            )
+        r.raise_for_status()
+        return r.json()
+
+    def pages(self, page_size, page_workers, params=()):
+        """
+        Yield `(offset, devices)` for every page of the device list.
+
+        The first page tells how many devices there are, the rest
+        are fetched `page_workers` at a time and yielded in the
+        order they complete.  No more than `page_workers` pages are
+        requested ahead of the caller.
+        """
+        first = self.get_page(page_size, 0, params)
+        yield 0, first["results"]
+
+        if not page_size or not first["next"]:
+            return
+
+        offsets = iter(range(page_size, first["count"], page_size))
+        del first
+
+        with ThreadPoolExecutor(max_workers=page_workers) as pool:
+            pending = {}
+            for offset in islice(offsets, page_workers):
+                pending[pool.submit(self.get_page, page_size, offset, params)] = offset
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset = pending.pop(future)
+                    for next_offset in islice(offsets, 1):
+                        pending[pool.submit(self.get_page, page_size, next_offset, params)] = next_offset
+                    yield offset, future.result()["results"]
+
+
+def active_sites(nb_url, nb_token, requests_verify=True, requests_timeout=60):
+    """
+    Slugs of the sites with status 'active' in Netbox that have devices.
+
+    Arguments:
+        nb_url: Netbox url
+        nb_token: Netbox token
+    """
+    session = requests.Session()
+    session.headers["Authorization"] = "Token {}".format(nb_token)
+    session.verify = requests_verify
+
+    sites = []
+    url = "{}/api/dcim/sites/".format(nb_url)
+    params = [("status", "active"), ("limit", 1000)]
+    while url:
+        r = session.get(url, params=params, timeout=requests_timeout)
+        r.raise_for_status()
+        data = r.json()
+        sites.extend(s["slug"] for s in data["results"] if s.get("device_count", 1))
+        # `next` already carries the query string
+        url, params = data["next"], None
+
+    return sites
@@ -0,0 +1,86 @@
+"""
+Asyncio SSH transport used by the async collection engine.
+
+Requires the optional `asyncssh` package:
+
+    pip install asyncssh
+
+"""
+
+import time
+
+from ncc.libs.transport.limits import limiter
+from ncc.libs.transport.sessions import sessions
+from ncc.summary import summary
+
+# imported on first use, only the async engine needs it
+asyncssh = None
+
+
+class MissingDependency(Exception):
+    "Error raised when the async engine is used without asyncssh installed."
+    pass
+
+
+def _import_asyncssh():
+    global asyncssh
+    if asyncssh is None:
+        try:
+            import asyncssh as module
+        except ImportError:
+            raise MissingDependency("The async engine requires asyncssh (`pip install asyncssh`).")
+        asyncssh = module
+    return asyncssh
+
+
+class AsyncSSH(object):
+    """
+    Async SSH session to a single device.
+
+    Every command runs on its own exec channel of one SSH connection,
+    so no prompt handling is required.
+
+    Usage:
+        async with AsyncSSH(host, username, password) as conn:
+            cfg = await conn.send_command("show run")
+
+    """
+    def __init__(self, host, username, password, port=22, timeout=60, **kwargs):
+        _import_asyncssh()
+
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.conn = None
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        self.conn = await asyncssh.connect(
+            self.host,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            known_hosts=None,
+            login_timeout=self.timeout,
+            **self.kwargs
+        )
+        seconds = time.perf_counter() - start
+        summary.add_phase("connect", seconds)
+        limiter.connected(seconds)
+        sessions.opened()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.conn.close()
+        await self.conn.wait_closed()
+        sessions.closed()
+
+    async def send_command(self, command):
+        start = time.perf_counter()
+        result = await self.conn.run(command, check=False, timeout=self.timeout)
+        summary.add_phase("command", time.perf_counter() - start, command=command)
+
+        return result.stdout
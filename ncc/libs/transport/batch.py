@@ -0,0 +1,167 @@
+"""
+Pipelined command execution for netmiko sessions.
+
+`netmiko.send_command` waits for the device prompt after every command,
+so N commands cost N round trips.  `send_batch` types every command in
+one write and reads the combined output back, splitting it on the
+device prompt.  On a high latency link that is one round trip instead
+of one per command.
+
+If the combined output can not be split reliably (a command echo is
+missing or out of order, or the prompts don't all come back in time),
+the commands are re-run one at a time with `send_command` so the
+result is never mixed up.  A batch that timed out may still be
+streaming, so its output is drained first, and the session is opened
+again if it won't settle.
+
+"""
+
+import re
+import time
+import logging
+
+from ncc.summary import summary
+
+
+# seconds without output, after a prompt, for a session to count as settled
+SETTLE_QUIET = 1.0
+
+
+class BatchError(Exception):
+    "Error raised when pipelined output can not be matched up with its commands."
+    pass
+
+
+def send_batch(netcon, commands, timeout=120, fallback=True):
+    """
+    Run `commands` on a netmiko connection in a single pipelined exchange.
+
+    Parameters
+    ----------
+    netcon : netmiko.BaseConnection
+        Connected netmiko session, paging already disabled.
+    commands : list of str
+    timeout : int
+        Seconds to wait for the whole batch.
+    fallback : bool
+        Re-run the commands one at a time if the batch output can not
+        be split.  With False `BatchError` is raised instead.
+
+    Returns
+    -------
+    outputs : dict
+        Maps each command to its output.
+    timings : dict
+        Maps each command to the seconds it took.  For a pipelined batch
+        that is the time between the prompt before and after its output.
+
+    """
+    try:
+        outputs, timings = _pipelined(netcon, commands, timeout)
+        summary.count("batched sessions")
+        return outputs, timings
+    except BatchError as e:
+        if not fallback:
+            raise
+        logging.warning("Batch failed on %s, running commands one at a time: %s", netcon.host, e)
+
+    summary.count("batch fallbacks")
+    _settle(netcon, timeout)
+    return send_sequential(netcon, commands)
+
+
+def send_sequential(netcon, commands):
+    "Run `commands` one `send_command` at a time.  Same return value as `send_batch`."
+    outputs, timings = dict(), dict()
+    for cmd in commands:
+        start = time.time()
+        outputs[cmd] = netcon.send_command(cmd)
+        timings[cmd] = time.time() - start
+
+    return outputs, timings
+
+
+def _pipelined(netcon, commands, timeout):
+    prompt = netcon.find_prompt().strip()
+    if not prompt:
+        raise BatchError("Could not determine device prompt.")
+
+    # a prompt at the start of a line marks the end of a command's output
+    marker = re.compile(r"^\s*" + re.escape(prompt), flags=re.M)
+
+    netcon.clear_buffer()
+    start = time.time()
+    netcon.write_channel("".join(netcon.normalize_cmd(cmd) for cmd in commands))
+
+    chunks = []
+    # output not yet scanned for prompts, and where to scan it from
+    tail, pos = "", 0
+    seen = []
+    while len(seen) < len(commands):
+        if time.time() - start > timeout:
+            raise BatchError("Timed out after {}s waiting for {} prompts, saw {}.".format(
+                timeout, len(commands), len(seen)))
+
+        chunk = netcon.read_channel()
+        if not chunk:
+            time.sleep(0.05)
+            continue
+
+        chunks.append(chunk)
+        now = time.time()
+        tail += chunk
+        for m in marker.finditer(tail, pos):
+            seen.append(now)
+            pos = m.end()
+
+        # Only the last line can still turn into a prompt.  One character
+        # before the cut is kept, so `^` matches at the cut exactly when
+        # it follows a newline, and the whole output is never rescanned.
+        cut = max(tail.rfind("\n") + 1, pos)
+        if cut > 1:
+            tail, pos = tail[cut - 1:], 1
+
+    output = netcon.strip_ansi_escape_codes("".join(chunks)).replace("\r", "")
+    segments = marker.split(output)
+
+    outputs, timings = dict(), dict()
+    last = start
+    for cmd, segment, seen_at in zip(commands, segments, seen):
+        echo, _, result = segment.partition("\n")
+        if echo.strip() != cmd.strip():
+            raise BatchError("Expected echo of '{}', got '{}'.".format(cmd, echo.strip()))
+
+        outputs[cmd] = result.rstrip("\n")
+        timings[cmd] = seen_at - last
+        last = seen_at
+
+    return outputs, timings
+
+
+def _settle(netcon, timeout):
+    """
+    Read what is left of a failed batch until the session has been
+    quiet for `SETTLE_QUIET` seconds after a prompt, and open it again
+    if that takes longer than `timeout`.
+    """
+    prompt = netcon.base_prompt
+    start = quiet_since = time.time()
+    last = ""
+    while time.time() - start < timeout:
+        chunk = netcon.read_channel()
+        if chunk:
+            last = (last + chunk)[-200:]
+            quiet_since = time.time()
+            continue
+
+        # settled once the last line is a prompt, or nothing was left
+        settled = not last or prompt in last.rstrip().rpartition("\n")[2]
+        if settled and time.time() - quiet_since >= SETTLE_QUIET:
+            return
+        time.sleep(0.05)
+
+    logging.warning("%s kept sending output, opening the session again", netcon.host)
+    summary.count("batch reconnects")
+    netcon.disconnect()
+    netcon.establish_connection()
+    netcon.session_preparation()
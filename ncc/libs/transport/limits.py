@@ -0,0 +1,336 @@
+"""
+Adaptive limits on concurrent device sessions, per platform and per site.
+
+`--workers` caps sessions overall, but devices don't all take load
+alike: WLCs and Opengear consoles refuse parallel logins that IOS
+switches shrug off, and a site's AAA server rate limits logins from
+every platform at once.  Every device session holds a slot of the
+module level `limiter` for its platform and its site:
+
+    with limiter.slot(host.platform, site):
+        ...  # connect and collect
+
+Each limit adapts with AIMD, like TCP's congestion window:
+
+    - after a decrease, it grows back by one for every full limit's
+      worth of sessions that succeed while it is the bottleneck
+    - it halves when a session fails to connect or times out, or when
+      connecting takes much longer than usual for the site, a sign the
+      device side is queueing logins.  Sessions started before a
+      decrease don't decrease it again, and a session only counts
+      against the limits that were full when it started.  Errors that
+      say nothing about load, like failed logins or unsupported
+      platforms, leave the limits alone.
+
+"Usual" is a smoothed connect time and its mean deviation, kept per
+site as TCP does for round trip times: a platform's devices at a
+remote site connect slower than at the local one without either being
+congested.
+
+Platform limits start at, and never exceed, `--workers` or the
+driver's `MAX_SESSIONS` if it is lower, or the override from
+`configure()`.  Site limits start at and are capped by `--site-workers`.
+A run starts as concurrent as it did before limits adapted, and only
+slows down once devices show congestion.
+
+Drivers report connect latency with `connected()` while a slot is
+held, `ncc.libs.transport.sessions` and `aiossh` do it for them.
+
+"""
+
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+from ncc.platforms import get_platform
+from ncc.summary import summary
+
+
+# slot held by the session being opened in this thread or task
+_current = contextvars.ContextVar("ncc_limits_slot", default=None)
+
+# sessions overall when `configure()` isn't given any, `--workers` by default
+DEFAULT_WORKERS = 15
+
+# how fast the smoothed connect time and its deviation follow new connects
+LATENCY_GAIN = 0.125
+DEVIATION_GAIN = 0.25
+
+# Errors that hint at an overloaded device or AAA server, matched by
+# class name like `collect.PERMANENT_ERRORS`.  Anything else, e.g. a
+# failed login, doesn't lower the limits.
+CONGESTION_ERRORS = {
+    "TimeoutError",  # builtin, asyncio
+    "timeout",  # socket before Python 3.10
+    "ConnectionError",  # builtin refused/reset/aborted, requests
+    "Timeout",  # requests
+    "NetMikoTimeoutException",  # netmiko
+    "ConnectionLost",  # asyncssh
+    "ConnectTimeoutError",  # napalm
+}
+
+
+def congestion(error):
+    "Whether `error` is a connect failure or timeout."
+    return any(cls.__name__ in CONGESTION_ERRORS for cls in type(error).__mro__)
+
+
+class AIMDLimit(object):
+    """
+    One adaptive limit.
+
+    Parameters
+    ----------
+    name : str
+        e.g. 'platform ios' or 'site usden1', for logs.
+    initial : int
+    minimum : int
+    maximum : int
+        None for no cap.
+    tolerance : float
+        Connect latency, relative to the smoothed latency of the site,
+        taken as congestion.
+    decrease : float
+        Factor the limit is multiplied with on congestion.
+
+    Attributes
+    ----------
+    limit : float
+        Current limit, sessions allowed are its integer part.
+    in_use : int
+    latency : dict
+        Maps site to its smoothed connect time and mean deviation in
+        seconds, `[srtt, rttvar]`.
+
+    """
+    def __init__(self, name, initial, minimum=1, maximum=None, tolerance=2.0, decrease=0.5):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.limit = float(self._cap(initial))
+        self.in_use = 0
+        self.latency = dict()
+        # bumped on every decrease
+        self.epoch = 0
+
+    def _cap(self, limit):
+        if self.maximum is not None:
+            limit = min(limit, self.maximum)
+        return max(self.minimum, limit)
+
+    def room(self):
+        return self.in_use < int(self.limit)
+
+    def success(self, epoch, saturated, latency=None, site=None):
+        "A session acquired at `epoch` succeeded, after connecting to `site` in `latency` seconds."
+        if latency is not None and self._slow(site, latency):
+            self.backoff(epoch, "connect took {:.1f}s".format(latency))
+            return
+
+        # only grow while the limit is what holds sessions back
+        if saturated:
+            self.limit = self._cap(self.limit + 1.0 / self.limit)
+
+    def _slow(self, site, latency):
+        "Whether `latency` is well above the usual for `site`, then take it into account."
+        estimate = self.latency.get(site)
+        if estimate is None:
+            self.latency[site] = [latency, latency / 2]
+            return False
+
+        srtt, rttvar = estimate
+        slow = latency > max(srtt * self.tolerance, srtt + 4 * rttvar)
+        estimate[1] += (abs(latency - srtt) - rttvar) * DEVIATION_GAIN
+        estimate[0] += (latency - srtt) * LATENCY_GAIN
+        return slow
+
+    def backoff(self, epoch, reason):
+        "Decrease the limit, once per `epoch`."
+        if epoch != self.epoch:
+            return
+        self.epoch += 1
+        old, self.limit = self.limit, self._cap(self.limit * self.decrease)
+        summary.count("session limit decreases")
+        logging.info("Lowered %s session limit from %d to %d: %s", self.name, old, self.limit, reason)
+
+
+class Slot(object):
+    "Sessions held on a platform and a site limit."
+    __slots__ = ("limits", "site", "epochs", "saturated", "latency")
+
+    def __init__(self, limits, site=None):
+        self.limits = limits
+        self.site = site
+        self.epochs = [l.epoch for l in limits]
+        self.saturated = [l.in_use + 1 >= int(l.limit) for l in limits]
+        self.latency = None
+
+
+class Limiter(object):
+    """
+    Parameters
+    ----------
+    tolerance, decrease : float
+        Passed to every `AIMDLimit`.
+
+    """
+    def __init__(self, tolerance=2.0, decrease=0.5):
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.platform_max = dict()
+        self.site_max = None
+        self.workers = DEFAULT_WORKERS
+        self.platforms = dict()
+        self.sites = dict()
+        self._cond = threading.Condition()
+        # futures of coroutines waiting in `slot_async`
+        self._waiters = []
+
+    def configure(self, platform_max=None, site_max=None, workers=DEFAULT_WORKERS):
+        """
+        Parameters
+        ----------
+        platform_max : dict
+            Maps platform slug to its maximum sessions, overriding the
+            driver's `MAX_SESSIONS`.
+        site_max : int
+            Maximum sessions per site, None for no site limits.
+        workers : int
+            Sessions overall, no platform limit is higher.
+
+        """
+        with self._cond:
+            self.platform_max.update(platform_max or {})
+            self.site_max = site_max
+            self.workers = workers
+            self.platforms.clear()
+            self.sites.clear()
+
+    def _limits(self, platform, site):
+        limit = self.platforms.get(platform)
+        if limit is None:
+            driver = get_platform(platform)
+            maximum = self.platform_max.get(platform, driver.MAX_SESSIONS)
+            maximum = self.workers if maximum is None else min(maximum, self.workers)
+            # starts open, as --workers did before limits adapted
+            limit = self.platforms[platform] = AIMDLimit(
+                "platform " + platform, maximum, maximum=maximum,
+                tolerance=self.tolerance, decrease=self.decrease)
+
+        limits = [limit]
+        if site is not None and self.site_max is not None:
+            site_limit = self.sites.get(site)
+            if site_limit is None:
+                # starts open, as --site-workers did before limits adapted
+                site_limit = self.sites[site] = AIMDLimit(
+                    "site " + site, self.site_max, maximum=self.site_max,
+                    tolerance=self.tolerance, decrease=self.decrease)
+            limits.append(site_limit)
+        return limits
+
+    def available(self, platform, site):
+        "Whether a session to `platform` at `site` would start right away."
+        with self._cond:
+            return all(l.room() for l in self._limits(platform, site))
+
+    def _acquire(self, platform, site):
+        "Slot if there is room for it, None otherwise.  `_cond` must be held."
+        limits = self._limits(platform, site)
+        if not all(l.room() for l in limits):
+            return None
+        slot = Slot(limits, site)
+        for l in limits:
+            l.in_use += 1
+        return slot
+
+    def _release(self, slot, error=None):
+        # Congestion is blamed on the limits that were full when the
+        # slot was taken, so an overloaded platform doesn't slow down
+        # every other platform at its sites, and the other way round.
+        blamed = slot.saturated if any(slot.saturated) else [True] * len(slot.limits)
+
+        with self._cond:
+            for limit, epoch, saturated, blame in zip(slot.limits, slot.epochs, slot.saturated, blamed):
+                limit.in_use -= 1
+                if error is None:
+                    limit.success(epoch, saturated, slot.latency if blame else None, slot.site)
+                elif blame and congestion(error):
+                    limit.backoff(epoch, "{}: {}".format(type(error).__name__, error))
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    @contextmanager
+    def slot(self, platform, site=None):
+        "Hold a session slot for `platform` at `site`, waiting for room."
+        with self._cond:
+            slot = self._acquire(platform, site)
+            if slot is None:
+                summary.count("session limit waits")
+                while slot is None:
+                    self._cond.wait()
+                    slot = self._acquire(platform, site)
+
+        token = _current.set(slot)
+        try:
+            yield slot
+        except Exception as e:
+            self._release(slot, e)
+            raise
+        else:
+            self._release(slot)
+        finally:
+            _current.reset(token)
+
+    @asynccontextmanager
+    async def slot_async(self, platform, site=None):
+        "`slot` for coroutines, waits without blocking the event loop."
+        loop = asyncio.get_running_loop()
+        waited = False
+        while True:
+            with self._cond:
+                slot = self._acquire(platform, site)
+                if slot is not None:
+                    break
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            if not waited:
+                summary.count("session limit waits")
+                waited = True
+            await future
+
+        token = _current.set(slot)
+        try:
+            yield slot
+        except Exception as e:
+            self._release(slot, e)
+            raise
+        else:
+            self._release(slot)
+        finally:
+            _current.reset(token)
+
+    def connected(self, seconds):
+        "Report that the session of the current slot took `seconds` to connect."
+        slot = _current.get()
+        if slot is not None:
+            slot.latency = seconds
+
+    def limits(self):
+        "Current limits, {'platform ios': 12, 'site usden1': 5, ...}."
+        with self._cond:
+            return {l.name: int(l.limit) for l in list(self.platforms.values()) + list(self.sites.values())}
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+limiter = Limiter()
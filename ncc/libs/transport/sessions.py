@@ -0,0 +1,92 @@
+"""
+Lifecycle of device sessions.
+
+Every SSH/API session a driver opens goes through the module level
+`sessions` manager:
+
+    with sessions.session(key, open_fn, close_fn) as conn:
+        ...
+
+A session is closed as soon as its block finishes, whether it raised
+or not.  Failed sessions are not kept for a retry: retries run after a
+backoff on whichever worker is free, and a session held open until
+then would count against the device's session limit while doing
+nothing.  Peak open sessions and file descriptors are recorded in the
+run summary.
+
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from ncc.libs.transport.limits import limiter
+from ncc.summary import summary
+
+
+def open_fds():
+    "Number of open file descriptors of this process, None where unknown."
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+class SessionManager(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def opened(self):
+        "Record a session that was just opened."
+        with self._lock:
+            self._open += 1
+            n = self._open
+        summary.count("sessions opened")
+        summary.peak("peak open sessions", n)
+        fds = open_fds()
+        if fds is not None:
+            summary.peak("peak open fds", fds)
+
+    def closed(self):
+        "Record a session that was just closed."
+        with self._lock:
+            self._open -= 1
+
+    @contextmanager
+    def session(self, key, open_fn, close_fn):
+        """
+        New session to `key`, closed when the block finishes.
+
+        Parameters
+        ----------
+        key : tuple
+            Identifies the device, e.g. (platform, host, username).
+        open_fn : callable
+            Opens and returns a new session.
+        close_fn : callable
+            Called with the session to close it.
+
+        """
+        start = time.perf_counter()
+        try:
+            conn = open_fn()
+        finally:
+            seconds = time.perf_counter() - start
+            summary.add_phase("connect", seconds)
+            limiter.connected(seconds)
+        self.opened()
+
+        try:
+            yield conn
+        finally:
+            try:
+                close_fn(conn)
+            except Exception as e:
+                logging.debug("Error closing session to %s: %s", key, e)
+            self.closed()
+
+
+sessions = SessionManager()
@@ -0,0 +1,168 @@
+"""
+Streaming XML to JSON conversion.
+
+`xml_to_json` produces exactly what
+
+    json.dumps(xmltodict.parse(xml)[path[0]][path[1]]..., indent=2)
+
+does, without building the parse tree or the nested dict.  The XML is
+fed to expat, the parser xmltodict uses, in chunks, and every element
+is rendered to its JSON text as soon as it is closed.  Only the
+rendered text of the elements still open is kept.
+
+Elements named in `secrets` are redacted structurally, their value is
+replaced whatever its layout.
+
+"""
+
+import json
+from xml.parsers import expat
+
+# same escaping as json.dumps with ensure_ascii
+_enc = json.encoder.encode_basestring_ascii
+
+# characters of XML handed to the parser at a time
+FEED_SIZE = 1 << 20
+
+INDENT = "  "
+
+
+class _Converter(object):
+    """
+    Expat handlers for `xml_to_json`.
+
+    Every open element below the converted one is an entry of `stack`:
+    (name, attributes, rendered children, character data).  Rendered
+    children map child names, in order of first appearance, to their
+    JSON values.
+    """
+    def __init__(self, path, secrets, replacement):
+        self.path = path
+        self.secrets = secrets
+        self.replacement = _enc(replacement)
+        # names of the open elements above the converted one
+        self.names = []
+        self.stack = []
+        self.inside = False
+        self.result = None
+
+    def start(self, name, attrs):
+        if not self.inside:
+            if (len(self.names) == len(self.path) - 1 and self.result is None
+                    and name == self.path[-1] and tuple(self.names) == self.path[:-1]):
+                self.inside = True
+            else:
+                self.names.append(name)
+                return
+        self.stack.append((name, attrs, {}, []))
+
+    def characters(self, data):
+        if self.inside:
+            self.stack[-1][3].append(data)
+
+    def end(self, name):
+        if not self.inside:
+            self.names.pop()
+            return
+
+        name, attrs, children, data = self.stack.pop()
+        text = "".join(data).strip() if data else None
+        level = len(self.stack)
+
+        if name in self.secrets and (text or attrs or children):
+            value = self.replacement
+        elif not attrs and not children:
+            value = _enc(text) if text else "null"
+        else:
+            value = _render(attrs, children, text, level)
+
+        if not self.stack:
+            self.result = value
+            self.inside = False
+            return
+
+        siblings = self.stack[-1][2].get(name)
+        if siblings is None:
+            self.stack[-1][2][name] = [value]
+        else:
+            # List items sit one level deeper, with everything below
+            # them.  The first one only turns out to be an item when
+            # the second shows up.
+            if len(siblings) == 1:
+                siblings[0] = siblings[0].replace("\n", "\n" + INDENT)
+            siblings.append(value.replace("\n", "\n" + INDENT))
+
+
+def _render(attrs, children, text, level):
+    "JSON object of an element whose value starts at indent `level`."
+    ind = "\n" + INDENT * (level + 1)
+
+    # attrs is a flat [name, value, name, value, ...] list
+    entries = ["{}: {}".format(_enc("@" + attrs[i]), _enc(attrs[i + 1])) for i in range(0, len(attrs), 2)]
+    for name, values in children.items():
+        if len(values) == 1:
+            entries.append("{}: {}".format(_enc(name), values[0]))
+        else:
+            item_ind = ind + INDENT
+            entries.append("{}: [{}{}{}]".format(_enc(name), item_ind, ("," + item_ind).join(values), ind))
+    if text:
+        entries.append('"#text": ' + _enc(text))
+
+    return "{" + ind + ("," + ind).join(entries) + "\n" + INDENT * level + "}"
+
+
+def xml_to_json(xml, path, secrets=(), replacement="<secret hidden>"):
+    """
+    Parameters
+    ----------
+    xml : str
+    path : tuple of str
+        Element names from the root down to the element to convert,
+        e.g. ('response', 'result', 'config').
+    secrets : collection of str
+        Names of elements whose value is replaced with `replacement`.
+    replacement : str
+
+    Returns
+    -------
+    str
+        JSON text, indented by 2.
+
+    Raises
+    ------
+    KeyError
+        If there is no element at `path`.
+
+    Examples
+    --------
+    >>> print(xml_to_json('<a><b x="1">t</b><c/><b>u</b><key>s</key></a>', ('a',), secrets={'key'}))
+    {
+      "b": [
+        {
+          "@x": "1",
+          "#text": "t"
+        },
+        "u"
+      ],
+      "c": null,
+      "key": "<secret hidden>"
+    }
+
+    """
+    converter = _Converter(tuple(path), secrets, replacement)
+
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = converter.start
+    parser.EndElementHandler = converter.end
+    parser.CharacterDataHandler = converter.characters
+
+    for start in range(0, len(xml), FEED_SIZE):
+        parser.Parse(xml[start:start + FEED_SIZE], False)
+    parser.Parse("", True)
+
+    if converter.result is None:
+        raise KeyError("/".join(path))
+
+    return converter.result
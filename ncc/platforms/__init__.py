@@ -0,0 +1,114 @@
+"""
+Registry of device platform drivers.
+
+Drivers pull in heavy libraries (napalm, netmiko, pandevice, xmltodict)
+when imported, so they are only imported the first time a host with
+their Netbox platform slug is collected.  A run against a single
+platform never loads the others.
+
+Drivers are subclasses of `ncc.platforms.base.Platform` and are found,
+in order, among:
+
+    - classes decorated with `@register("slug")`
+    - the built-in drivers in `PLATFORMS`
+    - the `ncc.platforms` entry point group of installed packages,
+      e.g. in setup.py:
+
+        entry_points={"ncc.platforms": ["eos = ncc_eos:AristaEOS"]}
+
+"""
+
+import importlib
+import threading
+
+
+class UnsupportedPlatform(Exception):
+    pass
+
+
+ENTRY_POINT_GROUP = "ncc.platforms"
+
+# Maps Netbox Platfrom field to the ncc platform Class, as "module:Class"
+PLATFORMS = {
+    "ios": "ncc.platforms.cisco_ios:CiscoIOS",
+    "nxos": "ncc.platforms.cisco_nxos:CiscoNXOS",
+    "asa": "ncc.platforms.cisco_asa:CiscoASA",
+    "cisco_wlc": "ncc.platforms.cisco_wlc:CiscoWLC",
+    "panos": "ncc.platforms.paloalto_panos:PaloaltoPanos",
+    "opengear": "ncc.platforms.opengear_linux:OpengearLinux",
+    "junos": "ncc.platforms.juniper_junos:JuniperJunos",
+    "dell_os6": "ncc.platforms.dell_os6:DellOS6",
+}
+
+_loaded = dict()
+_lock = threading.Lock()
+_entry_points = None
+
+
+def register(slug):
+    """
+    Class decorator registering a driver for a Netbox platform slug.
+
+    Usage:
+        @register("eos")
+        class AristaEOS(NetmikoPlatform):
+            ...
+    """
+    def decorator(cls):
+        _loaded[slug] = cls
+        return cls
+
+    return decorator
+
+
+def _find_entry_point(slug):
+    "'module:Class' of the installed entry point for `slug`, None if there is none."
+    global _entry_points
+    if _entry_points is None:
+        try:
+            from importlib.metadata import entry_points
+            found = entry_points()
+            if hasattr(found, "select"):
+                found = found.select(group=ENTRY_POINT_GROUP)
+            else:
+                found = found.get(ENTRY_POINT_GROUP, [])
+            _entry_points = {ep.name: ep.value for ep in found}
+        except ImportError:
+            # python < 3.8
+            import pkg_resources
+            _entry_points = {
+                ep.name: "{}:{}".format(ep.module_name, ".".join(ep.attrs))
+                for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+            }
+
+    return _entry_points.get(slug)
+
+
+def get_platform(slug):
+    """
+    Platform class for a Netbox platform slug, imported on first use.
+
+    Raises
+    ------
+    UnsupportedPlatform
+        If no driver is registered for `slug`.
+
+    """
+    try:
+        return _loaded[slug]
+    except KeyError:
+        pass
+
+    # collection threads may hit a new platform at the same time
+    with _lock:
+        if slug not in _loaded:
+            target = PLATFORMS.get(slug) or _find_entry_point(slug)
+            if not target:
+                raise UnsupportedPlatform("'{}' not in {}".format(slug, sorted(set(PLATFORMS) | set(_loaded))))
+
+            module, cls = target.split(":")
+            # importing a built-in driver runs its @register()
+            loaded = getattr(importlib.import_module(module), cls)
+            _loaded.setdefault(slug, loaded)
+
+    return _loaded[slug]
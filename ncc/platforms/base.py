@@ -0,0 +1,248 @@
+"""
+Base classes shared by every platform driver.
+
+A driver only declares what differs between platforms: the commands
+to run, the secrets to redact and, where needed, how to parse the
+output.  `Platform` does the rest the same way for all of them:
+
+    - opens the session (`open`) and runs the config and metadata
+      commands in one go (`run_commands`)
+    - always closes the session again (`close`), see
+      `ncc.libs.transport.sessions`
+    - skips the full fetch when the change marker is unchanged
+    - redacts with `Redactor`s compiled once per class
+    - builds the commented metadata banner
+
+`NapalmPlatform` and `NetmikoPlatform` supply `open`, `close` and
+`run_commands` for the two session libraries in use.
+
+"""
+
+import time
+
+from ncc.libs.transport.batch import send_batch
+from ncc.libs.transport.sessions import sessions
+from ncc.redact import Redactor
+from ncc.summary import summary
+
+
+class Platform(object):
+    """
+    Parameters
+    ----------
+    hide_secrets : bool
+        Redact `CONFIG_SECRETS` from the config and metadata.
+    connect : bool
+        Open a session and collect right away.  With False nothing is
+        collected, the async engine calls `fetch_config()` and
+        `fetch_metadata()` instead.
+    last_marker : str
+        Change marker stored from the last run.  If the device reports
+        the same one, `config` and `metadata` are left None.
+    params : dict
+        'platform', 'host', 'username' and 'password' of the device.
+
+    Attributes
+    ----------
+    config, metadata : str
+        Redacted output, None if the device is unchanged.
+    marker : str
+        Change marker reported by the device, None if unsupported.
+    timings : dict
+        Seconds each command took.
+
+    """
+    # (pattern, replacement) pairs, redacted with --hide-secrets
+    CONFIG_SECRETS = []
+    # (pattern, replacement) pairs, always redacted
+    GLOBAL_FILTER = []
+    # command whose output changes whenever the config does
+    CHANGE_CMD = None
+    CONFIG_CMD = None
+    META_CMDS = []
+    # how each metadata command is laid out in the banner
+    META_FORMAT = "\n\n{cmd}\n{rule}\n{result}"
+    # has `fetch_config()` / `fetch_metadata()` for the async engine
+    ASYNC = True
+    # concurrent sessions to devices of the platform, adapted at run
+    # time below it, see `ncc.libs.transport.limits`.  None for no
+    # maximum other than `--workers`.
+    MAX_SESSIONS = None
+    # indentation levels that name a config section in the commit
+    # message, see `ncc.diff`.  None to not classify changes.
+    SECTION_DEPTH = None
+
+    SECRETS_REDACTOR = Redactor(CONFIG_SECRETS)
+    GLOBAL_REDACTOR = Redactor(GLOBAL_FILTER)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # compile once per class, not once per device
+        if "CONFIG_SECRETS" in vars(cls):
+            cls.SECRETS_REDACTOR = Redactor(cls.CONFIG_SECRETS)
+        if "GLOBAL_FILTER" in vars(cls):
+            cls.GLOBAL_REDACTOR = Redactor(cls.GLOBAL_FILTER)
+
+    def __init__(self, hide_secrets, connect=True, last_marker=None, **params):
+        self.hide_secrets = hide_secrets
+        self.marker = None
+        self.outputs = dict()
+        self.timings = dict()
+        if not connect:
+            # collected with fetch_config() / fetch_metadata() instead
+            return
+
+        key = (params["platform"], params["host"], params["username"])
+        with sessions.session(key, lambda: self.open(**params), self.close) as self.netcon:
+            self.collect(last_marker)
+
+    def collect(self, last_marker=None):
+        "Fetch `config` and `metadata` over `self.netcon`."
+        with summary.timer("change marker"):
+            self.marker = self.get_change_marker()
+        if self.marker and self.marker == last_marker:
+            # unchanged since the last collection, skip the full fetch
+            self.config = self.metadata = None
+            return
+        # config and metadata commands in one go
+        with summary.timer("fetch"):
+            self.outputs, self.timings = self.run_commands([self.CONFIG_CMD] + self.META_CMDS)
+        self.config = self.get_config(self.hide_secrets)
+        self.metadata = self.get_metadata()
+
+    def open(self, platform, host, username, password):
+        "Open and return a session to the device."
+        raise NotImplementedError
+
+    def close(self, netcon):
+        "Close a session returned by `open`."
+        pass
+
+    def run_commands(self, commands):
+        """
+        Run `commands` on `self.netcon`.
+
+        Returns
+        -------
+        outputs : dict
+            Maps each command to its output.
+        timings : dict
+            Maps each command to the seconds it took.
+
+        """
+        raise NotImplementedError
+
+    def get_change_marker(self):
+        if not self.CHANGE_CMD:
+            return None
+
+        outputs, _ = self.run_commands([self.CHANGE_CMD])
+
+        return self.parse_change_marker(outputs[self.CHANGE_CMD])
+
+    def parse_change_marker(self, output):
+        "Change marker from the output of `CHANGE_CMD`."
+        return output.strip()
+
+    def get_config(self, hide_secrets):
+        cfg = self.outputs[self.CONFIG_CMD]
+
+        return self.filter(cfg)
+
+    def get_metadata(self):
+        results = dict()
+        for cmd in self.META_CMDS:
+            results[cmd] = self.outputs[cmd]
+
+        return self.format_metadata(results)
+
+    def format_metadata(self, results):
+        fill = "#" * 10
+        parts = ["{fill} METADATA {fill}\n".format(fill=fill)]
+        for cmd, result in results.items():
+            parts.append(self.META_FORMAT.format(cmd=cmd, rule="-"*15, result=result))
+        parts.append("\n{fill} END-METADATA {fill}".format(fill=fill))
+
+        # add comment '#' at the beginning of each line.
+        meta_data = "\n".join("# " + line for line in "".join(parts).split("\n"))
+
+        return self.filter(meta_data)
+
+    async def fetch_change_marker(self, conn):
+        if not self.CHANGE_CMD:
+            return None
+
+        output = await conn.send_command(self.CHANGE_CMD)
+
+        return self.parse_change_marker(output)
+
+    async def fetch_config(self, conn):
+        cfg = await conn.send_command(self.CONFIG_CMD)
+
+        return self.filter(cfg)
+
+    async def fetch_metadata(self, conn):
+        results = dict()
+        for cmd in self.META_CMDS:
+            results[cmd] = await conn.send_command(cmd)
+
+        return self.format_metadata(results)
+
+    def filter(self, cfg):
+        with summary.timer("redact"):
+            if self.hide_secrets:
+                cfg = self.SECRETS_REDACTOR.redact(cfg)
+
+            return self.GLOBAL_REDACTOR.redact(cfg)
+
+
+class NapalmPlatform(Platform):
+    "Platform driven through a NAPALM driver named after the Netbox platform slug."
+
+    def open(self, platform, host, username, password):
+        import napalm
+
+        driver = napalm.get_network_driver(platform)
+
+        device = driver(hostname=host, username=username, password=password)
+        device.open()
+
+        return device
+
+    def close(self, netcon):
+        netcon.close()
+
+    def run_commands(self, commands):
+        # napalm doesn't say how long each command took
+        return self.netcon.cli(commands), {}
+
+
+class NetmikoPlatform(Platform):
+    "Platform driven through netmiko, commands are pipelined with `send_batch`."
+
+    DEVICE_TYPE = None
+    # extra ConnectHandler arguments
+    NETMIKO_OPTIONS = {}
+
+    def open(self, platform, host, username, password):
+        from netmiko import ConnectHandler
+
+        return ConnectHandler(
+            device_type=self.DEVICE_TYPE,
+            host=host,
+            username=username,
+            password=password,
+            **self.NETMIKO_OPTIONS
+        )
+
+    def close(self, netcon):
+        netcon.disconnect()
+
+    def run_commands(self, commands):
+        if len(commands) == 1:
+            # nothing to pipeline
+            start = time.time()
+            output = self.netcon.send_command(commands[0])
+            return {commands[0]: output}, {commands[0]: time.time() - start}
+
+        return send_batch(self.netcon, commands)
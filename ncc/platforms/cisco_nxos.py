@@ -1,9 +1,9 @@
-import re
+from ncc.platforms import register
+from ncc.platforms.base import NapalmPlatform
 
-import napalm
 
-
-class CiscoNXOS():
+@register("nxos")
+class CiscoNXOS(NapalmPlatform):
     CONFIG_SECRETS = [
         (r'(snmp-server community).*', r'\1 <configuration removed>'),
         (r'(snmp-server host \S+( vrf \S+)?( version (1|2c|3))?)\s+\S+((\s+\S*)*)\s*', r'\1 <secret hidden> \5'),
@@ -32,40 +32,8 @@ class CiscoNXOS():
         (r'Last configuration.*', r''),
         (r'NVRAM config last.*', r'')
     ]
-
-    def __init__(self, hide_secrets, **params):
-        self.hide_secrets = hide_secrets
-        self.netcon = self.get_napalm_netcon(**params)
-        self.config = self.get_config(hide_secrets)
-        self.metadata = self.get_metadata()
-
-    def get_napalm_netcon(self, platform, host, username, password):
-        driver = napalm.get_network_driver(platform)
-        
-        device = driver(hostname=host, username=username, password=password)
-        device.open()
-
-        return device
-
-    def get_config(self, hide_secrets):
-        cfg = self.netcon.cli(["show run"])["show run"]
-
-        return self.filter(cfg)
-
-    def get_metadata(self):
-        results = dict()
-        meta_cmds = ["show inventory", "show version"]
-
-        results = self.netcon.cli(meta_cmds)
-        
-        fill = "#" * 10
-        meta_data = "{fill} METADATA {fill}\n".format(fill=fill)
-        for cmd, result in results.items():
-            meta_data += "\n\n{}\n{}\n{}".format(cmd, "-"*15, result)
-        meta_data += "\n{fill} END-METADATA {fill}".format(fill=fill)
-        
-        # add comment '#' at the beginning of each line.
-        meta_data = re.sub(r'^(.*)', r'# \1', meta_data, flags=re.M)
-        
-        return self.filter(meta_data)
-
+    CHANGE_CMD = 'show running-config | include "Running configuration last done"'
+    CONFIG_CMD = "show run"
+    META_CMDS = ["show inventory", "show version"]
+    # 'interface Gi0/1', 'router bgp 65000', 'ip route'
+    SECTION_DEPTH = 1
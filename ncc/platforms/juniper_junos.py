@@ -1,62 +1,29 @@
-import re
+from ncc.platforms import register
+from ncc.platforms.base import NapalmPlatform
 
-import napalm
 
-
-class JuniperJunos():
+@register("junos")
+class JuniperJunos(NapalmPlatform):
     CONFIG_SECRETS = [
         (r'(.*) "\S+"; ## SECRET-DATA', r'\1 < secret hidden >'),
         (r'community \S+ \{', r'community < secret hidden >')
     ]
     GLOBAL_FILTER = []
+    CHANGE_CMD = "show system commit"
+    CONFIG_CMD = "show configuration"
+    META_CMDS = [
+        "show chassis hardware",
+        "show version",
+        "show system license",
+        "show system license keys",
+    ]
+    # 'interfaces ge-0/0/0', 'protocols bgp', 'system host-name'
+    SECTION_DEPTH = 2
 
-    def __init__(self, hide_secrets, **params):
-        self.hide_secrets = hide_secrets
-        self.netcon = self.get_napalm_netcon(**params)
-        self.config = self.get_config(hide_secrets)
-        self.metadata = self.get_metadata()
-
-    def get_napalm_netcon(self, platform, host, username, password):
-        driver = napalm.get_network_driver(platform)
-        
-        device = driver(hostname=host, username=username, password=password)
-        device.open()
-
-        return device
-
-    def get_config(self, hide_secrets):
-        cfg = self.netcon.cli(["show configuration"])["show configuration"]
-
-        return self.filter(cfg)
-
-    def get_metadata(self):
-        results = dict()
-        meta_cmds = [
-            "show chassis hardware", 
-            "show version", 
-            "show system license", 
-            "show system license keys"
-            ]
-
-        results = self.netcon.cli(meta_cmds)
-
-        fill = "#" * 10
-        meta_data = "{fill} METADATA {fill}\n".format(fill=fill)
-        for cmd, result in results.items():
-            meta_data += "\n\n{}\n{}\n{}".format(cmd, "-"*15, result)
-        meta_data += "\n{fill} END-METADATA {fill}".format(fill=fill)
-
-        # add comment '#' at the beginning of each line.
-        meta_data = re.sub(r'^(.*)', r'# \1', meta_data, flags=re.M)
-
-        return self.filter(meta_data)
-
-    def filter(self, cfg):
-        if self.hide_secrets:
-            for secret in self.CONFIG_SECRETS:
-                cfg = re.sub(secret[0], secret[1], cfg, flags=re.M)
+    def parse_change_marker(self, commits):
+        # the most recent commit is listed first, numbered 0
+        for line in commits.splitlines():
+            if line.strip().startswith("0 "):
+                return line.strip()
 
-        for gfilter in self.GLOBAL_FILTER:
-            cfg = re.sub(gfilter[0], gfilter[1], cfg, flags=re.M)
-        
-        return cfg
\ No newline at end of file
+        return ""
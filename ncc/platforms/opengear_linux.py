@@ -1,34 +1,23 @@
-import re
+from ncc.platforms import register
+from ncc.platforms.base import NetmikoPlatform
 
-from netmiko import ConnectHandler
 
-
-class OpengearLinux():
+@register("opengear")
+class OpengearLinux(NetmikoPlatform):
     CONFIG_SECRETS = [
         (r'(.*password) \S+', r'\1 <secret hidden>'),
         (r'(.*community) \S+', r'\1 <secret hidden>')        
     ]
     GLOBAL_FILTER = []
+    CONFIG_CMD = "config -g config"
+    META_CMDS = ["cat /etc/version"]
     DEVICE_TYPE = "linux"
-    
-    def __init__(self, hide_secrets, **params):
-        self.hide_secrets = hide_secrets
-        self.netcon = ConnectHandler(
-            device_type=self.DEVICE_TYPE,
-            host=params["host"], 
-            username=params["username"], 
-            password=params["password"]
-        )
-        self.config = self.get_config(hide_secrets)
-        self.metadata = self.get_metadata()
-
-    def get_config(self, hide_secrets):
-        cfg = self.netcon.send_command("config -g config")
-
-        return self.filter(cfg)
+    ASYNC = False
+    # consoles fail parallel logins
+    MAX_SESSIONS = 3
 
     def get_metadata(self):
-        meta = cfg = self.netcon.send_command("cat /etc/version")
+        meta = self.outputs["cat /etc/version"]
 
         fill = "#" * 10
         meta_data = "{fill} METADATA {fill}\n".format(fill=fill)
@@ -38,14 +27,3 @@ class OpengearLinux():
         meta_data += "{fill} END-METADATA {fill}".format(fill=fill)
 
         return self.filter(meta_data)
-
-    def filter(self, cfg):
-
-        if self.hide_secrets:
-            for secret in self.CONFIG_SECRETS:
-                cfg = re.sub(secret[0], secret[1], cfg, flags=re.M)
-
-        for gfilter in self.GLOBAL_FILTER:
-            cfg = re.sub(gfilter[0], gfilter[1], cfg, flags=re.M)
-        
-        return cfg
\ No newline at end of file
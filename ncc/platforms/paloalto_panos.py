@@ -1,32 +1,63 @@
-import re
+import time
 
-import json
 import xmltodict
 import pandevice.firewall
 
+from ncc.libs.xmljson import xml_to_json
+from ncc.platforms import register
+from ncc.platforms.base import Platform
+from ncc.summary import summary
 
-class PaloaltoPanos():
-    CONFIG_SECRETS = [
-        (r'(phash":) "\S+(,?)', r'\1 <secret hidden>\2'),
-        (r'("(?:private-)?key":) "\S+(,?)', r'\1 <secret hidden>'),
-        (r'("bind-password":) "\S+', r'\1 <secret hidden>')
-    ]
+
+@register("panos")
+class PaloaltoPanos(Platform):
+    # elements whose value is replaced with --hide-secrets, whatever it holds
+    SECRET_ELEMENTS = {"phash", "key", "private-key", "bind-password"}
+    CONFIG_SECRETS = []
     GLOBAL_FILTER = []
-    
-    def __init__(self, hide_secrets, **params):
-        self.hide_secrets = hide_secrets
-        self.netcon = pandevice.firewall.Firewall(params["host"], params["username"], params["password"])
-        self.config = self.get_config(hide_secrets)
-        self.metadata = self.get_metadata()
-        
+    CHANGE_CMD = "show jobs processed"
+    CONFIG_CMD = "show config running"
+    META_CMDS = ["show system info"]
+    # XML API, no SSH session for the async engine
+    ASYNC = False
+
+    def open(self, platform, host, username, password):
+        return pandevice.firewall.Firewall(host, username, password)
+
+    def run_commands(self, commands):
+        outputs, timings = dict(), dict()
+        for cmd in commands:
+            start = time.time()
+            outputs[cmd] = self.netcon.op(cmd, xml=True)
+            timings[cmd] = time.time() - start
+
+        return outputs, timings
+
+    def parse_change_marker(self, xml_data):
+        # The running config only changes with a commit, so the
+        # newest successful commit job identifies its version.
+        jobs = (xmltodict.parse(xml_data)["response"]["result"] or {}).get("job", [])
+        if isinstance(jobs, dict):
+            jobs = [jobs]
+
+        commits = [int(j["id"]) for j in jobs if j.get("type") == "Commit" and j.get("result") == "OK"]
+        if not commits:
+            return ""
+
+        return "commit job {}".format(max(commits))
+
     def get_config(self, hide_secrets):
-        xml_cfg = self.netcon.op("show config running", xml=True)
-        json_cfg = json.dumps(xmltodict.parse(xml_cfg)["response"]["result"]["config"], indent=2)
+        xml_cfg = self.outputs[self.CONFIG_CMD]
+
+        # streamed straight from the XML, secrets are redacted as elements
+        with summary.timer("serialize"):
+            json_cfg = xml_to_json(
+                xml_cfg, ("response", "result", "config"), secrets=self.SECRET_ELEMENTS if hide_secrets else ())
 
         return self.filter(json_cfg)
 
     def get_metadata(self):
-        xml_data = self.netcon.op("show system info", xml=True)
+        xml_data = self.outputs["show system info"]
         info = xmltodict.parse(xml_data)["response"]["result"]["system"]
 
         fill = "#" * 10
@@ -41,13 +72,3 @@ class PaloaltoPanos():
         meta_data += "{fill} END-METADATA {fill}".format(fill=fill)
 
         return meta_data
-
-    def filter(self, cfg):
-        if self.hide_secrets:
-            for secret in self.CONFIG_SECRETS:
-                cfg = re.sub(secret[0], secret[1], cfg, flags=re.M)
-
-        for gfilter in self.GLOBAL_FILTER:
-            cfg = re.sub(gfilter[0], gfilter[1], cfg, flags=re.M)
-        
-        return cfg
\ No newline at end of file
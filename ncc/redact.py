@@ -0,0 +1,452 @@
+"""
+Compiled redaction engine shared by every platform's `filter()`.
+
+Platforms declare their rules as lists of `(pattern, replacement)` tuples
+(`CONFIG_SECRETS` and `GLOBAL_FILTER`).  Historically each rule was applied
+with its own `re.sub` call, one full scan of the config per rule.  A
+`Redactor` compiles a rule list once and applies it in as few passes as
+possible while producing byte-identical output:
+
+  * Runs of line-truncating rules (`literal.*` replaced with '') are
+    merged into a single alternation pass.
+  * Every other rule keeps its own pass, but is skipped entirely when
+    a literal the pattern requires is not present in the text.
+  * Rules of the form `.*<something>.*` are anchored to the start of the
+    line, so non-matching lines are scanned once instead of once per
+    character.
+  * When no rule can match across a line break, large texts are
+    redacted in chunks of whole lines, so no pass copies the whole
+    config at once.  The IOS and NX-OS secrets rules can, so those
+    configs are redacted whole.
+
+"""
+
+import re
+import threading
+from collections import Counter
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+
+# Shortest required literal worth checking before running a pass.
+# Anything shorter is present in practically every config.
+MIN_LITERAL = 3
+
+# Texts longer than this are redacted in chunks when every rule is line local.
+CHUNK_SIZE = 1 << 20
+
+# Characters that have meaning in a pattern. A rule whose prefix contains
+# none of these is a plain string and can be merged safely.
+_META = set(".^$*+?{}[]()|\\")
+
+def _tokens(parsed):
+    """
+    Flatten a parsed pattern into required characters, with None
+    marking every point where a literal run is broken.
+    """
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            yield chr(av)
+        elif op is sre_parse.SUBPATTERN:
+            # (group, add_flags, del_flags, pattern)
+            for t in _tokens(av[-1]):
+                yield t
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            yield None
+            for t in _tokens(av[2]):
+                yield t
+            yield None
+        else:
+            yield None
+
+
+def required_literal(pattern, flags=0):
+    """
+    Return the longest string every match of `pattern` must contain.
+
+    Parameters
+    ----------
+    pattern : str
+    flags : int
+        Flags the pattern will be compiled with.
+
+    Returns
+    -------
+    str
+        Empty string when no literal of at least `MIN_LITERAL`
+        characters can be determined.
+
+    Examples
+    --------
+    >>> required_literal(r'(crypto isakmp key) (\\S+) (.*)')
+    'crypto isakmp key '
+    >>> required_literal(r'(\\s+(?:password|secret)) (?:\\d )?\\S+')
+    ''
+
+    """
+    if re.compile(pattern, flags).flags & re.I:
+        return ""
+
+    runs, run = [], []
+    for t in _tokens(sre_parse.parse(pattern, flags)):
+        if t is None:
+            runs.append("".join(run))
+            run = []
+        else:
+            run.append(t)
+    runs.append("".join(run))
+
+    best = max(runs, key=len)
+    return best if len(best) >= MIN_LITERAL else ""
+
+
+def _can_match_newline(parsed, flags):
+    """
+    True if some item of a parsed pattern can match a newline character,
+    or depends on where the text starts or ends.
+    """
+    newline = ord("\n")
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            if av == newline:
+                return True
+        elif op is sre_parse.NOT_LITERAL:
+            if av != newline:
+                return True
+        elif op is sre_parse.ANY:
+            if flags & re.S:
+                return True
+        elif op is sre_parse.IN:
+            for item_op, item_av in av:
+                if item_op is sre_parse.NEGATE:
+                    return True
+                if item_op is sre_parse.LITERAL and item_av == newline:
+                    return True
+                if item_op is sre_parse.RANGE and item_av[0] <= newline <= item_av[1]:
+                    return True
+                if item_op is sre_parse.CATEGORY and item_av in (
+                        sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_DIGIT, sre_parse.CATEGORY_NOT_WORD):
+                    return True
+        elif op is sre_parse.SUBPATTERN:
+            if _can_match_newline(av[-1], flags):
+                return True
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if _can_match_newline(av[2], flags):
+                return True
+        elif op is sre_parse.BRANCH:
+            if any(_can_match_newline(p, flags) for p in av[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _can_match_newline(av[1], flags):
+                return True
+        elif op is sre_parse.AT:
+            # string anchors would match at every chunk edge
+            if av in (sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END_STRING):
+                return True
+            if av in (sre_parse.AT_BEGINNING, sre_parse.AT_END) and not flags & re.M:
+                return True
+        elif op is not sre_parse.GROUPREF:
+            # anything unknown is assumed to cross lines
+            return True
+    return False
+
+
+def line_local(pattern, flags=0):
+    """
+    True if every match of `pattern` lies within a single line.
+
+    Text split after line breaks can then be redacted chunk by chunk
+    with the same result.  Patterns that can match the empty string
+    are excluded, they could match at a chunk end where the whole text
+    continues.
+
+    Parameters
+    ----------
+    pattern : str
+    flags : int
+        Flags the pattern will be compiled with.
+
+    Returns
+    -------
+    bool
+
+    Examples
+    --------
+    >>> line_local(r'(tacacs-server (.+ )?key) .+')
+    True
+    >>> line_local(r'(\\s+(?:password|secret)) (?:\\d )?\\S+')
+    False
+
+    """
+    flags = re.compile(pattern, flags).flags
+    parsed = sre_parse.parse(pattern, flags)
+
+    return parsed.getwidth()[0] > 0 and not _can_match_newline(parsed, flags)
+
+
+def chunks(text, size=CHUNK_SIZE):
+    "Split `text` into pieces of about `size` characters, each ending after a line break."
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start + size)
+        end = len(text) if end < 0 else end + 1
+        yield text[start:end]
+        start = end
+
+
+def _edge(parsed, index):
+    "First (index=0) or last (index=-1) item of a parsed pattern, looking into groups."
+    while len(parsed):
+        op, av = parsed[index]
+        if op is not sre_parse.SUBPATTERN:
+            return op, av
+        parsed = av[-1]
+    return None, None
+
+
+def _is_dot_repeat(item, min_max):
+    op, av = item
+    return (
+        op is sre_parse.MAX_REPEAT
+        and av[0] <= min_max
+        and av[1] == sre_parse.MAXREPEAT
+        and list(av[2]) == [(sre_parse.ANY, None)]
+    )
+
+
+def line_anchorable(pattern, flags=0):
+    """
+    True if anchoring `pattern` with '^' cannot change what `re.sub` replaces.
+
+    That holds for patterns that start with `.*` and end with a greedy
+    `.*` or `.+`: every match runs to the end of a line, and a line that
+    contains a match anywhere also contains one starting at its first
+    character, which is the leftmost match `re.sub` would pick anyway.
+
+    Parameters
+    ----------
+    pattern : str
+    flags : int
+        Flags the pattern will be compiled with.
+
+    Returns
+    -------
+    bool
+
+    """
+    if re.compile(pattern, flags).flags & re.S:
+        return False
+
+    parsed = sre_parse.parse(pattern, flags)
+    first, last = _edge(parsed, 0), _edge(parsed, -1)
+    if first[0] is None:
+        return False
+
+    return _is_dot_repeat(first, 0) and _is_dot_repeat(last, 1)
+
+
+def truncation_literal(pattern, repl):
+    """
+    Return `literal` for rules of the form `literal.*` replaced with ''.
+
+    Such a rule drops the rest of the line from the first occurrence of
+    `literal`.  A run of them can be merged into one alternation pass as
+    long as none of their literals can overlap each other.
+
+    Parameters
+    ----------
+    pattern : str
+    repl : str
+
+    Returns
+    -------
+    str or None
+
+    """
+    if repl != "" or not pattern.endswith(".*"):
+        return None
+
+    head = pattern[:-2]
+    if head and not _META.intersection(head):
+        return head
+
+    return None
+
+
+def _overlaps(a, b):
+    "True if an occurrence of `a` and an occurrence of `b` can overlap."
+    if a in b or b in a:
+        return True
+    return any(a.endswith(b[:i]) or b.endswith(a[:i]) for i in range(1, min(len(a), len(b))))
+
+
+class _Pass(object):
+    """
+    One scan over the text.
+
+    Parameters
+    ----------
+    rules : list of (str, str)
+        Rules applied by this pass.  More than one rule means a merged
+        alternation of `truncation_literal` rules.
+    flags : int
+        Flags for `re.compile`.
+
+    """
+    def __init__(self, rules, flags):
+        self.rules = rules
+
+        # the pass can be skipped if none of its rules can match
+        self.literals = [required_literal(p, flags) for p, _ in rules]
+        if not all(self.literals):
+            self.literals = []
+
+        if len(rules) == 1:
+            pattern, self.repl = rules[0]
+            if line_anchorable(pattern, flags):
+                pattern = "^" + pattern
+            self.regex = re.compile(pattern, flags)
+        else:
+            # Non-capturing on purpose: capturing groups stop `re` from
+            # skipping ahead to the alternatives' first characters.
+            self.prefixes = [(truncation_literal(p, r), p) for p, r in rules]
+            self.regex = re.compile("|".join("(?:{})".format(p) for p, _ in rules), flags)
+            self.repl = None
+
+    def apply(self, text, hits):
+        if self.literals and not any(l in text for l in self.literals):
+            return text
+
+        if self.repl is not None:
+            text, n = self.regex.subn(self.repl, text)
+            if n:
+                hits[self.rules[0][0]] += n
+            return text
+
+        def dispatch(m):
+            match = m.group()
+            for prefix, pattern in self.prefixes:
+                if match.startswith(prefix):
+                    hits[pattern] += 1
+                    break
+            return ""
+
+        return self.regex.sub(dispatch, text)
+
+
+class Redactor(object):
+    """
+    Applies a list of `(pattern, replacement)` rules to text.
+
+    The result is identical to calling `re.sub(pattern, replacement,
+    text, flags=flags)` for each rule in order.
+
+    Parameters
+    ----------
+    rules : list of (str, str)
+        Regex pattern and replacement template, applied in order.
+    flags : int
+        Flags for `re.compile`, `re.M` to match the platform filters.
+
+    Attributes
+    ----------
+    passes : list of `_Pass`
+        Compiled passes, in the order they are applied.
+    hits : collections.Counter
+        Number of substitutions made by each rule, keyed by pattern.
+    line_local : bool
+        No rule matches across lines, large texts are redacted in chunks.
+
+    """
+    def __init__(self, rules, flags=re.M):
+        self.rules = list(rules)
+        self.passes = []
+        self.hits = Counter()
+        self.line_local = all(line_local(p, flags) for p, _ in self.rules)
+        self._lock = threading.Lock()
+
+        group, literals = [], []
+        for pattern, repl in self.rules:
+            literal = truncation_literal(pattern, repl)
+
+            if literal and any(_overlaps(literal, l) for l in literals):
+                self._flush(group, flags)
+                group, literals = [], []
+
+            if literal:
+                group.append((pattern, repl))
+                literals.append(literal)
+            else:
+                self._flush(group, flags)
+                group, literals = [], []
+                self.passes.append(_Pass([(pattern, repl)], flags))
+
+        self._flush(group, flags)
+
+    def _flush(self, group, flags):
+        if group:
+            self.passes.append(_Pass(group, flags))
+
+    def redact(self, text):
+        """
+        Apply every rule to `text`.
+
+        Parameters
+        ----------
+        text : str
+
+        Returns
+        -------
+        str
+            Redacted text.
+
+        """
+        if not self.passes:
+            return text
+
+        if self.line_local and len(text) > CHUNK_SIZE:
+            return "".join(self.redact_chunks(text))
+
+        hits = Counter()
+        text = self._apply(text, hits)
+        self._count(hits)
+
+        return text
+
+    def redact_chunks(self, text, size=CHUNK_SIZE):
+        """
+        Apply every rule to `text`, yielding the result in pieces.
+
+        Only valid for a `line_local` redactor, the result is then
+        identical to `redact(text)`.
+
+        Parameters
+        ----------
+        text : str
+        size : int
+            Approximate length of each piece.
+
+        Yields
+        ------
+        str
+
+        """
+        assert self.line_local
+
+        hits = Counter()
+        for chunk in chunks(text, size):
+            yield self._apply(chunk, hits)
+        self._count(hits)
+
+    def _apply(self, text, hits):
+        for p in self.passes:
+            text = p.apply(text, hits)
+        return text
+
+    def _count(self, hits):
+        if hits:
+            with self._lock:
+                self.hits.update(hits)
@@ -0,0 +1,271 @@
+"""
+Collect configs from every site at once.
+
+`SiteScheduler` keeps a single pool of device sessions across all sites
+instead of running `collect.configs` site after site.  Concurrency is
+capped both overall (`num_workers`) and per site (`site_workers`), and
+hosts are handed out round-robin across sites so one slow site can not
+hold up the others.  Hosts whose platform or site is at its adaptive
+session limit (`ncc.libs.transport.limits`) are passed over until a
+session ends.  As soon as the last host of a site finishes, the
+site is handed to `on_site_done` (e.g. the GitHub write) on a separate
+writer thread while collection carries on for the remaining sites.
+
+A failed host is not retried by the worker that collected it.  It goes
+back into its site's queue once its backoff has passed, so the worker
+and the site's slot are free for other hosts in the meantime.
+
+With the async engine all sites are collected by one event loop with
+`num_workers` concurrent sessions and sites are written once it is done.
+
+"""
+
+import time
+import heapq
+import itertools
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from nornir.core import Nornir
+from nornir.core.inventory import Inventory
+
+from ncc import collect
+from ncc.libs.transport.limits import limiter
+from ncc.platforms import UnsupportedPlatform
+from ncc.summary import summary
+
+
+def subset(devices, names):
+    """
+    Nornir object with only the hosts in `names`.  Unlike
+    `Nornir.filter` it does not scan the whole inventory.
+    """
+    inv = devices.inventory
+    nr = Nornir(**devices.__dict__)
+    nr.inventory = Inventory(
+        hosts={n: inv.hosts[n] for n in names}, groups=inv.groups, defaults=inv.defaults)
+    return nr
+
+
+class SiteScheduler(object):
+    """
+    Parameters
+    ----------
+    devices : nornir.core.Nornir
+        Nornir object with the inventory of every site.
+    sites : list of str
+        Site slugs to collect.
+    hide_secrets : bool
+        Passed to `collect.configs`.
+    retries : int
+        Times a failed host is collected again, see `collect.RetryPolicy`.
+    num_workers : int
+        Maximum number of devices collected at the same time, all sites together.
+    site_workers : int
+        Maximum number of devices collected at the same time within one site.
+    on_site_done : callable
+        Called as `on_site_done(site, nornir_obj)` once every host of
+        `site` is done.  Calls are made one at a time, in the order sites
+        finish, so writes to the same branch never race each other.
+    engine : str
+        "thread" or "async", see `collect.configs`.
+    state : ncc.state.StateStore
+        Passed to `collect.configs` to skip unchanged devices.
+
+    """
+    def __init__(self, devices, sites, hide_secrets, retries, num_workers, site_workers, on_site_done=None, engine="thread", state=None):
+        self.devices = devices
+        self.sites = sites
+        self.hide_secrets = hide_secrets
+        self.retries = retries
+        self.policy = collect.RetryPolicy(retries)
+        self.num_workers = num_workers
+        self.site_workers = site_workers
+        self.on_site_done = on_site_done
+        self.engine = engine
+        self.state = state
+
+        self.failed_hosts = dict()
+
+        self._cond = threading.Condition()
+        self._pending = dict()
+        self._remaining = Counter()
+        self._running = Counter()
+        self._order = deque()
+        # (ready time, seq, site, hostname) of hosts waiting for a retry
+        self._delayed = []
+        self._seq = itertools.count()
+        self._attempts = Counter()
+
+        # hostnames per site, from a single pass over the inventory
+        self._by_site = dict()
+        for name, host in devices.inventory.hosts.items():
+            self._by_site.setdefault(host.data.get("site"), []).append(name)
+
+    def subset(self, names):
+        return subset(self.devices, names)
+
+    def site_devices(self, site):
+        "Nornir object filtered down to a single site."
+        return self.subset(self._by_site.get(site, []))
+
+    def run(self):
+        """
+        Collect configs from every site and run `on_site_done` for each one.
+
+        Returns
+        -------
+        dict
+            Failed hosts, `{hostname: nornir.core.task.MultiResult}`.
+
+        """
+        if self.engine == "async":
+            return self._run_async()
+
+        for site in self.sites:
+            hosts = self._by_site.get(site, [])
+            logging.info("Queued %d devices for: %s", len(hosts), site)
+            if hosts:
+                self._pending[site] = deque(hosts)
+                self._remaining[site] = len(hosts)
+                self._order.append(site)
+
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._writes = []
+
+        workers = [
+            threading.Thread(target=self._worker, name="ncc-collect-{}".format(i))
+            for i in range(max(1, self.num_workers))
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        self._writer.shutdown(wait=True)
+        for w in self._writes:
+            # re-raise write errors
+            w.result()
+
+        return self.failed_hosts
+
+    def _run_async(self):
+        devices = self.subset([name for site in self.sites for name in self._by_site.get(site, [])])
+        _, results = collect.configs(
+            devices, self.hide_secrets, self.retries, num_workers=self.num_workers, engine="async", state=self.state)
+        self.failed_hosts.update(results.failed_hosts)
+
+        for site in self.sites:
+            if self._by_site.get(site):
+                self._site_done(site)
+
+        return self.failed_hosts
+
+    def _next(self):
+        """
+        Return (site, hostname) of the next host to collect, or None when
+        every host is done.  Must be called with `_cond` held.
+        """
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, site, hostname = heapq.heappop(self._delayed)
+                self._pending[site].appendleft(hostname)
+
+            if not any(self._pending[s] for s in self._order):
+                if not self._delayed and not any(self._running.values()):
+                    return None
+            else:
+                for _ in range(len(self._order)):
+                    site = self._order[0]
+                    self._order.rotate(-1)
+                    if self._pending[site] and self._running[site] < self.site_workers:
+                        hostname = self._startable(site)
+                        if hostname is not None:
+                            self._running[site] += 1
+                            return site, hostname
+
+            # every site with work left is at its limit, or waiting for
+            # running hosts and retries
+            self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def _startable(self, site):
+        """
+        Take the first pending host of `site` whose platform and site
+        session limits have room, see `ncc.libs.transport.limits`.
+        """
+        pending = self._pending[site]
+        platforms = set()
+        for i, hostname in enumerate(pending):
+            platform = self.devices.inventory.hosts[hostname].platform
+            if platform in platforms:
+                continue
+            try:
+                available = limiter.available(platform, site)
+            except UnsupportedPlatform:
+                # fails right away, and is reported by `collect`
+                available = True
+            if available:
+                del pending[i]
+                return hostname
+            platforms.add(platform)
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next()
+            if job is None:
+                return
+
+            site, hostname = job
+            retry_in = None
+            try:
+                retry_in = self._collect(hostname)
+            finally:
+                with self._cond:
+                    self._running[site] -= 1
+                    if retry_in is None:
+                        self._remaining[site] -= 1
+                    else:
+                        heapq.heappush(self._delayed, (time.monotonic() + retry_in, next(self._seq), site, hostname))
+                    done = self._remaining[site] == 0
+                    self._cond.notify_all()
+
+            if done:
+                logging.info("Finished collecting configs for: %s", site)
+                self._writes.append(self._writer.submit(self._site_done, site))
+
+    def _collect(self, hostname):
+        """
+        Collect a single attempt of `hostname`.  Returns the seconds
+        to wait before retrying it, None if it is done.
+        """
+        host = self.subset([hostname])
+        _, results = collect.configs(host, self.hide_secrets, 0, num_workers=1, state=self.state)
+
+        failed = results.failed_hosts.get(hostname)
+        with self._cond:
+            if failed is None:
+                self.failed_hosts.pop(hostname, None)
+                return None
+            self.failed_hosts[hostname] = failed
+            self._attempts[hostname] += 1
+            attempt = self._attempts[hostname]
+
+        if attempt > self.policy.retries:
+            return None
+        if self.policy.permanent(failed):
+            logging.info("Not retrying %s: %s", hostname, failed[0].exception)
+            return None
+
+        summary.count("host retries")
+        delay = self.policy.delay(attempt)
+        logging.info("Retrying %s in %.1fs, attempt %d of %d", hostname, delay, attempt, self.policy.retries)
+        return delay
+
+    def _site_done(self, site):
+        if self.on_site_done:
+            self.on_site_done(site, self.site_devices(site))
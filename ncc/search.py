@@ -0,0 +1,464 @@
+"""
+Search index over the latest config of every device.
+
+Fleet wide questions, which devices have `snmp-server community X` or
+which interfaces are in VLAN 200, otherwise mean grepping a clone of
+the configs repo.  The index answers them in milliseconds:
+
+    index = SearchIndex()
+    index.update("usden1/r1", text)             # after each collection
+    index.save()
+    index.search("switchport access vlan 200")  # [Match, ...]
+    index.search("snmp-server community *")     # * ends a token prefix
+    index.search(r"vlan 2\\d\\d$", regex=True)
+
+Configs of a fleet repeat the same lines over and over, so the index
+is built on distinct lines:
+
+    - every distinct line has an id, and postings of the devices and
+      line numbers it appears at
+    - every whitespace separated token maps to the ids of the lines
+      that contain it, so a phrase query intersects the lines of its
+      tokens and only checks those
+    - prefix tokens are looked up by bisecting the sorted tokens, and
+      regexes scan only the lines containing the longest literal they
+      require, found in the tokens joined into one string
+
+An update only touches the lines of the device that changed, and is
+skipped when its config is the same.  Matches carry the header of the
+block their line is in, e.g. the interface of a `switchport` line.
+
+The index is saved as one marshal file, written atomically, so
+`ncc.py search` can query what `run` and `serve` collected.  A save
+holds an flock on the index's lock file and, when another process
+saved since, reloads the file and applies only the devices updated
+here, so `run` and `serve` sharing an index keep each other's devices.
+The lookup tables are saved too, a search only reads the file back.
+
+"""
+
+import os
+import re
+import fcntl
+import heapq
+import bisect
+import marshal
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+from ncc.diff import ignored, indentation
+from ncc.redact import required_literal
+from ncc.spool import as_text
+from ncc.summary import summary
+
+
+DEFAULT_INDEX_FILE = os.path.join(os.path.expanduser("~"), ".ncc", "search.idx")
+
+# bumped when the saved layout changes, older files are ignored
+FORMAT = 2
+
+# saved attributes of a `SearchIndex`
+FIELDS = ("lines", "line_ids", "_free", "postings", "tokens", "names", "device_ids", "shas", "device_lines")
+
+Match = namedtuple("Match", ["device", "lineno", "line", "section"])
+Match.__doc__ = "A matching line, `lineno` counted from 1, `section` its block header or None."
+
+
+class SearchError(Exception):
+    "Error raised for a query that can't be run."
+    pass
+
+
+def tokens(line):
+    "Tokens of `line`, split on whitespace."
+    return line.split()
+
+
+def _device_filter(devices):
+    try:
+        return re.compile(devices) if devices else None
+    except re.error as e:
+        raise SearchError("invalid device regex {!r}: {}".format(devices, e))
+
+
+class SearchIndex(object):
+    """
+    Parameters
+    ----------
+    path : str
+        File to load from and save to.  Created on first save.
+
+    """
+    def __init__(self, path=DEFAULT_INDEX_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+
+        # line id -> text, None once no device has the line
+        self.lines = []
+        self.line_ids = dict()
+        self._free = []
+        # line id -> {device id: line numbers}
+        self.postings = []
+        # token -> line ids
+        self.tokens = dict()
+        # device id -> name, sha256 of its config, its line ids in order
+        self.names = []
+        self.device_ids = dict()
+        self.shas = []
+        self.device_lines = []
+
+        # names of the devices updated or removed since the last save
+        self._changed = set()
+        # identity of the index file as last loaded or saved
+        self._file_id = None
+        # sorted tokens, and joined with their offsets, for prefix and regex queries
+        self._sorted = None
+        self._joined = None
+        self._offsets = None
+
+        if os.path.exists(path):
+            self._load()
+
+    # -- updating
+
+    def update(self, device, text):
+        """
+        Index `text` as the config of `device`, replacing its previous one.
+
+        Returns
+        -------
+        bool
+            False if the config is the one already indexed.
+
+        """
+        with self._lock:
+            with summary.timer("index"):
+                changed = self._update(device, text)
+        if changed:
+            summary.count("configs indexed")
+        return changed
+
+    def _update(self, device, text):
+        "`update` without recording it in the run summary."
+        sha = hashlib.sha256(text.encode("utf-8")).digest()
+        dev = self.device_ids.get(device)
+        if dev is not None and self.shas[dev] == sha:
+            return False
+
+        if dev is None:
+            dev = self.device_ids[device] = len(self.names)
+            self.names.append(device)
+            self.shas.append(None)
+            self.device_lines.append([])
+
+        positions = dict()
+        for lineno, line in enumerate(text.split("\n")):
+            positions.setdefault(line, []).append(lineno)
+
+        ids = [None] * sum(len(p) for p in positions.values())
+        for line, linenos in positions.items():
+            lid = self._line(line)
+            self.postings[lid][dev] = tuple(linenos)
+            for lineno in linenos:
+                ids[lineno] = lid
+
+        # lines the device still has keep their postings
+        self._unlink(dev, set(self.device_lines[dev]).difference(ids))
+        self.shas[dev] = sha
+        self.device_lines[dev] = ids
+        self._changed.add(device)
+        return True
+
+    def update_config(self, config):
+        "`update` with a config dict as from `write.host_configs`, keyed by its path."
+        return self.update(os.path.splitext(config["path"])[0], as_text(config["content"]))
+
+    def remove(self, device):
+        "Drop `device` from the index."
+        with self._lock:
+            dev = self.device_ids.pop(device, None)
+            if dev is None:
+                return
+            self._unlink(dev, set(self.device_lines[dev]))
+            self.names[dev] = self.shas[dev] = None
+            self.device_lines[dev] = []
+            self._changed.add(device)
+
+    def _line(self, text):
+        "Id of line `text`, adding it to the index if no device has it yet."
+        lid = self.line_ids.get(text)
+        if lid is not None:
+            return lid
+
+        if self._free:
+            lid = self._free.pop()
+            self.lines[lid] = text
+            self.postings[lid] = dict()
+        else:
+            lid = len(self.lines)
+            self.lines.append(text)
+            self.postings.append(dict())
+        self.line_ids[text] = lid
+
+        for token in set(tokens(text)):
+            ids = self.tokens.get(token)
+            if ids is None:
+                ids = self.tokens[token] = set()
+                self._sorted = self._joined = None
+            ids.add(lid)
+        return lid
+
+    def _unlink(self, dev, lids):
+        "Remove device `dev` from the postings of lines `lids`, dropping lines left without devices."
+        for lid in lids:
+            posting = self.postings[lid]
+            posting.pop(dev, None)
+            if posting:
+                continue
+
+            text = self.lines[lid]
+            for token in set(tokens(text)):
+                ids = self.tokens[token]
+                ids.discard(lid)
+                if not ids:
+                    del self.tokens[token]
+                    self._sorted = self._joined = None
+            del self.line_ids[text]
+            self.lines[lid] = self.postings[lid] = None
+            self._free.append(lid)
+
+    # -- persistence
+
+    def save(self):
+        """
+        Atomically write the index file, if anything changed since it
+        was loaded.  Devices another process saved in the meantime are
+        kept, those updated here replace theirs.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            with open(self.path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    if _file_id(self.path) != self._file_id:
+                        self._merge_saved()
+
+                    data = {field: getattr(self, field) for field in FIELDS}
+                    data["format"] = FORMAT
+                    tmp = "{}.{}.tmp".format(self.path, os.getpid())
+                    with open(tmp, "wb") as f:
+                        f.write(marshal.dumps(data))
+                    os.replace(tmp, self.path)
+                    self._file_id = _file_id(self.path)
+                    self._changed = set()
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _merge_saved(self):
+        "Take the saved index, with the devices changed here applied to it."
+        saved = SearchIndex(self.path)
+        for device in self._changed:
+            dev = self.device_ids.get(device)
+            if dev is None:
+                saved.remove(device)
+            else:
+                saved._update(device, self._text(dev))
+
+        for field in FIELDS:
+            setattr(self, field, getattr(saved, field))
+        self._sorted = self._joined = self._offsets = None
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                file_id = _file_id(f)
+                # one read, marshal reads a file object in small pieces
+                data = marshal.loads(f.read())
+        except (ValueError, EOFError, TypeError) as e:
+            # corrupt, or written by a Python with another marshal format,
+            # rebuilt as devices are collected
+            logging.warning("Ignoring unreadable search index %s: %s", self.path, e)
+            return
+        if not isinstance(data, dict) or data.get("format") != FORMAT:
+            return
+
+        for field in FIELDS:
+            setattr(self, field, data[field])
+        self._file_id = file_id
+
+    def _text(self, dev):
+        "Indexed config of device id `dev`."
+        return "\n".join(self.lines[lid] for lid in self.device_lines[dev])
+
+    # -- querying
+
+    def devices(self):
+        "Names of every indexed device."
+        with self._lock:
+            return sorted(self.device_ids)
+
+    def search(self, query, regex=False, devices=None, limit=None):
+        """
+        Lines matching `query`.
+
+        Parameters
+        ----------
+        query : str
+            Whitespace separated tokens, matched as a phrase of whole
+            tokens anywhere in a line.  A token ending with '*' matches
+            every token starting with the rest of it.  With `regex`, a
+            regular expression searched in every line.
+        regex : bool
+        devices : str
+            Regex the device names are matched against, e.g. '^usden1/'.
+        limit : int
+            Maximum number of matches returned, None for all.
+
+        Returns
+        -------
+        list of Match
+            Ordered by device and line number.
+
+        """
+        device_filter = _device_filter(devices)
+        with self._lock:
+            found = []
+            for lid in self._matching_lines(query, regex):
+                for dev, linenos in self.postings[lid].items():
+                    name = self.names[dev]
+                    if device_filter is None or device_filter.search(name):
+                        found.extend((name, lineno, dev) for lineno in linenos)
+
+            found = sorted(found) if limit is None else heapq.nsmallest(limit, found)
+            return [Match(name, lineno + 1, self.lines[self.device_lines[dev][lineno]], self._section(dev, lineno))
+                    for name, lineno, dev in found]
+
+    def count(self, query, regex=False, devices=None):
+        """
+        Like `search`, without looking up line numbers and sections.
+
+        Returns
+        -------
+        dict
+            Maps the name of every device with a match to its number of
+            matching lines.
+
+        """
+        device_filter = _device_filter(devices)
+        with self._lock:
+            counts = dict()
+            for lid in self._matching_lines(query, regex):
+                for dev, linenos in self.postings[lid].items():
+                    counts[dev] = counts.get(dev, 0) + len(linenos)
+            counts = {self.names[dev]: n for dev, n in counts.items()}
+
+        if device_filter is not None:
+            counts = {name: n for name, n in counts.items() if device_filter.search(name)}
+        return counts
+
+    def _matching_lines(self, query, regex):
+        "Ids of the lines matching `query`."
+        if not regex:
+            if not tokens(query):
+                raise SearchError("empty query")
+            return self._phrase_lines(tokens(query))
+
+        try:
+            pattern = re.compile(query)
+        except re.error as e:
+            raise SearchError("invalid regex {!r}: {}".format(query, e))
+        # only lines with a token holding what every match contains,
+        # `required_literal` gives up on patterns that ignore case
+        literal = max(required_literal(query).split(), key=len, default="")
+        return [lid for lid in self._literal_lines(literal) if pattern.search(self.lines[lid])]
+
+    def _token_lines(self, token):
+        "Ids of the lines containing `token`, or a token it is the prefix of when it ends with '*'."
+        if not token.endswith("*"):
+            return self.tokens.get(token, set())
+
+        prefix = token[:-1]
+        if self._sorted is None:
+            self._sorted = sorted(self.tokens)
+        ids = set()
+        for i in range(bisect.bisect_left(self._sorted, prefix), len(self._sorted)):
+            if not self._sorted[i].startswith(prefix):
+                break
+            ids |= self.tokens[self._sorted[i]]
+        return ids
+
+    def _phrase_lines(self, query):
+        "Ids of the lines where the tokens of `query` appear in a row."
+        sets = sorted((self._token_lines(t) for t in query), key=len)
+        if not sets[0]:
+            return []
+        lids = set(sets[0]).intersection(*sets[1:])
+
+        if len(query) == 1:
+            return list(lids)
+
+        def token_match(want, token):
+            return token.startswith(want[:-1]) if want.endswith("*") else token == want
+
+        matches = []
+        n = len(query)
+        for lid in lids:
+            line = tokens(self.lines[lid])
+            if any(all(token_match(w, t) for w, t in zip(query, line[i:i + n]))
+                   for i in range(len(line) - n + 1)):
+                matches.append(lid)
+        return matches
+
+    def _literal_lines(self, literal):
+        "Ids of the lines with a token containing `literal`, every line if it is empty."
+        if not literal:
+            return [lid for lid, text in enumerate(self.lines) if text is not None]
+
+        # one C level scan of every token instead of a loop over them
+        if self._joined is None:
+            if self._sorted is None:
+                self._sorted = sorted(self.tokens)
+            self._joined = "\n".join(self._sorted) + "\n"
+            self._offsets = []
+            offset = 0
+            for token in self._sorted:
+                self._offsets.append(offset)
+                offset += len(token) + 1
+
+        ids = set()
+        start = self._joined.find(literal)
+        while start != -1:
+            i = bisect.bisect_right(self._offsets, start) - 1
+            ids |= self.tokens[self._sorted[i]]
+            # on to the next token
+            start = self._joined.find(literal, self._offsets[i] + len(self._sorted[i]) + 1)
+        return ids
+
+    def _section(self, dev, lineno):
+        "Header of the block line `lineno` of device `dev` is in, None at the top level."
+        ids = self.device_lines[dev]
+        indent = indentation(self.lines[ids[lineno]])
+        if not indent:
+            return None
+        for i in range(lineno - 1, -1, -1):
+            line = self.lines[ids[i]]
+            if not ignored(line.strip()) and indentation(line) < indent:
+                return line.strip()
+        return None
+
+
+def _file_id(f):
+    "Identity of file or path `f` that changes when it is replaced or written, None if it is missing."
+    try:
+        st = os.fstat(f.fileno()) if hasattr(f, "fileno") else os.stat(f)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
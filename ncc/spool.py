@@ -0,0 +1,144 @@
+"""
+On-disk spool for collected configs.
+
+Keeping every collected config as a string on its nornir host means
+the whole fleet's configs are in memory until the site, or with a
+single commit the whole run, is written.  Instead `collect` writes each
+config to the module level `spool` as soon as the device is done and
+keeps only a `SpooledConfig` reference, which the writers read back one
+file at a time:
+
+    ref = spool.write("r1", [metadata, config])
+    ref.sha           # git blob sha, computed while writing
+    ref.read()        # the text again
+    ref.copy_to(path) # without loading it
+
+The spool directory is temporary and removed with `cleanup()` at the
+end of the run.
+
+Only what is held after collection is bounded.  A device's config is
+still read from its session as one string and redacted before it is
+spooled, so peak memory grows with the largest configs times
+`--workers`, no longer with the fleet.  IOS and NX-OS configs are also
+redacted whole, see `ncc.redact`.
+
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import itertools
+
+
+class SpooledConfig(object):
+    """
+    Reference to a config in the spool.
+
+    Attributes
+    ----------
+    path : str
+        Spool file, UTF-8 encoded.
+    size : int
+        Size in bytes.
+    sha : str
+        Git object hash of the content as a blob.
+
+    """
+    __slots__ = ("path", "size", "sha")
+
+    def __init__(self, path, size, sha):
+        self.path = path
+        self.size = size
+        self.sha = sha
+
+    def read(self):
+        "Content as text."
+        with open(self.path, encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def copy_to(self, path):
+        "Copy the content to file `path`."
+        shutil.copyfile(self.path, path)
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __repr__(self):
+        return "<SpooledConfig {} {} bytes>".format(self.path, self.size)
+
+
+def as_text(content):
+    "`content` as text, reading it from the spool if it is a `SpooledConfig`."
+    if isinstance(content, SpooledConfig):
+        return content.read()
+    return content
+
+
+class Spool(object):
+    """
+    Parameters
+    ----------
+    directory : str
+        Parent of the spool directory, the system temp dir by default.
+
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.path = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def _dir(self):
+        with self._lock:
+            if self.path is None:
+                self.path = tempfile.mkdtemp(prefix="ncc-spool-", dir=self.directory)
+            return self.path
+
+    def write(self, name, parts):
+        """
+        Write the concatenation of `parts` to a new spool file.
+
+        Parameters
+        ----------
+        name : str
+            Device name, only used to name the file.
+        parts : list of str
+
+        Returns
+        -------
+        `SpooledConfig`
+
+        """
+        path = os.path.join(self._dir(), "{}.{}".format(name.replace(os.sep, "_"), next(self._ids)))
+
+        # git hashes the size first, so encode before hashing
+        data = [p.encode("utf-8") for p in parts if p]
+        size = sum(len(d) for d in data)
+        sha = hashlib.sha1("blob {}\0".format(size).encode("utf-8"))
+
+        with open(path, "wb") as f:
+            for d in data:
+                sha.update(d)
+                f.write(d)
+
+        return SpooledConfig(path, size, sha.hexdigest())
+
+    def discard(self, ref):
+        "Remove the spool file of `ref`, once it is no longer needed."
+        if isinstance(ref, SpooledConfig):
+            try:
+                os.remove(ref.path)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        "Remove the spool directory and every file in it."
+        with self._lock:
+            path, self.path = self.path, None
+        if path:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+spool = Spool()
@@ -0,0 +1,94 @@
+"""
+Local state kept between collection runs.
+
+`StateStore` remembers the last seen change marker of every device
+(e.g. the IOS 'Last configuration change' line or the Junos commit).
+When a device reports the same marker again its config has not
+changed, and the full config fetch and redaction can be skipped.
+
+A marker only says the config is the same.  Software upgrades and
+hardware swaps change the version and inventory metadata without
+touching it, so a marker older than `max_age` is not returned and the
+device is fetched in full again.
+
+"""
+
+import os
+import json
+import time
+import threading
+
+
+DEFAULT_STATE_FILE = os.path.join(os.path.expanduser("~"), ".ncc", "state.json")
+
+# seconds a device is skipped for before its metadata is refreshed
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+class StateStore(object):
+    """
+    Change markers per device, persisted as a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        JSON file to load from and save to.  Created on first save.
+    max_age : float
+        Seconds since a device was last fetched in full after which its
+        marker is ignored.
+
+    """
+    def __init__(self, path=DEFAULT_STATE_FILE, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.markers = dict()
+        # unix time of the last full fetch of every device with a marker
+        self.fetched = dict()
+        # devices whose marker was too old to be returned by `get`
+        self._due = set()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.markers = data.get("markers", {})
+            self.fetched = data.get("fetched", {})
+
+    def get(self, hostname):
+        "Last marker saved for `hostname`, None if unknown or too old."
+        with self._lock:
+            if time.time() - self.fetched.get(hostname, 0) > self.max_age:
+                self._due.add(hostname)
+                return None
+            return self.markers.get(hostname)
+
+    def update(self, markers):
+        """
+        Parameters
+        ----------
+        markers : dict
+            Maps hostname to its new change marker.
+
+        """
+        now = time.time()
+        with self._lock:
+            for hostname, marker in markers.items():
+                # a new marker, or one `get` didn't return, means a full fetch
+                if hostname in self._due or self.markers.get(hostname) != marker:
+                    self.fetched[hostname] = now
+                    self._due.discard(hostname)
+            self.markers.update(markers)
+
+    def save(self):
+        "Atomically write the state file."
+        with self._lock:
+            data = json.dumps({"markers": self.markers, "fetched": self.fetched}, indent=2, sort_keys=True)
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
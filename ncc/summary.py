@@ -0,0 +1,281 @@
+"""
+Run summary shared by every stage of a collection run.
+
+Workers record counters and timings on the module level `summary`
+object, `ncc.py` prints `summary.report()` at the end of the run and
+can write it as JSON (`write_json`) and as a Prometheus textfile
+(`write_prometheus`) for the node exporter's textfile collector.
+
+Timings are recorded per phase, e.g. 'connect', 'command', 'redact',
+'blob upload', and labelled with the device, platform and site being
+collected.  Labels are set once per device with `summary.labels()` and
+picked up by every timing recorded below it, in the same thread or
+asyncio task:
+
+    with summary.labels(device=host.name, platform=host.platform, site=site):
+        with summary.timer("connect"):
+            ...
+
+A sample costs one `perf_counter` call pair and a list append.
+
+"""
+
+import os
+import json
+import math
+import time
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+QUANTILES = [0.5, 0.95, 0.99]
+
+# labels of the device currently being collected
+_labels = contextvars.ContextVar("ncc_summary_labels", default={})
+
+
+def percentile(values, q):
+    "Nearest rank `q` percentile of the sorted list `values`."
+    if not values:
+        return None
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def stats(values):
+    "count, total, max and `QUANTILES` of a list of seconds."
+    values = sorted(values)
+    result = {"count": len(values), "total": sum(values), "max": values[-1] if values else None}
+    for q in QUANTILES:
+        result["p{}".format(int(q * 100))] = percentile(values, q)
+    return result
+
+
+class RunSummary(object):
+    """
+    Thread safe collection of counters and timings.
+
+    Attributes
+    ----------
+    counters : collections.Counter
+        Named event counts, e.g. 'batched sessions'.
+    peaks : dict
+        Highest value seen of named gauges, e.g. 'peak open sessions'.
+    samples : list
+        (phase, seconds, labels) of every timing recorded.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Start over, e.g. for the next interval of a long running process."
+        with self._lock:
+            self.started = time.time()
+            self.counters = Counter()
+            self.peaks = dict()
+            self.samples = list()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def peak(self, name, value):
+        "Record `value` of gauge `name`, only the highest one is kept."
+        with self._lock:
+            if value > self.peaks.get(name, value - 1):
+                self.peaks[name] = value
+
+    @contextmanager
+    def labels(self, **labels):
+        "Label every timing recorded inside the block, e.g. with device=, platform=, site=."
+        token = _labels.set(dict(_labels.get(), **labels))
+        try:
+            yield
+        finally:
+            _labels.reset(token)
+
+    def add_phase(self, phase, seconds, **labels):
+        "Record that `phase` took `seconds`."
+        current = _labels.get()
+        if labels:
+            current = dict(current, **labels)
+        with self._lock:
+            self.samples.append((phase, seconds, current))
+
+    @contextmanager
+    def timer(self, phase, **labels):
+        "Record how long the block takes as `phase`."
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(phase, time.perf_counter() - start, **labels)
+
+    def add_timings(self, platform, timings):
+        """
+        Parameters
+        ----------
+        platform : str
+            Netbox platform slug.
+        timings : dict
+            Maps command to seconds, as returned by `send_batch`.
+
+        """
+        for cmd, seconds in timings.items():
+            self.add_phase("command", seconds, platform=platform, command=cmd)
+
+    def _grouped(self, *keys):
+        "Map tuples of label `keys` plus the phase to lists of seconds."
+        with self._lock:
+            samples = list(self.samples)
+
+        groups = defaultdict(list)
+        for phase, seconds, labels in samples:
+            groups[tuple(labels.get(k) for k in keys) + (phase,)].append(seconds)
+        return groups
+
+    def to_dict(self):
+        """
+        Everything recorded so far, aggregated for the JSON report.
+
+        Phases are aggregated overall, per platform and per site with
+        `stats()`, commands per platform and command, and every device
+        gets its total seconds per phase.
+        """
+        def nest(groups):
+            result = defaultdict(dict)
+            for key, values in groups.items():
+                result[key[0]][key[-1]] = stats(values)
+            return dict(result)
+
+        commands = defaultdict(dict)
+        for (platform, cmd, phase), values in self._grouped("platform", "command").items():
+            if phase == "command":
+                commands[platform][cmd] = stats(values)
+
+        devices = dict()
+        for (device, platform, site, phase), values in self._grouped("device", "platform", "site").items():
+            if device is None:
+                continue
+            info = devices.setdefault(device, {"platform": platform, "site": site, "phases": {}})
+            info["phases"][phase] = sum(values)
+
+        with self._lock:
+            counters = dict(self.counters)
+            peaks = dict(self.peaks)
+
+        return {
+            "started": self.started,
+            "duration": time.time() - self.started,
+            "counters": counters,
+            "peaks": peaks,
+            "phases": {phase: stats(values) for (phase,), values in self._grouped().items()},
+            "platforms": nest({k: v for k, v in self._grouped("platform").items() if k[0]}),
+            "sites": nest({k: v for k, v in self._grouped("site").items() if k[0]}),
+            "commands": dict(commands),
+            "devices": devices,
+        }
+
+    def write_json(self, path):
+        "Atomically write `to_dict()` to `path`."
+        _write(path, json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path, prefix="ncc"):
+        """
+        Atomically write the run as a Prometheus textfile.
+
+        Phases become summaries with `QUANTILES`, overall and per
+        platform and site.  Devices are left out to keep the number of
+        series bounded, they are in the JSON report.
+        """
+        data = self.to_dict()
+        lines = list()
+
+        def metric(name, kind, help_text):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+
+        def summaries(name, groups, label=None):
+            for key, phases in sorted(groups.items()):
+                for phase, s in sorted(phases.items()):
+                    labels = [("phase", phase)] + ([(label, key)] if label else [])
+                    for q in QUANTILES:
+                        value = s["p{}".format(int(q * 100))]
+                        lines.append(_sample(prefix, name, labels + [("quantile", str(q))], value))
+                    lines.append(_sample(prefix, name + "_sum", labels, s["total"]))
+                    lines.append(_sample(prefix, name + "_count", labels, s["count"]))
+
+        metric("phase_seconds", "summary", "Seconds spent in each phase of the last run.")
+        summaries("phase_seconds", {None: data["phases"]})
+        metric("platform_phase_seconds", "summary", "Seconds spent in each phase of the last run, per platform.")
+        summaries("platform_phase_seconds", data["platforms"], "platform")
+        metric("site_phase_seconds", "summary", "Seconds spent in each phase of the last run, per site.")
+        summaries("site_phase_seconds", data["sites"], "site")
+
+        metric("events", "gauge", "Events counted during the last run.")
+        for name, n in sorted(data["counters"].items()):
+            lines.append(_sample(prefix, "events", [("event", name)], n))
+        metric("peak", "gauge", "Highest value of gauges during the last run.")
+        for name, n in sorted(data["peaks"].items()):
+            lines.append(_sample(prefix, "peak", [("name", name)], n))
+
+        metric("run_duration_seconds", "gauge", "Duration of the last run.")
+        lines.append(_sample(prefix, "run_duration_seconds", [], data["duration"]))
+        metric("last_run_timestamp_seconds", "gauge", "Unix time the last run started.")
+        lines.append(_sample(prefix, "last_run_timestamp_seconds", [], data["started"]))
+
+        _write(path, "\n".join(lines) + "\n")
+
+    def report(self):
+        "Human readable summary of the run."
+        lines = ["{fill} RUN SUMMARY {fill}".format(fill="#" * 10)]
+
+        for name, n in sorted(self.counters.items()):
+            lines.append("{:<40} {:>8}".format(name, n))
+
+        for name, n in sorted(self.peaks.items()):
+            lines.append("{:<40} {:>8}".format(name, n))
+
+        data = self.to_dict()
+
+        if data["phases"]:
+            lines.append("")
+            lines.append("{:<20} {:>7} {:>10} {:>8} {:>8} {:>8}".format(
+                "phase", "count", "total (s)", "p50", "p95", "p99"))
+            for phase, s in sorted(data["phases"].items()):
+                lines.append("{:<20} {:>7} {:>10.2f} {:>8.3f} {:>8.3f} {:>8.3f}".format(
+                    phase, s["count"], s["total"], s["p50"], s["p95"], s["p99"]))
+
+        if data["commands"]:
+            lines.append("")
+            lines.append("{:<12} {:<30} {:>6} {:>9} {:>9}".format("platform", "command", "runs", "avg (s)", "max (s)"))
+            for platform, commands in sorted(data["commands"].items(), key=lambda i: str(i[0])):
+                for cmd, s in sorted(commands.items()):
+                    lines.append("{:<12} {:<30} {:>6} {:>9.2f} {:>9.2f}".format(
+                        str(platform), cmd, s["count"], s["total"] / s["count"], s["max"]))
+
+        return "\n".join(lines)
+
+
+def _sample(prefix, name, labels, value):
+    if labels:
+        body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+        return "{}_{}{{{}}} {}".format(prefix, name, body, value)
+    return "{}_{} {}".format(prefix, name, value)
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+summary = RunSummary()
@@ -5,9 +5,22 @@ https://nbviewer.jupyter.org/gist/jiffyclub/10809459
 """
 
 import os
+import time
+import random
+import base64
+import hashlib
+import logging
+import subprocess
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-import github3
+from ncc.diff import commit_message
+from ncc.spool import SpooledConfig, as_text, spool
+from ncc.summary import summary
+
+
+DEFAULT_CLONE_DIR = os.path.join(os.path.expanduser('~'), '.ncc', 'configs')
 
 
 def split_one(path):
@@ -37,6 +50,33 @@ def split_one(path):
         return tuple(s)
 
 
+def git_blob_sha(content):
+    """
+    Git object hash of `content` as a blob, the sha GitHub reports
+    for a file with that content.
+    
+    Parameters
+    ----------
+    content : str or `ncc.spool.SpooledConfig`
+    
+    Returns
+    -------
+    str
+    
+    Examples
+    --------
+    >>> git_blob_sha('hello\\n')
+    'ce013625030ba8dba906f756967f9e9ca394464a'
+    
+    """
+    if isinstance(content, SpooledConfig):
+        # hashed when it was spooled
+        return content.sha
+    data = content.encode('utf-8')
+    header = 'blob {}\0'.format(len(data)).encode('utf-8')
+    return hashlib.sha1(header + data).hexdigest()
+
+
 class File(object):
     """
     Represents a file/blob in the repo.
@@ -51,8 +91,8 @@ class File(object):
     sha : str
         Git sha for an existing file, 
         omitted or None for a new/changed file.
-    content : str
-        File's contents as text. 
+    content : str or `ncc.spool.SpooledConfig`
+        File's contents as text, or a reference read when uploading.
         Omitted or None for an existing file,
         must be given for a changed or new file.
     
@@ -62,6 +102,7 @@ class File(object):
         self.mode = mode
         self.sha = sha
         self.content = content
+        self.uploaded = False
     
     def create_blob(self, repo):
         """
@@ -87,13 +128,17 @@ class File(object):
         
         """
         if self.sha:
-            # already up to date
-            print('Blob unchanged for {}'.format(self.name))
-            changed = False
+            # already up to date, or uploaded earlier in this push
+            changed = self.uploaded
+            if not changed:
+                logging.debug('Blob unchanged for %s', self.name)
         else:
             assert self.content is not None
             print('Making blob for {}'.format(self.name))
-            self.sha = repo.create_blob(self.content, encoding='utf-8')
+            with summary.timer('blob upload'):
+                self.sha = repo.create_blob(as_text(self.content), encoding='utf-8')
+            self.uploaded = True
+            summary.count('blobs uploaded')
             changed = True
         
         return {'path': self.name,
@@ -106,6 +151,11 @@ class File(object):
 class Directory(object):
     """
     Represents a directory/tree in the repo.
+
+    An existing tree given with `repo` is loaded lazily: its entries
+    are fetched (one level, not recursively) the first time a path
+    inside it is read or written.  Trees that are never touched are
+    reused by their sha without being downloaded.
     
     Parameters
     ----------
@@ -113,14 +163,40 @@ class Directory(object):
         Name of directory. Should not contain any path components.
     sha : str
         Hash for an existing tree, omitted or None for a new tree.
+        May also be a commit sha for the root directory.
+    repo : github3.repos.repo.Repository
+        Repository to load an existing tree's entries from.
+        Omitted or None if the entries are added by the caller.
     
     """
-    def __init__(self, name, sha=None):
+    def __init__(self, name, sha=None, repo=None):
         self.name = name
         self.sha = sha
+        self.repo = repo
         self.files = {}
         self.directories = {}
         self.changed = False
+        self.built = False
+        self.tree_info = None
+        self.loaded = repo is None or sha is None
+
+    def load(self):
+        "Fetch this tree's entries, unless already loaded."
+        if self.loaded:
+            return
+
+        print('Loading tree for {}'.format(self.name))
+        tree = self.repo.tree(self.sha)
+        summary.count('trees loaded')
+        # resolves a commit sha given for the root to its tree
+        self.sha = tree.sha
+
+        for h in tree.tree or []:
+            if h.type == 'tree':
+                self.directories[h.path] = Directory(h.path, h.sha, self.repo)
+            elif h.type == 'blob':
+                self.files[h.path] = File(h.path, h.mode, h.sha)
+        self.loaded = True
     
     def add_directory(self, name, sha=None):
         """
@@ -142,6 +218,7 @@ class Directory(object):
             reference to the last directory referenced is returned.
         
         """
+        self.load()
         head, tail = split_one(name)
         if head and head not in self.directories:
             self.directories[head] = Directory(head)
@@ -182,6 +259,7 @@ class Directory(object):
         head, tail = os.path.split(name)
         if not head:
             # this file belongs in this directory
+            self.load()
             if mode is None:
                 if tail in self.files:
                     # we're getting an update to an existing file
@@ -190,11 +268,54 @@ class Directory(object):
                     assert mode
                 else:
                     raise ValueError('Adding a new file with no mode.')
+
+            existing = self.files.get(tail)
+            if (content is not None and existing is not None and existing.sha
+                    and existing.mode == mode and existing.sha == git_blob_sha(content)):
+                # same bytes as already in the repo, no need to upload
+                summary.count('blobs unchanged')
+                return
                     
             self.files[tail] = File(name, mode, sha, content)
         else:
             self.add_directory(head).add_file(tail, mode, sha, content)
     
+    def get_file(self, name):
+        """
+        Look up a file by path.
+
+        Parameters
+        ----------
+        name : str
+            Name of file. May contain path components.
+
+        Returns
+        -------
+        `File` or None
+
+        """
+        self.load()
+        head, tail = split_one(name)
+        if not head:
+            return self.files.get(tail)
+        if head not in self.directories:
+            return None
+        return self.directories[head].get_file(tail)
+
+    def settle(self):
+        """
+        Mark this directory and everything below it as matching
+        the repo after a successful push, so the same tree can be
+        reused as the base of the next push.  Drops file contents.
+        """
+        for depth, d in self.walk():
+            for f in d.files.values():
+                f.content = None
+                f.uploaded = False
+            d.changed = False
+            d.built = False
+            d.tree_info = None
+
     def delete_file(self, name):
         """
         Delete a named file.
@@ -209,6 +330,7 @@ class Directory(object):
         
         if not head:
             # should be in this directory
+            self.load()
             del self.files[tail]
             self.changed = True
         else:
@@ -236,12 +358,27 @@ class Directory(object):
             'changed': True if a new tree was posted to GitHub
         
         """
+        if self.built:
+            # already built earlier in this push by an `Uploader`
+            return self.tree_info
+
+        if not self.loaded:
+            # never touched, reuse the existing tree as is
+            self.tree_info = {'path': self.name,
+                              'mode': '040000',
+                              'sha': self.sha,
+                              'type': 'tree',
+                              'changed': False}
+            self.built = True
+            return self.tree_info
+
         tree = [f.create_blob(repo) for f in self.files.values()]
         tree = tree + [d.create_tree(repo) for d in self.directories.values()]
         tree = list(filter(None, tree))
 
         if not tree:
             # nothing left in this directory, it should be discarded
+            self.built = True
             return None
 
         # have any subdirectories or files changed (or been deleted)?
@@ -250,57 +387,543 @@ class Directory(object):
         if changed:
             print('Creating tree for {}'.format(self.name))
             tree = [{k: v for k, v in t.items() if k != 'changed'} for t in tree]
-            self.sha = repo.create_tree(tree).sha
+            with summary.timer('tree upload'):
+                self.sha = repo.create_tree(tree).sha
         else:
             print('Tree unchanged for {}'.format(self.name))
         assert self.sha
-        return {'path': self.name,
-                'mode': '040000',
-                'sha': self.sha,
-                'type': 'tree',
-                'changed': changed}
+        self.tree_info = {'path': self.name,
+                          'mode': '040000',
+                          'sha': self.sha,
+                          'type': 'tree',
+                          'changed': changed}
+        self.built = True
+        return self.tree_info
+
+    def walk(self, depth=0):
+        """
+        Yield `(depth, directory)` for this directory and every
+        directory below it.
+        """
+        yield depth, self
+        for d in self.directories.values():
+            for item in d.walk(depth + 1):
+                yield item
+
+
+def keep_alive(session, workers):
+    """
+    Give `session` a pool of keep-alive connections shared by up to
+    `workers` threads.
+
+    Parameters
+    ----------
+    session : requests.Session
+    workers : int
+
+    """
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, adapter)
+
+
+class Uploader(object):
+    """
+    Posts the blobs and trees of a `Directory` to GitHub concurrently.
+
+    All new blobs are uploaded first through a bounded thread pool.
+    Trees are then built from the deepest directories up, with sibling
+    directories posted in parallel, so every tree is created after the
+    blobs and subtrees it references.  Rate limited and 5xx responses
+    are retried with exponential backoff.
+
+    Parameters
+    ----------
+    repo : github3.repos.repo.Repository
+        Authorized github3.py repository instance.
+    workers : int
+        Maximum number of requests in flight.
+    retries : int
+        Attempts per request before giving up.
+    max_backoff : int
+        Longest single wait between attempts, in seconds.
+
+    """
+    def __init__(self, repo, workers=16, retries=6, max_backoff=120):
+        self.repo = repo
+        self.workers = workers
+        self.retries = retries
+        self.max_backoff = max_backoff
+
+    def retry(self, fn, *args, **kwargs):
+        "Call `fn`, retrying rate limited and server errors with backoff."
+        import github3
+
+        for attempt in range(self.retries):
+            try:
+                return fn(*args, **kwargs)
+            except github3.exceptions.ResponseError as e:
+                wait = self._backoff(e, attempt)
+                if wait is None or attempt == self.retries - 1:
+                    raise
+                logging.warning("GitHub %s, retrying in %.1fs", e.code, wait)
+                summary.count('github retries')
+                time.sleep(wait)
+
+    def _backoff(self, error, attempt):
+        "Seconds to wait before retrying `error`, None if it should not be retried."
+        headers = error.response.headers
+        rate_limited = (
+            error.code == 429
+            or (error.code == 403 and (headers.get('X-RateLimit-Remaining') == '0'
+                                       or 'Retry-After' in headers
+                                       or 'rate limit' in (error.msg or '').lower()))
+        )
+        if not rate_limited and error.code < 500:
+            return None
+
+        if 'Retry-After' in headers:
+            wait = float(headers['Retry-After'])
+        elif headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in headers:
+            wait = float(headers['X-RateLimit-Reset']) - time.time()
+        else:
+            wait = 2 ** attempt
+
+        # jitter so parallel workers don't retry in lock step
+        return min(max(wait, 0) + random.uniform(0, 1), self.max_backoff)
+
+    def _map(self, pool, fn, items):
+        return list(pool.map(lambda item: self.retry(fn, item), items))
+
+    def upload(self, root):
+        """
+        Post every changed blob and tree below `root`.
+
+        Returns
+        -------
+        tree_info : dict
+            Same as `Directory.create_tree`.
+
+        """
+        levels = dict()
+        for depth, d in root.walk():
+            levels.setdefault(depth, []).append(d)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            new = [f for dirs in levels.values() for d in dirs for f in d.files.values() if not f.sha]
+            self._map(pool, lambda f: f.create_blob(self.repo), new)
+
+            for depth in sorted(levels, reverse=True):
+                self._map(pool, lambda d: d.create_tree(self.repo), levels[depth])
+
+        return root.create_tree(self.repo)
 
 
 class Github():
-    def __init__(self, token, org, repository, branch):
+    """
+    Writer backend that builds commits through the GitHub git data API.
+
+    The branch head is fetched once, on first use, and kept as a lazily
+    loaded `Directory`.  Each successful push advances that base
+    so later pushes in the same run don't download the tree again.
+
+    """
+    def __init__(self, token, org, repository, branch, workers=16):
+        # imported here so runs using the git writer don't pay for it
+        import github3
+
         self.github = github3.login(token=token)
+        # mounted once, so the connections are reused across pushes
+        keep_alive(self.github.session, workers)
         self.org = org
         self.repository = repository
         self.branch = branch
-    
-    def push(self, configs):
-        repo = self.github.repository(self.org, self.repository)
-        sha = repo.branch("master").commit.sha
-        tree = repo.tree(sha, recursive=True)
+        self.workers = workers
+        self.repo = None
+        self.head = None
+        self.root = None
+
+    def load(self):
+        "Fetch the branch head and its tree, unless already loaded."
+        if self.root is not None:
+            return
 
-        for t in tree.tree:
-            print(t.path, t.mode, t.type)
+        self.repo = self.github.repository(self.org, self.repository)
+        self.head = self.repo.branch(self.branch).commit.sha
 
-        trees = [h for h in tree.tree if h.type == 'tree']
-        blobs = [h for h in tree.tree if h.type == 'blob']
+        # subtrees are fetched only for the paths being written
+        self.root = Directory('', self.head, self.repo)
 
-        root = Directory('', sha)
+    def blob_sha(self, path):
+        "Sha of `path` on the branch head, None if it doesn't exist."
+        self.load()
+        f = self.root.get_file(path)
+        return f.sha if f else None
 
-        for h in trees:
-            root.add_directory(h.path, h.sha)
+    def push(self, configs, message=None):
+        import github3
 
-        for h in blobs:
-            root.add_file(h.path, h.mode, h.sha)
+        self.load()
+        root = self.root
 
         for config in configs:
             root.add_file(config["path"], config["mode"], content=config["content"])
 
-        root_info = root.create_tree(repo)
+        try:
+            uploader = Uploader(self.repo, workers=self.workers)
+            root_info = uploader.upload(root)
 
-        new_commit = repo.create_commit(
-            "{} - Config Updates Commit".format(datetime.now().strftime("%m/%d/%Y %H:%M:%S")),
-            tree=root_info["sha"],
-            parents=[sha])
+            if not root_info['changed']:
+                print("No config changes, nothing to push")
+                root.settle()
+                return True
 
-        ref = repo.ref('heads/{}'.format("master"))
-        result = ref.update(new_commit.sha)
+            with summary.timer('commit'):
+                new_commit = uploader.retry(
+                    self.repo.create_commit,
+                    message or default_message(),
+                    tree=root_info["sha"],
+                    parents=[self.head])
+
+            with summary.timer('ref update'):
+                ref = self.repo.ref('heads/{}'.format(self.branch))
+                result = uploader.retry(ref.update, new_commit.sha)
+        except github3.exceptions.GitHubError as e:
+            logging.error(e)
+            result = False
 
         if result:
             print("Push to Github Successful!")
+            self.head = new_commit.sha
+            root.settle()
         else:
-            print("Push to Github Failed!")
\ No newline at end of file
+            print("Push to Github Failed!")
+            # the half built tree can't be trusted, fetch it again next time
+            self.root = None
+
+        return result
+
+
+class GitError(Exception):
+    "Error raised when a git command run by `LocalGit` fails."
+    pass
+
+
+class LocalGit(object):
+    """
+    Writer backend that keeps a persistent local clone of the configs
+    repo and pushes with plain git.
+
+    `Github.push` builds a commit one REST call per blob and tree.  Here
+    the configs are written to the working copy, committed once and
+    pushed, so any number of changed files go out as a single packfile.
+
+    Parameters
+    ----------
+    url : str
+        Remote to clone and push to.  Anything git understands, including
+        a path to a local bare repo.
+    branch : str
+    path : str
+        Directory of the local clone.  Cloned on first push, reused after.
+    token : str
+        GitHub token sent as HTTP basic auth on fetch and push.  It is
+        passed per command through the environment, so it is neither
+        written to the clone's config nor visible on the command line.
+
+    """
+    def __init__(self, url, branch, path=DEFAULT_CLONE_DIR, token=None):
+        self.url = url
+        self.branch = branch
+        self.path = path
+        self.auth = None
+        if token:
+            basic = base64.b64encode('x-access-token:{}'.format(token).encode('utf-8')).decode('ascii')
+            self.auth = ('http.extraHeader', 'Authorization: basic {}'.format(basic))
+        self.blobs = None
+
+    def git(self, *args, remote=False, check=True):
+        """
+        Run a git command in the clone.
+
+        Parameters
+        ----------
+        args : str
+            git arguments, e.g. 'add', '--', 'usden1/r1.cfg'.
+        remote : bool
+            Command talks to the remote, send the auth header.
+        check : bool
+            Raise `GitError` on a non zero exit.
+
+        Returns
+        -------
+        subprocess.CompletedProcess
+
+        """
+        cmd = ['git', '-C', self.path] + list(args)
+        env = None
+        if remote and self.auth:
+            # config from the environment, unlike `-c`, doesn't show up in ps
+            env = dict(os.environ)
+            n = int(env.get('GIT_CONFIG_COUNT', 0))
+            env['GIT_CONFIG_COUNT'] = str(n + 1)
+            env['GIT_CONFIG_KEY_{}'.format(n)], env['GIT_CONFIG_VALUE_{}'.format(n)] = self.auth
+        # identity options come before the subcommand
+        name = next(a for a in args if not a.startswith('-') and '=' not in a)
+        with summary.timer('git {}'.format(name)):
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                                  env=env)
+        if check and proc.returncode != 0:
+            raise GitError('git {} failed: {}'.format(name, proc.stderr.strip()))
+        return proc
+
+    def sync(self):
+        "Clone the remote if needed and reset the working copy to the remote branch."
+        if not os.path.isdir(os.path.join(self.path, '.git')):
+            os.makedirs(self.path, exist_ok=True)
+            self.git('init', '-q')
+            self.git('remote', 'add', 'origin', self.url)
+
+        self.git('fetch', '-q', '--prune', 'origin', remote=True)
+
+        remote_branch = 'refs/remotes/origin/{}'.format(self.branch)
+        if self.git('rev-parse', '-q', '--verify', remote_branch, check=False).returncode == 0:
+            self.git('checkout', '-q', '-B', self.branch, remote_branch)
+            self.git('reset', '-q', '--hard', remote_branch)
+        else:
+            # empty remote, the first push creates the branch
+            self.git('checkout', '-q', '--orphan', self.branch)
+            self.git('rm', '-q', '-r', '--cached', '--ignore-unmatch', '.')
+
+        self.git('clean', '-q', '-f', '-d')
+
+    def blob_sha(self, path):
+        "Sha of `path` on the remote branch, None if it doesn't exist."
+        if self.blobs is None:
+            self.sync()
+            listing = self.git('ls-files', '-s').stdout.splitlines()
+            self.blobs = dict()
+            for line in listing:
+                info, name = line.split('\t', 1)
+                self.blobs[name] = info.split()[1]
+
+        return self.blobs.get(path)
+
+    def push(self, configs, message=None):
+        """
+        Parameters
+        ----------
+        configs : list of dict
+            Each with 'path' (e.g. 'usden1/r1.cfg'), 'content' and 'mode',
+            same as for `Github.push`.
+        message : str
+            Commit message, `default_message()` if None.
+
+        Returns
+        -------
+        bool
+            True if the configs are on the remote branch.
+
+        """
+        try:
+            self.sync()
+
+            paths = []
+            for config in configs:
+                path = os.path.join(self.path, config['path'])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if isinstance(config['content'], SpooledConfig):
+                    config['content'].copy_to(path)
+                else:
+                    with open(path, 'w', encoding='utf-8', newline='') as f:
+                        f.write(config['content'])
+                os.chmod(path, 0o755 if config['mode'] == '100755' else 0o644)
+                paths.append(config['path'])
+
+            for i in range(0, len(paths), 1000):
+                self.git('add', '--', *paths[i:i + 1000])
+
+            changed = self.git('diff', '--cached', '--name-only').stdout.split()
+            if not changed:
+                print("No config changes, nothing to push")
+                return True
+
+            summary.count('configs committed', len(changed))
+
+            # commit as ncc unless the clone or user has an identity set
+            identity = []
+            if self.git('config', 'user.email', check=False).returncode != 0:
+                identity = ['-c', 'user.name=ncc', '-c', 'user.email=ncc@localhost']
+
+            self.git(*identity, 'commit', '-q', '-m', message or default_message())
+            self.git('push', '-q', 'origin', 'HEAD:refs/heads/{}'.format(self.branch), remote=True)
+        except GitError as e:
+            logging.error(e)
+            self.blobs = None
+            print("Push to {} Failed!".format(self.url))
+            return False
+
+        if self.blobs is not None:
+            for config in configs:
+                self.blobs[config['path']] = git_blob_sha(config['content'])
+
+        print("Push to {} Successful!".format(self.url))
+        return True
+
+
+def default_message():
+    "Commit message when there is no summary of the changes."
+    return "{} - Config Updates Commit".format(datetime.now().strftime("%m/%d/%Y %H:%M:%S"))
+
+
+def host_configs(site, hosts):
+    """
+    Configs and change markers collected on nornir `hosts`.
+
+    Parameters
+    ----------
+    site : str
+        Site slug, the directory of the configs.
+    hosts : dict
+        Maps hostname to `nornir.core.inventory.Host`.
+
+    Returns
+    -------
+    configs : list of dict
+        Same as for `Github.push`, plus the host's 'platform'.
+    markers : dict
+        Maps hostname to its change marker.
+
+    """
+    configs = list()
+    markers = dict()
+
+    for hostname, host in hosts.items():
+        if host.get('configs'):
+            configs.append({
+                'path': os.path.join(site, hostname + '.cfg'),
+                'content': host.get('configs'),
+                'mode': '100644',
+                'platform': host.platform,
+            })
+
+        if host.get('marker'):
+            markers[hostname] = host.get('marker')
+
+    return configs, markers
+
+
+class Accumulator(object):
+    """
+    Write stage that gathers configs from every site and publishes
+    them as a single commit.
+
+    Only configs that differ from the branch head are held, so memory
+    grows with the number of changes rather than the size of the fleet.
+    Change markers are saved to `state` only after the configs they
+    describe have been pushed.
+
+    With a `differ`, every changed config is diffed against the version
+    pushed last as it is added, and the commit lists the changed
+    devices and config sections.
+
+    Parameters
+    ----------
+    writer : `Github` or `LocalGit`
+    state : `ncc.state.StateStore`
+        Where to save device change markers, None to not save them.
+    flush_each_site : bool
+        Push after every `add` instead of once at the end of the run.
+    differ : `ncc.diff.DiffStage`
+        None to push without diffs and with `default_message()`.
+    archive : `ncc.archive.Archive`
+        Where every config added is also recorded, changed or not.
+    index : `ncc.search.SearchIndex`
+        Kept up to date with every config added, saved on `flush`.
+
+    """
+    def __init__(self, writer, state=None, flush_each_site=False, differ=None, archive=None, index=None):
+        self.writer = writer
+        self.state = state
+        self.flush_each_site = flush_each_site
+        self.differ = differ
+        self.archive = archive
+        self.index = index
+        self.pending = dict()
+        self.markers = dict()
+        self._lock = threading.Lock()
+
+    def add(self, configs, markers=None):
+        """
+        Parameters
+        ----------
+        configs : list of dict
+            Same as for `Github.push`.
+        markers : dict
+            Maps hostname to its change marker.
+
+        """
+        now = time.time()
+        with self._lock:
+            for config in configs:
+                if self.archive is not None:
+                    self.archive.store_config(config, now)
+                if self.index is not None:
+                    self.index.update_config(config)
+                if self.writer.blob_sha(config['path']) == git_blob_sha(config['content']):
+                    summary.count('configs unchanged')
+                    if self.differ is not None:
+                        self.differ.seed(config)
+                    spool.discard(config['content'])
+                    continue
+                if self.differ is not None:
+                    config['change'] = self.differ.diff(config)
+                replaced = self.pending.get(config['path'])
+                if replaced is not None:
+                    spool.discard(replaced['content'])
+                self.pending[config['path']] = config
+            self.markers.update(markers or {})
+
+        if self.flush_each_site:
+            self.flush()
+
+    def flush(self):
+        """
+        Push the pending configs in one commit and save the markers
+        and the search index.
+
+        Returns
+        -------
+        bool
+            False if the push failed.  The configs stay pending and the
+            markers unsaved, so the devices are fetched again next run.
+
+        """
+        with self._lock:
+            # searchable whether or not the push goes through
+            if self.index is not None:
+                self.index.save()
+
+            if self.pending:
+                configs = list(self.pending.values())
+                message = None
+                if self.differ is not None:
+                    message = commit_message([c['change'] for c in configs])
+                with summary.timer('push'):
+                    pushed = self.writer.push(configs, message)
+                if not pushed:
+                    return False
+                if self.differ is not None:
+                    self.differ.commit(configs)
+                for config in configs:
+                    spool.discard(config['content'])
+                self.pending.clear()
+
+            if self.state is not None and self.markers:
+                self.state.update(self.markers)
+                self.state.save()
+            self.markers.clear()
+
+        return True